@@ -15,7 +15,10 @@
 
 
 import argparse
+import inspect
+import math
 import os
+import re
 import sys
 import logging
 import json
@@ -30,6 +33,9 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, "..")))
 
 SERVING_SPEC_FILEPATH = 'build/serving_resources_spec.json'
 
+# Vertex AI scales replicas out above 60% CPU utilization by default.
+DEFAULT_TARGET_UTILIZATION = 0.6
+
 def get_args():
     parser = argparse.ArgumentParser()
 
@@ -68,6 +74,45 @@ def get_args():
         type=str,
     )
 
+    parser.add_argument(
+        '--benchmark-files',
+        type=str,
+        help='Comma separated load_generator reports of single replicas.',
+    )
+
+    parser.add_argument(
+        '--target-qps',
+        type=float,
+    )
+
+    parser.add_argument(
+        '--peak-qps',
+        type=float,
+    )
+
+    parser.add_argument(
+        '--p99-slo-ms',
+        type=float,
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        default=1,
+        type=int,
+    )
+
+    parser.add_argument(
+        '--max-error-rate',
+        default=0.001,
+        type=float,
+    )
+
+    parser.add_argument(
+        '--target-utilization',
+        default=DEFAULT_TARGET_UTILIZATION,
+        type=float,
+    )
+
     return parser.parse_args()
 
 
@@ -109,12 +154,154 @@ def deploy_model(project, region, endpoint_display_name, model_display_name, ser
         order_by="update_time"
     )[-1]
 
-    deployed_model = endpoint.deploy(model=model, **serving_resources_spec)
+    deployed_model = endpoint.deploy(
+        model=model, **_get_deploy_args(serving_resources_spec)
+    )
     logging.info(f"Model is deployed.")
     logging.info(deployed_model)
     return deployed_model
 
 
+def _get_deploy_args(serving_resources_spec):
+    """Returns the entries of the spec that Endpoint.deploy accepts.
+
+    Sizing details, and autoscaling settings the installed SDK does not
+    support yet, are logged and skipped.
+    """
+    parameters = inspect.signature(vertex_ai.Endpoint.deploy).parameters
+    deploy_args = {}
+    for key, value in serving_resources_spec.items():
+        if key in parameters:
+            deploy_args[key] = value
+        else:
+            logging.info(f"Not passing {key}={value} to Endpoint.deploy.")
+    return deploy_args
+
+
+def _vcpus(machine_type):
+    match = re.search(r"-(\d+)$", machine_type)
+    return int(match.group(1)) if match else 1
+
+
+def _replica_capacity(reports, batch_size, p99_slo_ms, max_error_rate):
+    """Returns the requests per second a replica serves within the SLO."""
+    capacities = [
+        report['requests_per_second']
+        for report in reports
+        if report['batch_size'] == batch_size
+        and report['p99_latency_ms'] <= p99_slo_ms
+        and report['error_rate'] <= max_error_rate
+    ]
+    return max(capacities, default=0)
+
+
+def recommend_serving_resources(
+    reports,
+    target_qps,
+    p99_slo_ms,
+    peak_qps=None,
+    batch_size=1,
+    max_error_rate=0.001,
+    target_utilization=DEFAULT_TARGET_UTILIZATION,
+    base_spec=None,
+):
+    """Returns the serving resources spec that meets the SLO at the lowest cost.
+
+    Args:
+      reports: load_generator reports measured on single replicas, at several
+        concurrencies or QPS, each labeled with its machine_type.
+      target_qps: the steady request rate, served by the minimum replicas at
+        target_utilization.
+      p99_slo_ms: the p99 latency objective.
+      peak_qps: the peak request rate, served by the maximum replicas at full
+        capacity. Defaults to twice target_qps.
+      batch_size: the number of instances per request in production.
+      max_error_rate: the error rate above which a measurement is discarded.
+      target_utilization: the replica utilization at which Vertex AI scales out.
+      base_spec: the spec to update, e.g. the current serving_resources_spec.json.
+    """
+    peak_qps = peak_qps or 2 * target_qps
+    reports_by_machine_type = {}
+    for report in reports:
+        if 'machine_type' not in report:
+            raise ValueError(
+                "Every report needs a machine_type label, set by the "
+                f"--machine-type flag of the load generator: {report}"
+            )
+        reports_by_machine_type.setdefault(report['machine_type'], []).append(report)
+
+    candidates = []
+    for machine_type, machine_reports in reports_by_machine_type.items():
+        capacity = _replica_capacity(
+            machine_reports, batch_size, p99_slo_ms, max_error_rate
+        )
+        if not capacity:
+            logging.info(f"{machine_type} does not meet the SLO: skipped.")
+            continue
+        min_replica_count = max(
+            1, math.ceil(target_qps / (capacity * target_utilization))
+        )
+        max_replica_count = max(min_replica_count, math.ceil(peak_qps / capacity))
+        candidates.append(
+            {
+                'machine_type': machine_type,
+                'min_replica_count': min_replica_count,
+                'max_replica_count': max_replica_count,
+                'replica_capacity_qps': capacity,
+            }
+        )
+    if not candidates:
+        raise ValueError(
+            f"No benchmarked machine type meets the p99 SLO of {p99_slo_ms} ms "
+            f"at batch size {batch_size}."
+        )
+
+    # The vCPUs of the minimum replicas stand for the serving cost.
+    best = min(
+        candidates,
+        key=lambda candidate: (
+            _vcpus(candidate['machine_type']) * candidate['min_replica_count']
+        ),
+    )
+    spec = dict(base_spec or {})
+    spec.update(
+        {
+            'machine_type': best['machine_type'],
+            'min_replica_count': best['min_replica_count'],
+            'max_replica_count': best['max_replica_count'],
+            'accelerator_type': None,
+            'accelerator_count': None,
+            'autoscaling_target_cpu_utilization': int(target_utilization * 100),
+            'sizing': {
+                'target_qps': target_qps,
+                'peak_qps': peak_qps,
+                'p99_slo_ms': p99_slo_ms,
+                'batch_size': batch_size,
+                'replica_capacity_qps': best['replica_capacity_qps'],
+            },
+        }
+    )
+    return spec
+
+
+def size_serving_resources(benchmark_files, **kwargs):
+    """Writes the spec recommended from benchmark reports to SERVING_SPEC_FILEPATH."""
+    reports = []
+    for benchmark_file in benchmark_files:
+        with open(benchmark_file) as json_file:
+            reports.extend(json.load(json_file))
+
+    base_spec = {}
+    if os.path.exists(SERVING_SPEC_FILEPATH):
+        with open(SERVING_SPEC_FILEPATH) as json_file:
+            base_spec = json.load(json_file)
+
+    spec = recommend_serving_resources(reports, base_spec=base_spec, **kwargs)
+    with open(SERVING_SPEC_FILEPATH, 'w') as json_file:
+        json.dump(spec, json_file, indent=4)
+    return spec
+
+
 def compile_pipeline(pipeline_name):
     from src.tfx_pipelines import runner
     pipeline_definition_file = f"{pipeline_name}.json"
@@ -161,6 +348,24 @@ def main():
             serving_resources_spec
         )
         
+    elif args.mode == 'size-serving-resources':
+        if not args.benchmark_files:
+            raise ValueError("benchmark-files must be supplied.")
+        if not args.target_qps:
+            raise ValueError("target-qps must be supplied.")
+        if not args.p99_slo_ms:
+            raise ValueError("p99-slo-ms must be supplied.")
+
+        result = size_serving_resources(
+            args.benchmark_files.split(','),
+            target_qps=args.target_qps,
+            p99_slo_ms=args.p99_slo_ms,
+            peak_qps=args.peak_qps,
+            batch_size=args.batch_size,
+            max_error_rate=args.max_error_rate,
+            target_utilization=args.target_utilization,
+        )
+
     elif args.mode == 'compile-pipeline':
         if not args.pipeline_name:
             raise ValueError("pipeline-name must be supplied.")
@@ -0,0 +1,98 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare epoch wall time and on-disk size of the transformed data codecs.
+
+    python -m src.benchmarks.compression_benchmark --num-examples=200000
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import tensorflow as tf
+
+from src.benchmarks import synthetic_data
+from src.common import data_manifest
+from src.model_training import data
+
+
+def run_benchmark(data_root, num_files, num_examples, batch_size, num_epochs):
+    results = []
+    for compression_type in data_manifest.COMPRESSION_TYPES:
+        data_dir = os.path.join(data_root, compression_type)
+        file_paths = synthetic_data.write_tfrecords(
+            data_dir,
+            num_files=num_files,
+            examples_per_file=num_examples // num_files,
+            compression_type=compression_type,
+        )
+        data_size = sum(tf.io.gfile.stat(path).length for path in file_paths)
+
+        # The reader codec is picked up from the data manifest.
+        dataset = data.get_dataset(
+            os.path.join(data_dir, "data-*"),
+            synthetic_data.transformed_feature_spec(),
+            batch_size=batch_size,
+        )
+
+        epoch_times = []
+        for _ in range(num_epochs):
+            start = time.perf_counter()
+            for _ in dataset:
+                pass
+            epoch_times.append(time.perf_counter() - start)
+
+        result = {
+            "compression_type": compression_type,
+            "data_size_mb": data_size / 1e6,
+            "epoch_seconds": min(epoch_times),
+        }
+        logging.info(result)
+        results.append(result)
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", type=str)
+    parser.add_argument("--num-files", default=8, type=int)
+    parser.add_argument("--num-examples", default=200000, type=int)
+    parser.add_argument("--batch-size", default=512, type=int)
+    parser.add_argument("--num-epochs", default=3, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    results = run_benchmark(
+        data_root=args.data_dir or tempfile.mkdtemp(),
+        num_files=args.num_files,
+        num_examples=args.num_examples,
+        batch_size=args.batch_size,
+        num_epochs=args.num_epochs,
+    )
+
+    print(f"{'codec':>6} {'size MB':>10} {'epoch s':>10}")
+    for r in results:
+        print(
+            f"{r['compression_type']:>6} {r['data_size_mb']:>10.2f} "
+            f"{r['epoch_seconds']:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,102 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare CPU and wall time per epoch of the TFRecord and Parquet formats.
+
+    python -m src.benchmarks.data_format_benchmark --num-examples=200000
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from src.benchmarks import synthetic_data
+from src.model_training import data
+
+
+def run_benchmark(data_root, num_files, num_examples, batch_size, num_epochs):
+    writers = {
+        "tfrecord-GZIP": lambda data_dir: synthetic_data.write_tfrecords(
+            data_dir, num_files, num_examples // num_files, "GZIP"
+        ),
+        "tfrecord-NONE": lambda data_dir: synthetic_data.write_tfrecords(
+            data_dir, num_files, num_examples // num_files, "NONE"
+        ),
+        "parquet-SNAPPY": lambda data_dir: synthetic_data.write_parquet(
+            data_dir, num_files, num_examples // num_files, "SNAPPY"
+        ),
+    }
+
+    results = []
+    for name, write_fn in writers.items():
+        data_dir = os.path.join(data_root, name)
+        write_fn(data_dir)
+
+        # The reader is picked up from the data manifest.
+        dataset = data.get_dataset(
+            os.path.join(data_dir, "data-*"),
+            synthetic_data.transformed_feature_spec(),
+            batch_size=batch_size,
+        )
+
+        wall_times, cpu_times = [], []
+        for _ in range(num_epochs):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            for _ in dataset:
+                pass
+            wall_times.append(time.perf_counter() - wall_start)
+            cpu_times.append(time.process_time() - cpu_start)
+
+        result = {
+            "data": name,
+            "epoch_seconds": min(wall_times),
+            "epoch_cpu_seconds": min(cpu_times),
+        }
+        logging.info(result)
+        results.append(result)
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", type=str)
+    parser.add_argument("--num-files", default=8, type=int)
+    parser.add_argument("--num-examples", default=200000, type=int)
+    parser.add_argument("--batch-size", default=512, type=int)
+    parser.add_argument("--num-epochs", default=3, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    results = run_benchmark(
+        data_root=args.data_dir or tempfile.mkdtemp(),
+        num_files=args.num_files,
+        num_examples=args.num_examples,
+        batch_size=args.batch_size,
+        num_epochs=args.num_epochs,
+    )
+
+    print(f"{'data':>16} {'epoch s':>10} {'epoch cpu s':>12}")
+    for r in results:
+        print(
+            f"{r['data']:>16} {r['epoch_seconds']:>10.3f} "
+            f"{r['epoch_cpu_seconds']:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,215 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure multi-worker training scaling with workers on localhost.
+
+Each worker is a separate process, configured through TF_CONFIG as on Vertex
+AI, and limited to an equal share of the host CPUs:
+
+    python -m src.benchmarks.distribution_benchmark --num-workers=2
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import tensorflow as tf
+
+from src.benchmarks import synthetic_data
+from src.common import features
+from src.model_training import data, defaults, distribution, model, trainer
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def _run_worker(args):
+    """Trains on synthetic data and writes the chief's throughput to a file."""
+    tf.config.threading.set_intra_op_parallelism_threads(args.num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(args.num_threads)
+
+    strategy = distribution.get_strategy(args.strategy)
+    hyperparams = defaults.update_hyperparams({"batch_size": args.batch_size})
+    global_batch_size = args.batch_size * strategy.num_replicas_in_sync
+
+    def dataset_fn(input_context):
+        return data.get_dataset(
+            os.path.join(args.data_dir, "data-*"),
+            synthetic_data.transformed_feature_spec(),
+            global_batch_size,
+            num_epochs=None,
+            input_context=input_context,
+        )
+
+    dataset = distribution.distribute_dataset(strategy, dataset_fn)
+    feature_vocab_sizes = {
+        feature_name: synthetic_data.VOCAB_SIZE
+        for feature_name in features.categorical_feature_names()
+    }
+    with strategy.scope():
+        classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+        trainer._compile(classifier, hyperparams)
+
+    # The first epoch traces the model and fills the input pipeline.
+    classifier.fit(dataset, epochs=1, steps_per_epoch=args.warmup_steps, verbose=0)
+    start = time.perf_counter()
+    classifier.fit(dataset, epochs=1, steps_per_epoch=args.num_steps, verbose=0)
+    elapsed = time.perf_counter() - start
+
+    if distribution.is_chief():
+        with open(args.output_file, "w") as f:
+            json.dump(
+                {
+                    "num_replicas": strategy.num_replicas_in_sync,
+                    "examples_per_sec": global_batch_size * args.num_steps / elapsed,
+                },
+                f,
+            )
+
+
+def run_local_cluster(
+    data_dir,
+    num_workers,
+    batch_size=512,
+    num_steps=200,
+    warmup_steps=20,
+    num_threads=None,
+):
+    """Trains with num_workers local processes and returns the chief's result."""
+    num_threads = num_threads or max(1, os.cpu_count() // num_workers)
+    output_file = os.path.join(
+        tempfile.mkdtemp(), f"distribution_benchmark_{num_workers}.json"
+    )
+    workers = [f"localhost:{_free_port()}" for _ in range(num_workers)]
+    strategy = (
+        distribution.MULTI_WORKER_MIRRORED_STRATEGY
+        if num_workers > 1
+        else distribution.NO_STRATEGY
+    )
+
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env.pop("TF_CONFIG", None)
+        if num_workers > 1:
+            env["TF_CONFIG"] = json.dumps(
+                {
+                    "cluster": {"worker": workers},
+                    "task": {"type": "worker", "index": index},
+                }
+            )
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "src.benchmarks.distribution_benchmark",
+                    "--worker",
+                    f"--data-dir={data_dir}",
+                    f"--strategy={strategy}",
+                    f"--batch-size={batch_size}",
+                    f"--num-steps={num_steps}",
+                    f"--warmup-steps={warmup_steps}",
+                    f"--num-threads={num_threads}",
+                    f"--output-file={output_file}",
+                ],
+                env=env,
+            )
+        )
+
+    for index, process in enumerate(processes):
+        if process.wait() != 0:
+            raise RuntimeError(f"Worker {index} failed with code {process.returncode}.")
+
+    with open(output_file) as f:
+        return json.load(f)
+
+
+def measure_scaling_efficiency(data_dir, num_workers=2, **kwargs):
+    """Compares the throughput of num_workers workers with a single worker.
+
+    Every run gives each worker the same share of CPU threads, so the single
+    worker stands in for one of the multi-worker hosts. A scaling efficiency of
+    1.0 means num_workers workers train num_workers times faster.
+    """
+    num_threads = max(1, os.cpu_count() // num_workers)
+    single_worker = run_local_cluster(
+        data_dir, num_workers=1, num_threads=num_threads, **kwargs
+    )
+    multi_worker = run_local_cluster(
+        data_dir, num_workers=num_workers, num_threads=num_threads, **kwargs
+    )
+    scaling_efficiency = multi_worker["examples_per_sec"] / (
+        num_workers * single_worker["examples_per_sec"]
+    )
+    logging.info(
+        f"1 worker: {single_worker['examples_per_sec']:,.0f} examples/sec, "
+        f"{num_workers} workers: {multi_worker['examples_per_sec']:,.0f} examples/sec, "
+        f"scaling efficiency: {scaling_efficiency:.2f}"
+    )
+    return {
+        "single_worker_examples_per_sec": single_worker["examples_per_sec"],
+        "multi_worker_examples_per_sec": multi_worker["examples_per_sec"],
+        "num_replicas": multi_worker["num_replicas"],
+        "scaling_efficiency": scaling_efficiency,
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker", action="store_true")
+    parser.add_argument("--data-dir", type=str)
+    parser.add_argument("--num-workers", default=2, type=int)
+    parser.add_argument("--num-files", default=4, type=int)
+    parser.add_argument("--examples-per-file", default=20000, type=int)
+    parser.add_argument("--strategy", default=distribution.NO_STRATEGY, type=str)
+    parser.add_argument("--batch-size", default=512, type=int)
+    parser.add_argument("--num-steps", default=200, type=int)
+    parser.add_argument("--warmup-steps", default=20, type=int)
+    parser.add_argument("--num-threads", default=1, type=int)
+    parser.add_argument("--output-file", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.worker:
+        _run_worker(args)
+        return
+
+    data_dir = args.data_dir or tempfile.mkdtemp()
+    if not tf.io.gfile.glob(os.path.join(data_dir, "data-*")):
+        synthetic_data.write_tfrecords(
+            data_dir, num_files=args.num_files, examples_per_file=args.examples_per_file
+        )
+    measure_scaling_efficiency(
+        data_dir,
+        num_workers=args.num_workers,
+        batch_size=args.batch_size,
+        num_steps=args.num_steps,
+        warmup_steps=args.warmup_steps,
+    )
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,130 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the loc_cross embedding modes on model size and serving latency.
+
+    python -m src.benchmarks.embedding_benchmark --vocab-size=1000000
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from src.benchmarks import synthetic_data
+from src.benchmarks.vocabulary_benchmark import dir_size, override_embedding_config
+from src.common import features
+from src.model_training import defaults, model
+
+FEATURE_NAME = "loc_cross"
+MODES = {
+    features.DENSE_EMBEDDING: {},
+    features.HASH_EMBEDDING: {"num_buckets": 10000},
+    features.QUOTIENT_REMAINDER_EMBEDDING: {"num_buckets": 1000},
+    features.MIXED_DIMENSION_EMBEDDING: {"head_size": 10000, "tail_embedding_size": 2},
+}
+
+
+def _get_inputs(batch_size, vocab_size, seed=0):
+    columns = synthetic_data.generate_columns(batch_size, seed=seed)
+    columns.pop(features.TARGET_FEATURE_NAME)
+    rng = np.random.default_rng(seed)
+    columns[features.transformed_name(FEATURE_NAME)] = rng.integers(
+        0, vocab_size, batch_size
+    )
+    return {name: tf.constant(values) for name, values in columns.items()}
+
+
+def _serving_latency_ms(serving_fn, inputs, num_requests):
+    for _ in range(10):
+        serving_fn(**inputs)
+    latencies = []
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        serving_fn(**inputs)
+        latencies.append(time.perf_counter() - start)
+    return float(np.percentile(np.array(latencies) * 1000, 50))
+
+
+def run_benchmark(
+    embedding_mode, mode_config, vocab_size, output_dir, batch_size=64, num_requests=200
+):
+    """Returns the parameters, SavedModel size, and p50 latency of a mode."""
+    hyperparams = defaults.update_hyperparams({})
+    feature_vocab_sizes = {
+        feature_name: synthetic_data.VOCAB_SIZE
+        for feature_name in features.categorical_feature_names()
+    }
+    feature_vocab_sizes[FEATURE_NAME] = vocab_size
+
+    config = dict(features.EMBEDDING_CATEGORICAL_FEATURES)
+    config[FEATURE_NAME] = dict(
+        config[FEATURE_NAME], embedding_mode=embedding_mode, **mode_config
+    )
+    with override_embedding_config(config):
+        classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+
+    saved_model_dir = os.path.join(output_dir, embedding_mode)
+    classifier.save(saved_model_dir)
+    serving_fn = tf.saved_model.load(saved_model_dir).signatures["serving_default"]
+
+    return {
+        "model_params": classifier.count_params(),
+        "saved_model_bytes": dir_size(saved_model_dir),
+        "p50_latency_ms": _serving_latency_ms(
+            serving_fn, _get_inputs(batch_size, vocab_size), num_requests
+        ),
+    }
+
+
+def run_sweep(vocab_size, output_dir, batch_size=64, num_requests=200, modes=None):
+    results = {}
+    for embedding_mode, mode_config in (modes or MODES).items():
+        results[embedding_mode] = run_benchmark(
+            embedding_mode, mode_config, vocab_size, output_dir, batch_size, num_requests
+        )
+    for embedding_mode, result in results.items():
+        logging.info(
+            f"{embedding_mode}: {result['model_params']:,} parameters, "
+            f"SavedModel {result['saved_model_bytes'] / 2 ** 20:.1f} MiB, "
+            f"p50 latency {result['p50_latency_ms']:.2f} ms"
+        )
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vocab-size", default=1000000, type=int)
+    parser.add_argument("--batch-size", default=64, type=int)
+    parser.add_argument("--num-requests", default=200, type=int)
+    parser.add_argument("--output-dir", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    run_sweep(
+        args.vocab_size,
+        args.output_dir or tempfile.mkdtemp(),
+        args.batch_size,
+        args.num_requests,
+    )
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
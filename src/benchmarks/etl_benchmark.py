@@ -0,0 +1,99 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare per-element and batched parse/convert stages on the DirectRunner.
+
+    python -m src.benchmarks.etl_benchmark --num-rows=100000
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import apache_beam as beam
+import tensorflow_data_validation as tfdv
+from tensorflow_transform.tf_metadata import schema_utils
+
+from src.benchmarks import synthetic_data
+from src.preprocessing import etl
+
+RAW_SCHEMA_LOCATION = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "raw_schema/schema.pbtxt"
+)
+
+
+def _parse_stage(batched, arrow_schema):
+    if batched:
+        return (
+            beam.BatchElements(max_batch_size=etl.SPLIT_BATCH_SIZE)
+            | beam.Map(etl.parse_bq_records, arrow_schema)
+        )
+    return beam.Map(etl.parse_bq_record)
+
+
+def _convert_stage(batched):
+    if batched:
+        return beam.BatchElements() | beam.Map(etl.convert_to_jsonl_block)
+    return beam.Map(etl.convert_to_jsonl)
+
+
+def _time_pipeline(rows, stage, output_prefix=None):
+    start = time.perf_counter()
+    with beam.Pipeline(runner="DirectRunner") as pipeline:
+        outputs = pipeline | "Create" >> beam.Create(rows) | "Stage" >> stage
+        if output_prefix:
+            _ = outputs | "Write" >> beam.io.WriteToText(
+                output_prefix, file_name_suffix=".jsonl"
+            )
+        else:
+            _ = outputs | "Count" >> beam.combiners.Count.Globally()
+    return time.perf_counter() - start
+
+
+def run_benchmark(rows, output_dir):
+    raw_schema = tfdv.load_schema_text(RAW_SCHEMA_LOCATION)
+    raw_feature_spec = schema_utils.schema_as_feature_spec(raw_schema).feature_spec
+    arrow_schema = etl.get_raw_arrow_schema(raw_feature_spec)
+
+    results = {}
+    for batched in [False, True]:
+        mode = "batched" if batched else "per-element"
+        results[f"parse {mode}"] = len(rows) / _time_pipeline(
+            rows, _parse_stage(batched, arrow_schema)
+        )
+        results[f"convert {mode}"] = len(rows) / _time_pipeline(
+            rows, _convert_stage(batched), os.path.join(output_dir, mode, "data")
+        )
+    for name, rows_per_sec in results.items():
+        logging.info(f"{name}: {rows_per_sec:,.0f} rows/sec")
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-rows", default=100000, type=int)
+    parser.add_argument("--output-dir", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    rows = synthetic_data.generate_bq_rows(args.num_rows)
+    run_benchmark(rows, args.output_dir or tempfile.mkdtemp())
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
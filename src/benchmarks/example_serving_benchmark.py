@@ -0,0 +1,92 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure the throughput of serving_tf_example on serialized example batches.
+
+This is the signature the TFX Evaluator runs on the eval split.
+
+    python -m src.benchmarks.example_serving_benchmark --num-examples=100000
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+
+import tensorflow as tf
+
+from src.benchmarks import synthetic_data
+from src.benchmarks.serving_benchmark import export_models
+
+SIGNATURE_NAME = "serving_tf_example"
+BATCH_SIZES = [64, 256, 1024, 4096]
+
+
+def measure_throughput(signature, serialized_examples, batch_size):
+    """Returns the examples per second of signature over all the batches."""
+    batches = [
+        tf.constant(serialized_examples[start : start + batch_size])
+        for start in range(0, len(serialized_examples), batch_size)
+    ]
+    # One call per batch shape, so that no tracing or warmup is measured.
+    signature(examples=batches[0])
+    signature(examples=batches[-1])
+
+    start = time.perf_counter()
+    for batch in batches:
+        signature(examples=batch)
+    return len(serialized_examples) / (time.perf_counter() - start)
+
+
+def run_benchmark(saved_model_dir, num_examples=100000, batch_sizes=None):
+    serialized_examples = synthetic_data.serialize_raw_examples(
+        synthetic_data.generate_bq_rows(num_examples, seed=1)
+    )
+    signature = tf.saved_model.load(saved_model_dir).signatures[SIGNATURE_NAME]
+
+    results = {}
+    for batch_size in batch_sizes or BATCH_SIZES:
+        results[batch_size] = measure_throughput(
+            signature, serialized_examples, batch_size
+        )
+        logging.info(
+            f"{SIGNATURE_NAME} batch {batch_size}: "
+            f"{results[batch_size]:,.0f} examples/s"
+        )
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-examples", default=100000, type=int)
+    parser.add_argument(
+        "--saved-model-dir",
+        type=str,
+        help="An exported model. A model is exported to --output-dir if unset.",
+    )
+    parser.add_argument("--output-dir", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    saved_model_dir = args.saved_model_dir
+    if not saved_model_dir:
+        output_dir = args.output_dir or tempfile.mkdtemp()
+        saved_model_dir = export_models(output_dir)["keras"]
+    run_benchmark(saved_model_dir, args.num_examples)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,154 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the throughput of data.get_dataset on synthetic TFRecords.
+
+Sweeps batch size, file count, compression and reader parallelism over data
+written to the local filesystem, which stands in for GCS:
+
+    python -m src.benchmarks.input_pipeline_benchmark \
+        --batch-sizes=256,512 --num-files=1,8 --compression-types=GZIP,NONE
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from src.benchmarks import synthetic_data
+from src.model_training import data
+
+
+def _data_size(file_pattern):
+    return sum(
+        tf.io.gfile.stat(file_path).length
+        for file_path in tf.io.gfile.glob(file_pattern)
+    )
+
+
+def run_benchmark(dataset, batch_size, data_size, num_epochs=1):
+    """Iterates over the dataset and returns its throughput and batch latency."""
+    batch_times = []
+    start = time.perf_counter()
+    for _ in range(num_epochs):
+        batch_start = time.perf_counter()
+        for _ in dataset:
+            batch_end = time.perf_counter()
+            batch_times.append(batch_end - batch_start)
+            batch_start = batch_end
+    elapsed = time.perf_counter() - start
+
+    batch_times_ms = np.array(batch_times) * 1000
+    return {
+        "examples_per_sec": len(batch_times) * batch_size / elapsed,
+        "bytes_per_sec": data_size * num_epochs / elapsed,
+        "p50_batch_ms": float(np.percentile(batch_times_ms, 50)),
+        "p99_batch_ms": float(np.percentile(batch_times_ms, 99)),
+    }
+
+
+def run_sweep(
+    data_root,
+    batch_sizes,
+    num_files_values,
+    compression_types,
+    num_parallel_reads_values,
+    num_examples=100000,
+    num_epochs=1,
+):
+    """Benchmarks every combination of the given settings."""
+    results = []
+    for num_files, compression_type in itertools.product(
+        num_files_values, compression_types
+    ):
+        data_dir = os.path.join(
+            data_root, f"files-{num_files}-{compression_type}"
+        )
+        synthetic_data.write_tfrecords(
+            data_dir,
+            num_files=num_files,
+            examples_per_file=num_examples // num_files,
+            compression_type=compression_type,
+        )
+        file_pattern = os.path.join(data_dir, "data-*")
+        data_size = _data_size(file_pattern)
+
+        for batch_size, num_parallel_reads in itertools.product(
+            batch_sizes, num_parallel_reads_values
+        ):
+            dataset = data.get_dataset(
+                file_pattern,
+                synthetic_data.transformed_feature_spec(),
+                batch_size=batch_size,
+                num_parallel_reads=num_parallel_reads,
+            )
+            result = {
+                "batch_size": batch_size,
+                "num_files": num_files,
+                "compression_type": compression_type,
+                "num_parallel_reads": num_parallel_reads,
+            }
+            result.update(run_benchmark(dataset, batch_size, data_size, num_epochs))
+            logging.info(result)
+            results.append(result)
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", type=str)
+    parser.add_argument("--batch-sizes", default="512", type=str)
+    parser.add_argument("--num-files", default="1,8", type=str)
+    parser.add_argument("--compression-types", default="GZIP,NONE", type=str)
+    parser.add_argument("--num-parallel-reads", default="1,-1", type=str)
+    parser.add_argument("--num-examples", default=100000, type=int)
+    parser.add_argument("--num-epochs", default=2, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    results = run_sweep(
+        data_root=args.data_dir or tempfile.mkdtemp(),
+        batch_sizes=[int(v) for v in args.batch_sizes.split(",")],
+        num_files_values=[int(v) for v in args.num_files.split(",")],
+        compression_types=args.compression_types.split(","),
+        num_parallel_reads_values=[
+            int(v) for v in args.num_parallel_reads.split(",")
+        ],
+        num_examples=args.num_examples,
+        num_epochs=args.num_epochs,
+    )
+
+    print(
+        f"{'batch':>6} {'files':>6} {'codec':>6} {'reads':>6} "
+        f"{'examples/s':>12} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for r in results:
+        print(
+            f"{r['batch_size']:>6} {r['num_files']:>6} {r['compression_type']:>6} "
+            f"{r['num_parallel_reads']:>6} {r['examples_per_sec']:>12,.0f} "
+            f"{r['bytes_per_sec'] / 1e6:>8.1f} {r['p50_batch_ms']:>8.2f} "
+            f"{r['p99_batch_ms']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
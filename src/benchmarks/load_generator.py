@@ -0,0 +1,293 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load test a prediction endpoint, and report its latency and throughput.
+
+Closed-loop mode keeps --concurrency requests in flight. Open-loop mode sends
+--qps requests per second whatever the latency, and measures latency from the
+scheduled send time, so that a slow endpoint does not slow down the load.
+
+    python -m src.benchmarks.load_generator --url=http://localhost:8080/predict \
+        --mode=closed --concurrency=16 --batch-sizes=1,8,32
+    python -m src.benchmarks.load_generator --endpoint=... --project=... \
+        --region=... --mode=open --qps=50 --instances-file=instances.jsonl
+
+Reports of the local server, written with --machine-type and --output-file,
+size the serving replicas with build/utils.py --mode=size-serving-resources.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+import urllib.request
+from concurrent import futures
+
+import numpy as np
+import tensorflow as tf
+from google.cloud import aiplatform as vertex_ai
+
+from src.benchmarks import synthetic_data
+from src.common import features
+
+CLOSED_LOOP = "closed"
+OPEN_LOOP = "open"
+
+
+def load_instances(instances_file):
+    """Reads instances from a JSONL file, in the batch prediction input format.
+
+    Each line is an instance, or a request of the form {"instances": [...]}.
+    """
+    instances = []
+    with tf.io.gfile.GFile(instances_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and "instances" in record:
+                instances.extend(record["instances"])
+            else:
+                instances.append(record)
+    return instances
+
+
+def synthetic_instances(num_instances, seed=0):
+    """Returns instances of features.FEATURE_NAMES, as sent to the endpoint."""
+    return [
+        {feature_name: [row[feature_name]] for feature_name in features.FEATURE_NAMES}
+        for row in synthetic_data.generate_bq_rows(num_instances, seed)
+    ]
+
+
+class HttpTarget:
+    """Posts Vertex AI prediction requests to a URL, such as the local server."""
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def predict(self, instances):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"instances": instances}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            predictions = json.load(response)["predictions"]
+        if len(predictions) != len(instances):
+            raise ValueError(
+                f"{len(predictions)} predictions for {len(instances)} instances."
+            )
+        return predictions
+
+
+class EndpointTarget:
+    """Sends prediction requests to a Vertex AI endpoint."""
+
+    def __init__(self, endpoint_name, project=None, region=None):
+        vertex_ai.init(project=project, location=region)
+        self.endpoint = vertex_ai.Endpoint(endpoint_name)
+
+    def predict(self, instances):
+        return self.endpoint.predict(instances).predictions
+
+
+class _Results:
+    def __init__(self):
+        self.latencies = []
+        self.num_errors = 0
+
+    def record(self, latency, error=None):
+        if error is None:
+            self.latencies.append(latency)
+        else:
+            self.num_errors += 1
+
+
+async def _send(loop, executor, target, instances, results, start_time):
+    try:
+        await loop.run_in_executor(executor, target.predict, instances)
+        error = None
+    except Exception as exception:  # Failed requests count as errors.
+        error = exception
+        logging.debug(f"Request failed: {error}")
+    results.record(time.perf_counter() - start_time, error)
+
+
+async def _run_closed_loop(target, batches, concurrency, duration, executor):
+    loop = asyncio.get_running_loop()
+    results = _Results()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await _send(
+                loop, executor, target, next(batches), results, time.perf_counter()
+            )
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+async def _run_open_loop(target, batches, qps, duration, executor):
+    loop = asyncio.get_running_loop()
+    results = _Results()
+    start = time.perf_counter()
+    tasks = []
+    for index in range(int(qps * duration)):
+        send_time = start + index / qps
+        await asyncio.sleep(max(0, send_time - time.perf_counter()))
+        tasks.append(
+            asyncio.ensure_future(
+                _send(loop, executor, target, next(batches), results, send_time)
+            )
+        )
+    await asyncio.gather(*tasks)
+    return results
+
+
+def run_load_test(
+    target,
+    instances,
+    batch_size=1,
+    mode=CLOSED_LOOP,
+    concurrency=8,
+    qps=10,
+    duration=30,
+    max_in_flight=256,
+):
+    """Sends requests of batch_size instances to target for duration seconds.
+
+    Args:
+      target: an object with a predict(instances) method, e.g. HttpTarget.
+      instances: the instances to send, cycled through.
+      batch_size: the number of instances per request.
+      mode: CLOSED_LOOP, to keep concurrency requests in flight, or OPEN_LOOP,
+        to send qps requests per second.
+      max_in_flight: the maximum number of open-loop requests in flight. Later
+        requests queue, and their latency includes the wait.
+    Returns:
+      A dict of latency percentiles, error rate, and throughput.
+    """
+    batches = (
+        list(batch)
+        for batch in zip(*[itertools.cycle(instances)] * batch_size)
+    )
+    num_threads = concurrency if mode == CLOSED_LOOP else max_in_flight
+    with futures.ThreadPoolExecutor(num_threads) as executor:
+        start = time.perf_counter()
+        if mode == CLOSED_LOOP:
+            run = _run_closed_loop(target, batches, concurrency, duration, executor)
+        elif mode == OPEN_LOOP:
+            run = _run_open_loop(target, batches, qps, duration, executor)
+        else:
+            raise ValueError(
+                f"Invalid mode {mode}. Supported modes: {[CLOSED_LOOP, OPEN_LOOP]}."
+            )
+        results = asyncio.run(run)
+        elapsed = time.perf_counter() - start
+
+    num_requests = len(results.latencies) + results.num_errors
+    latencies_ms = np.array(results.latencies or [np.nan]) * 1000
+    return {
+        "batch_size": batch_size,
+        "num_requests": num_requests,
+        "error_rate": results.num_errors / max(num_requests, 1),
+        "p50_latency_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_latency_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_latency_ms": float(np.percentile(latencies_ms, 99)),
+        "requests_per_second": len(results.latencies) / elapsed,
+        "instances_per_second": len(results.latencies) * batch_size / elapsed,
+    }
+
+
+def run_sweep(target, instances, batch_sizes, **kwargs):
+    """Runs a load test per batch size, and logs a report."""
+    reports = []
+    for batch_size in batch_sizes:
+        report = run_load_test(target, instances, batch_size, **kwargs)
+        reports.append(report)
+        logging.info(
+            f"batch {batch_size}: {report['num_requests']} requests, "
+            f"p50 {report['p50_latency_ms']:.1f} ms, "
+            f"p95 {report['p95_latency_ms']:.1f} ms, "
+            f"p99 {report['p99_latency_ms']:.1f} ms, "
+            f"errors {report['error_rate']:.2%}, "
+            f"{report['requests_per_second']:.1f} requests/s, "
+            f"{report['instances_per_second']:.1f} instances/s"
+        )
+    return reports
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, help="An HTTP prediction route.")
+    parser.add_argument("--endpoint", type=str, help="A Vertex AI endpoint.")
+    parser.add_argument("--project", type=str)
+    parser.add_argument("--region", type=str)
+    parser.add_argument(
+        "--instances-file",
+        type=str,
+        help="A JSONL file of instances. Synthetic instances are sent if unset.",
+    )
+    parser.add_argument("--mode", default=CLOSED_LOOP, type=str)
+    parser.add_argument("--concurrency", default=8, type=int)
+    parser.add_argument("--qps", default=10, type=float)
+    parser.add_argument("--duration", default=30, type=float)
+    parser.add_argument("--batch-sizes", default="1", type=str)
+    parser.add_argument(
+        "--machine-type",
+        type=str,
+        help="The machine type of the benchmarked replica, recorded in the reports.",
+    )
+    parser.add_argument("--output-file", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.url:
+        target = HttpTarget(args.url)
+    elif args.endpoint:
+        target = EndpointTarget(args.endpoint, args.project, args.region)
+    else:
+        raise ValueError("Either --url or --endpoint must be set.")
+
+    if args.instances_file:
+        instances = load_instances(args.instances_file)
+    else:
+        instances = synthetic_instances(1000)
+
+    reports = run_sweep(
+        target,
+        instances,
+        [int(batch_size) for batch_size in args.batch_sizes.split(",")],
+        mode=args.mode,
+        concurrency=args.concurrency,
+        qps=args.qps,
+        duration=args.duration,
+    )
+    if args.machine_type:
+        for report in reports:
+            report["machine_type"] = args.machine_type
+    if args.output_file:
+        with tf.io.gfile.GFile(args.output_file, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,125 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the serving latency of the Keras and optimized SavedModel exports.
+
+    python -m src.benchmarks.serving_benchmark --num-requests=500
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_transform as tft
+
+from src.benchmarks import synthetic_data
+from src.benchmarks.vocabulary_benchmark import RAW_SCHEMA_LOCATION, analyze, dir_size
+from src.model_training import defaults, exporter, model
+
+BATCH_SIZES = [1, 256]
+EXPORT_MODES = {"keras": False, "optimized": True}
+
+
+def _signature_inputs(signature_name, rows):
+    if signature_name == "serving_tf_example":
+        return {"examples": tf.constant(synthetic_data.serialize_raw_examples(rows))}
+    return synthetic_data.raw_serving_inputs(rows)
+
+
+def measure_latency(signature, inputs, num_requests, num_warmup_requests=10):
+    """Returns the p50 and p99 latency of a signature in milliseconds."""
+    for _ in range(num_warmup_requests):
+        signature(**inputs)
+    latencies = []
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        signature(**inputs)
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "p50_latency_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_latency_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def export_models(output_dir, num_rows=2000, include_tf_example_signature=True):
+    """Exports an untrained model in every export mode.
+
+    Serving latency does not depend on the weights, so the model is not trained.
+
+    Returns:
+      The SavedModel directory of each export mode.
+    """
+    transform_artifact_dir = os.path.join(output_dir, "transform")
+    analyze(synthetic_data.generate_bq_rows(num_rows), transform_artifact_dir)
+    tft_output = tft.TFTransformOutput(transform_artifact_dir)
+    classifier = model.create_binary_classifier(
+        tft_output, defaults.update_hyperparams({})
+    )
+
+    saved_model_dirs = {}
+    for export_mode, optimize in EXPORT_MODES.items():
+        saved_model_dirs[export_mode] = os.path.join(output_dir, export_mode)
+        exporter.export_serving_model(
+            classifier,
+            saved_model_dirs[export_mode],
+            RAW_SCHEMA_LOCATION,
+            transform_artifact_dir,
+            optimize=optimize,
+            include_tf_example_signature=include_tf_example_signature,
+        )
+    return saved_model_dirs
+
+
+def run_benchmark(saved_model_dirs, num_requests=500, batch_sizes=None):
+    rows = synthetic_data.generate_bq_rows(max(batch_sizes or BATCH_SIZES), seed=1)
+    results = {}
+    for export_mode, saved_model_dir in saved_model_dirs.items():
+        signatures = tf.saved_model.load(saved_model_dir).signatures
+        for signature_name, signature in signatures.items():
+            for batch_size in batch_sizes or BATCH_SIZES:
+                inputs = _signature_inputs(signature_name, rows[:batch_size])
+                result = measure_latency(signature, inputs, num_requests)
+                result["saved_model_bytes"] = dir_size(saved_model_dir)
+                results[(export_mode, signature_name, batch_size)] = result
+
+    for (export_mode, signature_name, batch_size), result in results.items():
+        logging.info(
+            f"{export_mode} {signature_name} batch {batch_size}: "
+            f"p50 {result['p50_latency_ms']:.2f} ms, "
+            f"p99 {result['p99_latency_ms']:.2f} ms, "
+            f"SavedModel {result['saved_model_bytes'] / 2 ** 20:.1f} MiB"
+        )
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-requests", default=500, type=int)
+    parser.add_argument("--output-dir", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    saved_model_dirs = export_models(args.output_dir or tempfile.mkdtemp())
+    run_benchmark(saved_model_dirs, args.num_requests)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,77 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the rows per second of the hash split and the previous split.
+
+    python -m src.benchmarks.split_benchmark --num-rows=200000
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from src.benchmarks import synthetic_data
+from src.preprocessing import etl
+
+
+def legacy_split_dataset(bq_row, num_partitions, ratio):
+    """The json.dumps based split that etl.hash_split replaced."""
+    assert num_partitions == len(ratio)
+    bucket = sum(map(ord, json.dumps(bq_row))) % sum(ratio)
+    total = 0
+    for i, part in enumerate(ratio):
+        total += part
+        if bucket < total:
+            return i
+    return len(ratio) - 1
+
+
+def run_benchmark(rows, batch_size):
+    split_ratios = etl.DEFAULT_SPLIT_RATIOS
+    ratio = list(split_ratios.values())
+
+    start = time.perf_counter()
+    for row in rows:
+        legacy_split_dataset(row, len(ratio), ratio)
+    legacy_rows_per_sec = len(rows) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        etl.hash_split(rows[i : i + batch_size], split_ratios)
+    hash_rows_per_sec = len(rows) / (time.perf_counter() - start)
+
+    return {
+        "legacy_rows_per_sec": legacy_rows_per_sec,
+        "hash_rows_per_sec": hash_rows_per_sec,
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-rows", default=200000, type=int)
+    parser.add_argument("--batch-size", default=etl.SPLIT_BATCH_SIZE, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    rows = synthetic_data.generate_raw_rows(args.num_rows)
+    result = run_benchmark(rows, args.batch_size)
+    logging.info(f"json.dumps split: {result['legacy_rows_per_sec']:,.0f} rows/sec")
+    logging.info(f"hash split: {result['hash_rows_per_sec']:,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
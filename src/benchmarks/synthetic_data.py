@@ -0,0 +1,220 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic transformed data for offline benchmarks."""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from src.common import features, data_manifest
+
+VOCAB_SIZE = 100
+
+
+def transformed_feature_spec():
+    """Returns the feature spec produced by transformations.preprocessing_fn."""
+    feature_spec = {}
+    for feature_name in features.FEATURE_NAMES:
+        if feature_name in features.NUMERICAL_FEATURE_NAMES:
+            dtype = tf.float32
+        else:
+            dtype = tf.int64
+        feature_spec[features.transformed_name(feature_name)] = tf.io.FixedLenFeature(
+            shape=[], dtype=dtype
+        )
+    feature_spec[features.TARGET_FEATURE_NAME] = tf.io.FixedLenFeature(
+        shape=[], dtype=tf.int64
+    )
+    return feature_spec
+
+
+def generate_columns(num_examples, vocab_size=VOCAB_SIZE, seed=0):
+    """Returns a dictionary of random numpy columns matching the feature spec."""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, spec in transformed_feature_spec().items():
+        if name == features.TARGET_FEATURE_NAME:
+            columns[name] = rng.integers(0, 2, num_examples)
+        elif spec.dtype == tf.float32:
+            columns[name] = rng.standard_normal(num_examples).astype(np.float32)
+        else:
+            columns[name] = rng.integers(0, vocab_size, num_examples)
+    return columns
+
+
+def _grid_point(rng, grid_decimals):
+    if grid_decimals is None:
+        return f"POINT({rng.integers(-88, -87)} {rng.integers(41, 43)})"
+    longitude = rng.uniform(-88, -87)
+    latitude = rng.uniform(41, 43)
+    return f"POINT({longitude:.{grid_decimals}f} {latitude:.{grid_decimals}f})"
+
+
+def generate_bq_rows(num_rows, seed=0, grid_decimals=None):
+    """Returns raw rows as read from BigQuery by the serving/training queries.
+
+    grid_decimals sets the precision of the grid coordinates, and so the
+    cardinality of pickup_grid, dropoff_grid, and loc_cross.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(num_rows):
+        pickup_grid = _grid_point(rng, grid_decimals)
+        dropoff_grid = _grid_point(rng, grid_decimals)
+        rows.append(
+            {
+                "trip_month": int(rng.integers(1, 13)),
+                "trip_day": int(rng.integers(1, 32)),
+                "trip_day_of_week": int(rng.integers(1, 8)),
+                "trip_hour": int(rng.integers(0, 24)),
+                "trip_seconds": int(rng.integers(60, 3600)),
+                "trip_miles": float(rng.uniform(0.1, 30)),
+                "payment_type": str(rng.choice(["Cash", "Credit Card"])),
+                "pickup_grid": pickup_grid,
+                "dropoff_grid": dropoff_grid,
+                "euclidean": float(rng.uniform(100, 30000)),
+                "loc_cross": f"{pickup_grid}{dropoff_grid}",
+                features.TARGET_FEATURE_NAME: int(rng.integers(0, 2)),
+            }
+        )
+    return rows
+
+
+def generate_raw_rows(num_rows, seed=0):
+    """Returns raw rows as parsed by etl.parse_bq_record."""
+    return [
+        {key: [value] for key, value in row.items()}
+        for row in generate_bq_rows(num_rows, seed)
+    ]
+
+
+def raw_serving_inputs(rows):
+    """Returns the serving_default inputs of raw rows, as (batch, 1) tensors."""
+    inputs = {}
+    for feature_name in features.FEATURE_NAMES:
+        values = [[row[feature_name]] for row in rows]
+        # Python ints would default to int32.
+        dtype = tf.int64 if isinstance(values[0][0], int) else None
+        inputs[feature_name] = tf.constant(values, dtype=dtype)
+    return inputs
+
+
+def serialize_raw_examples(rows):
+    """Serializes raw rows, label included, as the eval split tf.Examples."""
+    serialized = []
+    for row in rows:
+        feature = {}
+        for feature_name, value in row.items():
+            if isinstance(value, str):
+                feature[feature_name] = tf.train.Feature(
+                    bytes_list=tf.train.BytesList(value=[value.encode()])
+                )
+            elif isinstance(value, float):
+                feature[feature_name] = tf.train.Feature(
+                    float_list=tf.train.FloatList(value=[value])
+                )
+            else:
+                feature[feature_name] = tf.train.Feature(
+                    int64_list=tf.train.Int64List(value=[value])
+                )
+        example = tf.train.Example(features=tf.train.Features(feature=feature))
+        serialized.append(example.SerializeToString())
+    return serialized
+
+
+def serialize_examples(columns):
+    """Serializes numpy columns into a list of tf.Example strings."""
+    num_examples = len(columns[features.TARGET_FEATURE_NAME])
+    serialized = []
+    for i in range(num_examples):
+        feature = {}
+        for name, values in columns.items():
+            if values.dtype == np.float32:
+                feature[name] = tf.train.Feature(
+                    float_list=tf.train.FloatList(value=[values[i]])
+                )
+            else:
+                feature[name] = tf.train.Feature(
+                    int64_list=tf.train.Int64List(value=[values[i]])
+                )
+        example = tf.train.Example(features=tf.train.Features(feature=feature))
+        serialized.append(example.SerializeToString())
+    return serialized
+
+
+def write_tfrecords(
+    output_dir,
+    num_files=4,
+    examples_per_file=10000,
+    compression_type="GZIP",
+    vocab_size=VOCAB_SIZE,
+):
+    """Writes synthetic transformed tf.Example files and returns their paths.
+
+    A data manifest recording the codec is written next to the files.
+    """
+    compression_type = data_manifest.validate_compression_type(compression_type)
+    data_manifest.write_manifest(output_dir, compression_type, num_files)
+    suffix = data_manifest.FILE_SUFFIXES[compression_type]
+    options = tf.io.TFRecordOptions(
+        compression_type=data_manifest.COMPRESSION_TYPES[compression_type]
+    )
+
+    file_paths = []
+    for shard in range(num_files):
+        file_path = os.path.join(
+            output_dir, f"data-{shard:05d}-of-{num_files:05d}{suffix}"
+        )
+        columns = generate_columns(examples_per_file, vocab_size, seed=shard)
+        with tf.io.TFRecordWriter(file_path, options) as writer:
+            for record in serialize_examples(columns):
+                writer.write(record)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def write_parquet(
+    output_dir,
+    num_files=4,
+    examples_per_file=10000,
+    compression_type="SNAPPY",
+    vocab_size=VOCAB_SIZE,
+):
+    """Writes synthetic transformed Parquet files and returns their paths.
+
+    A data manifest recording the format and codec is written next to the files.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    compression_type = data_manifest.validate_compression_type(
+        compression_type, data_manifest.PARQUET_FORMAT
+    )
+    data_manifest.write_manifest(
+        output_dir, compression_type, num_files, data_manifest.PARQUET_FORMAT
+    )
+
+    file_paths = []
+    for shard in range(num_files):
+        file_path = os.path.join(
+            output_dir,
+            f"data-{shard:05d}-of-{num_files:05d}{data_manifest.PARQUET_FILE_SUFFIX}",
+        )
+        columns = generate_columns(examples_per_file, vocab_size, seed=shard)
+        table = pa.Table.from_pydict(columns)
+        with tf.io.gfile.GFile(file_path, "wb") as f:
+            pq.write_table(table, f, compression=compression_type)
+        file_paths.append(file_path)
+    return file_paths
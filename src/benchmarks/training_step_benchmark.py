@@ -0,0 +1,113 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare training steps/sec with XLA, mixed precision and steps_per_execution.
+
+The classifier is built by model._create_binary_classifier from a synthetic
+vocabulary, and fed from an in-memory dataset so that only the training step
+is measured:
+
+    python -m src.benchmarks.training_step_benchmark --batch-size=512
+"""
+
+import argparse
+import logging
+import time
+
+import tensorflow as tf
+from tensorflow import keras
+
+from src.benchmarks import synthetic_data
+from src.common import features
+from src.model_training import defaults, model, trainer
+
+CONFIGS = {
+    "baseline": {},
+    "jit_compile": {"jit_compile": True},
+    "mixed_bfloat16": {"mixed_precision": "mixed_bfloat16"},
+    "steps_per_execution": {"steps_per_execution": 32},
+    "all": {
+        "jit_compile": True,
+        "mixed_precision": "mixed_bfloat16",
+        "steps_per_execution": 32,
+    },
+}
+
+
+def _get_dataset(batch_size, num_batches, vocab_size):
+    columns = synthetic_data.generate_columns(batch_size * num_batches, vocab_size)
+    label = columns.pop(features.TARGET_FEATURE_NAME)
+    return (
+        tf.data.Dataset.from_tensor_slices((columns, label))
+        .batch(batch_size, drop_remainder=True)
+        .cache()
+        .repeat()
+    )
+
+
+def run_benchmark(
+    config,
+    batch_size=512,
+    num_steps=500,
+    warmup_steps=50,
+    vocab_size=synthetic_data.VOCAB_SIZE,
+):
+    """Trains with the config hyperparameters and returns the steps/sec."""
+    hyperparams = defaults.update_hyperparams(dict(config, batch_size=batch_size))
+    feature_vocab_sizes = {
+        feature_name: vocab_size
+        for feature_name in features.categorical_feature_names()
+    }
+
+    trainer.set_precision_policy(hyperparams)
+    try:
+        classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+        trainer._compile(classifier, hyperparams)
+    finally:
+        keras.mixed_precision.set_global_policy("float32")
+
+    dataset = _get_dataset(batch_size, warmup_steps, vocab_size)
+    # The first epoch traces (and compiles) the training step.
+    classifier.fit(dataset, epochs=1, steps_per_epoch=warmup_steps, verbose=0)
+    start = time.perf_counter()
+    classifier.fit(dataset, epochs=1, steps_per_epoch=num_steps, verbose=0)
+    return num_steps / (time.perf_counter() - start)
+
+
+def run_sweep(batch_size=512, num_steps=500, warmup_steps=50, configs=None):
+    results = {}
+    for name, config in (configs or CONFIGS).items():
+        results[name] = run_benchmark(config, batch_size, num_steps, warmup_steps)
+    baseline = results.get("baseline")
+    for name, steps_per_sec in results.items():
+        speedup = f" ({steps_per_sec / baseline:.2f}x)" if baseline else ""
+        logging.info(f"{name}: {steps_per_sec:,.1f} steps/sec{speedup}")
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", default=512, type=int)
+    parser.add_argument("--num-steps", default=500, type=int)
+    parser.add_argument("--warmup-steps", default=50, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    run_sweep(args.batch_size, args.num_steps, args.warmup_steps)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
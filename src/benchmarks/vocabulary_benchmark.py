@@ -0,0 +1,166 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare analyzer time and model size with uncapped and capped vocabularies.
+
+    python -m src.benchmarks.vocabulary_benchmark --num-rows=100000 --grid-decimals=3
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import time
+
+import apache_beam as beam
+import tensorflow_data_validation as tfdv
+import tensorflow_transform as tft
+import tensorflow_transform.beam as tft_beam
+from tensorflow_transform.tf_metadata import dataset_metadata
+from tensorflow_transform.tf_metadata import schema_utils
+
+from src.benchmarks import synthetic_data
+from src.common import features
+from src.model_training import defaults, model
+from src.preprocessing import etl, transformations
+
+RAW_SCHEMA_LOCATION = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "raw_schema/schema.pbtxt"
+)
+
+# Vocabulary caps of the high-cardinality features, compared with no caps.
+VOCABULARY_CAPS = {
+    "pickup_grid": {"top_k": 5000, "frequency_threshold": 5, "num_oov_buckets": 10},
+    "dropoff_grid": {"top_k": 5000, "frequency_threshold": 5, "num_oov_buckets": 10},
+    "loc_cross": {"top_k": 50000, "frequency_threshold": 5, "num_oov_buckets": 100},
+}
+
+
+def uncapped_config():
+    """Returns EMBEDDING_CATEGORICAL_FEATURES without vocabulary limits."""
+    return {
+        feature_name: {"embedding_size": features.embedding_size(feature_name)}
+        for feature_name in features.EMBEDDING_CATEGORICAL_FEATURES
+    }
+
+
+def capped_config():
+    """Returns EMBEDDING_CATEGORICAL_FEATURES with the VOCABULARY_CAPS."""
+    return {
+        feature_name: dict(config, **VOCABULARY_CAPS.get(feature_name, {}))
+        for feature_name, config in features.EMBEDDING_CATEGORICAL_FEATURES.items()
+    }
+
+
+@contextlib.contextmanager
+def override_embedding_config(config):
+    """Temporarily replaces features.EMBEDDING_CATEGORICAL_FEATURES."""
+    original_config = features.EMBEDDING_CATEGORICAL_FEATURES
+    features.EMBEDDING_CATEGORICAL_FEATURES = config
+    try:
+        yield
+    finally:
+        features.EMBEDDING_CATEGORICAL_FEATURES = original_config
+
+
+def analyze(rows, transform_artifact_dir):
+    """Writes the transform artifacts of raw rows, and returns the analyzer time."""
+    raw_schema = tfdv.load_schema_text(RAW_SCHEMA_LOCATION)
+    raw_feature_spec = schema_utils.schema_as_feature_spec(raw_schema).feature_spec
+    raw_metadata = dataset_metadata.DatasetMetadata(
+        schema_utils.schema_from_feature_spec(raw_feature_spec)
+    )
+
+    start = time.perf_counter()
+    with beam.Pipeline(runner="DirectRunner") as pipeline:
+        with tft_beam.Context(os.path.join(transform_artifact_dir, "tmp")):
+            raw_data = (
+                pipeline
+                | "Create" >> beam.Create(rows)
+                | "Parse" >> beam.Map(etl.parse_bq_record)
+            )
+            transform_fn = (
+                raw_data,
+                raw_metadata,
+            ) | "Analyze" >> tft_beam.AnalyzeDataset(transformations.preprocessing_fn)
+            _ = transform_fn | "Write" >> tft_beam.WriteTransformFn(
+                transform_artifact_dir
+            )
+    return time.perf_counter() - start
+
+
+def dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(path)
+        for file_name in file_names
+    )
+
+
+def run_benchmark(rows, output_dir):
+    hyperparams = defaults.update_hyperparams({})
+    configs = {
+        "uncapped": uncapped_config(),
+        "capped": capped_config(),
+    }
+
+    results = {}
+    for name, config in configs.items():
+        transform_artifact_dir = os.path.join(output_dir, name)
+        with override_embedding_config(config):
+            analyzer_time = analyze(rows, transform_artifact_dir)
+            tft_output = tft.TFTransformOutput(transform_artifact_dir)
+            classifier = model.create_binary_classifier(tft_output, hyperparams)
+            results[name] = {
+                "analyzer_time": analyzer_time,
+                "vocabulary_sizes": {
+                    feature_name: tft_output.vocabulary_size_by_name(feature_name)
+                    for feature_name in features.EMBEDDING_CATEGORICAL_FEATURES
+                },
+                "model_params": classifier.count_params(),
+                "artifact_bytes": dir_size(
+                    os.path.join(transform_artifact_dir, "transform_fn")
+                ),
+            }
+
+    for name, result in results.items():
+        logging.info(
+            f"{name}: analyzer {result['analyzer_time']:.1f}s, "
+            f"{result['model_params']:,} model parameters "
+            f"({result['model_params'] * 4 / 2 ** 20:.1f} MiB float32), "
+            f"transform artifacts {result['artifact_bytes'] / 2 ** 20:.1f} MiB, "
+            f"vocabulary sizes {result['vocabulary_sizes']}"
+        )
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-rows", default=100000, type=int)
+    parser.add_argument("--grid-decimals", default=3, type=int)
+    parser.add_argument("--output-dir", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    rows = synthetic_data.generate_bq_rows(
+        args.num_rows, grid_decimals=args.grid_decimals
+    )
+    run_benchmark(rows, args.output_dir or tempfile.mkdtemp())
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,137 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Manifest describing how transformed data files are written."""
+
+import os
+import json
+
+import tensorflow as tf
+
+
+MANIFEST_FILENAME = "manifest.json"
+DEFAULT_COMPRESSION_TYPE = "GZIP"
+
+TFRECORD_FORMAT = "tfrecord"
+PARQUET_FORMAT = "parquet"
+DATA_FORMATS = [TFRECORD_FORMAT, PARQUET_FORMAT]
+
+# Supported TFRecord codecs and their tf.data compression_type values.
+COMPRESSION_TYPES = {"NONE": "", "GZIP": "GZIP", "ZLIB": "ZLIB"}
+FILE_SUFFIXES = {"NONE": ".tfrecord", "GZIP": ".gz", "ZLIB": ".zz"}
+
+# Supported Parquet column codecs.
+PARQUET_CODECS = ["NONE", "SNAPPY", "GZIP", "ZSTD"]
+DEFAULT_PARQUET_CODEC = "SNAPPY"
+PARQUET_FILE_SUFFIX = ".parquet"
+
+
+def validate_data_format(data_format):
+    """Returns the normalized data format, or raises ValueError if unsupported."""
+    data_format = (data_format or TFRECORD_FORMAT).lower()
+    if data_format not in DATA_FORMATS:
+        raise ValueError(
+            f"Invalid data format {data_format}. Supported formats: {DATA_FORMATS}."
+        )
+    return data_format
+
+
+def validate_compression_type(compression_type, data_format=TFRECORD_FORMAT):
+    """Returns the normalized codec name, or raises ValueError if unsupported."""
+    compression_type = (compression_type or "NONE").upper()
+    if data_format == PARQUET_FORMAT:
+        supported_types = PARQUET_CODECS
+    else:
+        supported_types = list(COMPRESSION_TYPES.keys())
+        if compression_type == "SNAPPY":
+            raise ValueError(
+                "Snappy is not supported for TFRecord files by Beam or tf.data. "
+                "Use the parquet data format for Snappy compression."
+            )
+    if compression_type not in supported_types:
+        raise ValueError(
+            f"Invalid compression type {compression_type}. "
+            f"Supported types: {supported_types}."
+        )
+    return compression_type
+
+
+def default_compression_type(data_format=TFRECORD_FORMAT):
+    """Returns the codec used when none is specified for the data format."""
+    if data_format == PARQUET_FORMAT:
+        return DEFAULT_PARQUET_CODEC
+    return DEFAULT_COMPRESSION_TYPE
+
+
+def get_file_suffix(compression_type, data_format=TFRECORD_FORMAT):
+    """Returns the suffix of the data files written with the given codec."""
+    if data_format == PARQUET_FORMAT:
+        return PARQUET_FILE_SUFFIX
+    return FILE_SUFFIXES[compression_type]
+
+
+def write_manifest(
+    data_dir,
+    compression_type,
+    num_shards=0,
+    data_format=TFRECORD_FORMAT,
+    partitions=None,
+):
+    """Writes the manifest of the transformed data files under data_dir.
+
+    The manifest is written at the root of the transformed data (next to the
+    train/ and eval/ directories) so that a "train/*" file pattern does not
+    match it. partitions lists the source partitions already transformed.
+    """
+    data_format = validate_data_format(data_format)
+    compression_type = validate_compression_type(compression_type, data_format)
+    manifest = {
+        "data_format": data_format,
+        "compression_type": compression_type,
+        "file_suffix": get_file_suffix(compression_type, data_format),
+        "num_shards": num_shards,
+        "partitions": list(partitions or []),
+    }
+    tf.io.gfile.makedirs(data_dir)
+    with tf.io.gfile.GFile(os.path.join(data_dir, MANIFEST_FILENAME), "w") as f:
+        f.write(json.dumps(manifest))
+    return manifest
+
+
+def load_manifest(data_dir):
+    """Returns the manifest written under data_dir, or None if missing."""
+    manifest_path = os.path.join(data_dir, MANIFEST_FILENAME)
+    if not tf.io.gfile.exists(manifest_path):
+        return None
+    with tf.io.gfile.GFile(manifest_path) as f:
+        return json.loads(f.read())
+
+
+def read_manifest(file_pattern):
+    """Returns the manifest of the files in file_pattern, or None if missing.
+
+    Looks in the directory of the files and in its parent directory. For a list
+    of patterns, as passed by the TFX Trainer, the first pattern is used.
+    """
+    if isinstance(file_pattern, (list, tuple)):
+        if not file_pattern:
+            return None
+        file_pattern = file_pattern[0]
+    data_dir = os.path.dirname(file_pattern)
+    if any(char in data_dir for char in "*?["):
+        return None
+    for manifest_dir in [data_dir, os.path.dirname(data_dir)]:
+        manifest = load_manifest(manifest_dir)
+        if manifest:
+            return manifest
+    return None
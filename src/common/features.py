@@ -38,15 +38,45 @@ NUMERICAL_FEATURE_NAMES = [
     "euclidean",
 ]
 
+# Embedding size and vocabulary settings of the embedded categorical features.
+# The vocabulary settings are unset by default, which keeps every value:
+#   top_k: keep only the top_k most frequent values in the vocabulary.
+#   frequency_threshold: drop values seen fewer times than the threshold.
+#   num_oov_buckets: hash buckets shared by the values outside of the vocabulary,
+#     DEFAULT_NUM_OOV_BUCKETS by default. Raise it with top_k or
+#     frequency_threshold, e.g. {"top_k": 5000, "frequency_threshold": 5,
+#     "num_oov_buckets": 10} for pickup_grid, so that the dropped values do not
+#     all share one embedding.
+#   embedding_mode: "dense" (default) for one row per value, or a compact table:
+#     "hash": num_buckets rows shared by hashing the values.
+#     "quotient_remainder": rows of the value quotient and remainder by
+#       num_buckets, combined, so that every value has a distinct embedding.
+#     "mixed_dimension": head_size most frequent values of embedding_size, the
+#       others of tail_embedding_size, projected to embedding_size.
+# Changing the vocabulary settings changes the transform graph and the
+# embedding tables, so the model must be retrained.
 EMBEDDING_CATEGORICAL_FEATURES = {
-    "trip_month": 2,
-    "trip_day": 4,
-    "trip_hour": 3,
-    "pickup_grid": 3,
-    "dropoff_grid": 3,
-    "loc_cross": 10,
+    "trip_month": {"embedding_size": 2},
+    "trip_day": {"embedding_size": 4},
+    "trip_hour": {"embedding_size": 3},
+    "pickup_grid": {"embedding_size": 3},
+    "dropoff_grid": {"embedding_size": 3},
+    "loc_cross": {"embedding_size": 10},
 }
 
+DEFAULT_NUM_OOV_BUCKETS = 1
+
+DENSE_EMBEDDING = "dense"
+HASH_EMBEDDING = "hash"
+QUOTIENT_REMAINDER_EMBEDDING = "quotient_remainder"
+MIXED_DIMENSION_EMBEDDING = "mixed_dimension"
+EMBEDDING_MODES = [
+    DENSE_EMBEDDING,
+    HASH_EMBEDDING,
+    QUOTIENT_REMAINDER_EMBEDDING,
+    MIXED_DIMENSION_EMBEDDING,
+]
+
 ONEHOT_CATEGORICAL_FEATURE_NAMES = ["payment_type", "trip_day_of_week"]
 
 
@@ -65,6 +95,38 @@ def vocabulary_name(key: str) -> str:
     return f"{key}_vocab"
 
 
+def embedding_size(key: str) -> int:
+    """Get the embedding size of an embedded categorical feature."""
+    return EMBEDDING_CATEGORICAL_FEATURES[key]["embedding_size"]
+
+
+def embedding_config(key: str) -> dict:
+    """Get the embedding table settings of an embedded categorical feature."""
+    config = EMBEDDING_CATEGORICAL_FEATURES[key]
+    return {
+        "embedding_size": config["embedding_size"],
+        "embedding_mode": config.get("embedding_mode", DENSE_EMBEDDING),
+        "num_buckets": config.get("num_buckets"),
+        "head_size": config.get("head_size"),
+        "tail_embedding_size": config.get("tail_embedding_size"),
+    }
+
+
+def vocabulary_config(key: str) -> dict:
+    """Get the tft.compute_and_apply_vocabulary settings of a categorical feature."""
+    config = EMBEDDING_CATEGORICAL_FEATURES.get(key, {})
+    return {
+        "top_k": config.get("top_k"),
+        "frequency_threshold": config.get("frequency_threshold"),
+        "num_oov_buckets": config.get("num_oov_buckets", DEFAULT_NUM_OOV_BUCKETS),
+    }
+
+
+def num_oov_buckets(key: str) -> int:
+    """Get the number of out-of-vocabulary buckets of a categorical feature."""
+    return vocabulary_config(key)["num_oov_buckets"]
+
+
 def categorical_feature_names() -> list:
     return (
         list(EMBEDDING_CATEGORICAL_FEATURES.keys()) + ONEHOT_CATEGORICAL_FEATURE_NAMES
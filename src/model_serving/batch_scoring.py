@@ -0,0 +1,195 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batch scoring of JSONL instance shards, without a Vertex AI job.
+
+The serving-data-*.jsonl shards written by the bigquery_data_gen component are
+scored across a pool of processes, each loading the model once and calling its
+serving_default signature with large batches. The predictions are written in
+the layout of a Vertex AI batch prediction job: a directory of
+prediction.results-XXXXX-of-YYYYY shards, whose lines are
+{"instance": ..., "prediction": ...}.
+
+Each results shard is written to a temporary file, then renamed, so it only
+exists once its input shard is scored. A rerun with the same output directory
+skips the shards that exist. The local_batch_prediction pipeline component
+writes to a new output artifact on every run, so only reruns of this command
+resume.
+
+    python -m src.model_serving.batch_scoring --model-dir=... \
+        --input-pattern=.../serving-data-*.jsonl --output-dir=...
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent import futures
+
+import tensorflow as tf
+
+from src.model_serving import server
+
+PREDICTIONS_DIR = "prediction-local"
+RESULTS_PREFIX = "prediction.results-"
+TEMP_PREFIX = "_tmp."
+
+# The model of each worker process, loaded once by _init_worker.
+_predict_fn = None
+
+
+def results_file_name(shard_index, num_shards):
+    return f"{RESULTS_PREFIX}{shard_index:05d}-of-{num_shards:05d}"
+
+
+def _init_worker(model_dir, num_threads):
+    global _predict_fn
+    if num_threads:
+        # Workers share the host cores, instead of each using all of them.
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(num_threads)
+    _predict_fn = server.load_predict_fn(model_dir)
+
+
+def _read_batches(input_file, batch_size):
+    batch = []
+    with tf.io.gfile.GFile(input_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def score_shard(input_file, output_file, batch_size):
+    """Writes the predictions of the instances of input_file to output_file.
+
+    Returns:
+      The number of scored instances.
+    """
+    temp_file = os.path.join(
+        os.path.dirname(output_file), TEMP_PREFIX + os.path.basename(output_file)
+    )
+    num_instances = 0
+    with tf.io.gfile.GFile(temp_file, "w") as f:
+        for instances in _read_batches(input_file, batch_size):
+            predictions = _predict_fn(instances)
+            f.write(
+                "".join(
+                    json.dumps({"instance": instance, "prediction": prediction}) + "\n"
+                    for instance, prediction in zip(instances, predictions)
+                )
+            )
+            num_instances += len(instances)
+    tf.io.gfile.rename(temp_file, output_file, overwrite=True)
+    return num_instances
+
+
+def run_batch_scoring(
+    model_dir, input_pattern, output_dir, num_workers=None, batch_size=4096
+):
+    """Scores the input shards that have no results yet.
+
+    Args:
+      model_dir: the SavedModel exported by exporter.export_serving_model.
+      input_pattern: the JSONL instance shards, one instance per line.
+      output_dir: the directory where the results directory is written.
+      num_workers: the number of processes, one per core by default. With 1,
+        the shards are scored in this process.
+      batch_size: the number of instances per signature call.
+    Returns:
+      The directory of the prediction.results-* shards.
+    """
+    input_files = sorted(tf.io.gfile.glob(input_pattern))
+    if not input_files:
+        raise ValueError(f"No input files match {input_pattern}.")
+
+    predictions_dir = os.path.join(output_dir, PREDICTIONS_DIR)
+    tf.io.gfile.makedirs(predictions_dir)
+    pending = {}
+    for shard_index, input_file in enumerate(input_files):
+        output_file = os.path.join(
+            predictions_dir, results_file_name(shard_index, len(input_files))
+        )
+        if not tf.io.gfile.exists(output_file):
+            pending[input_file] = output_file
+    logging.info(
+        f"Scoring {len(pending)} of {len(input_files)} shards: "
+        f"{len(input_files) - len(pending)} were scored by a previous run."
+    )
+    if not pending:
+        return predictions_dir
+
+    num_workers = min(num_workers or os.cpu_count(), len(pending))
+    num_threads = max(1, os.cpu_count() // num_workers) if num_workers > 1 else None
+    start = time.perf_counter()
+    num_instances = 0
+    if num_workers == 1:
+        _init_worker(model_dir, num_threads)
+        for num_done, (input_file, output_file) in enumerate(pending.items(), 1):
+            num_instances += score_shard(input_file, output_file, batch_size)
+            logging.info(f"Scored {num_done} of {len(pending)} shards.")
+    else:
+        # TensorFlow is not fork-safe, so workers are started with spawn.
+        with futures.ProcessPoolExecutor(
+            num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_dir, num_threads),
+        ) as executor:
+            shard_futures = [
+                executor.submit(score_shard, input_file, output_file, batch_size)
+                for input_file, output_file in pending.items()
+            ]
+            for num_done, future in enumerate(futures.as_completed(shard_futures), 1):
+                num_instances += future.result()
+                logging.info(f"Scored {num_done} of {len(pending)} shards.")
+
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Scored {num_instances} instances in {elapsed:.1f} s "
+        f"({num_instances / elapsed:.0f} instances/s) with {num_workers} workers."
+    )
+    return predictions_dir
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", required=True, type=str)
+    parser.add_argument("--input-pattern", required=True, type=str)
+    parser.add_argument("--output-dir", required=True, type=str)
+    parser.add_argument("--num-workers", type=int)
+    parser.add_argument("--batch-size", default=4096, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    run_batch_scoring(
+        args.model_dir,
+        args.input_pattern,
+        args.output_dir,
+        args.num_workers,
+        args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,209 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Dynamic batching of concurrent prediction requests, and serving metrics."""
+
+import bisect
+import logging
+import queue
+import threading
+import time
+from concurrent import futures
+
+# Histogram bucket upper bounds.
+LATENCY_BUCKETS_SECONDS = [
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+class Histogram:
+    """A thread-safe cumulative histogram, exported in the Prometheus format."""
+
+    def __init__(self, name, buckets, description=""):
+        self.name = name
+        self.buckets = list(buckets)
+        self.description = description
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        with self._lock:
+            return sum(self._counts)
+
+    def to_prometheus(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        cumulative_count = 0
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            cumulative_count += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative_count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative_count}")
+        return "\n".join(lines)
+
+
+class _Request:
+    def __init__(self, instances):
+        self.instances = instances
+        self.future = futures.Future()
+        self.enqueue_time = time.perf_counter()
+
+
+class DynamicBatcher:
+    """Coalesces concurrent requests into batches for one predict_fn call.
+
+    A batch is run as soon as it holds max_batch_size instances, or
+    max_wait_seconds after its first request was queued. Requests are never
+    split: a request larger than max_batch_size runs as a batch of its own.
+    When a batch fails, its requests are run again one by one, so a bad
+    request does not fail the requests batched with it.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_seconds=0.005):
+        """
+        Args:
+          predict_fn: returns the list of predictions of a list of instances.
+          max_batch_size: the maximum number of instances per batch.
+          max_wait_seconds: how long a request waits for others to join its batch.
+        """
+        self._predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queue = queue.Queue()
+        self._pending_request = None
+        self._thread = None
+        self.latency_histogram = Histogram(
+            "request_latency_seconds",
+            LATENCY_BUCKETS_SECONDS,
+            "Time from queueing a request to its predictions.",
+        )
+        self.batch_size_histogram = Histogram(
+            "batch_size", BATCH_SIZE_BUCKETS, "Instances per predict_fn call."
+        )
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def predict(self, instances):
+        """Returns the predictions of instances, once their batch has run."""
+        request = _Request(instances)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _next_batch(self):
+        """Returns the next batch of requests, or None once stopped."""
+        first_request = self._pending_request or self._queue.get()
+        self._pending_request = None
+        if first_request is None:
+            return None
+        batch = [first_request]
+        batch_size = len(first_request.instances)
+        deadline = first_request.enqueue_time + self.max_wait_seconds
+        while batch_size < self.max_batch_size:
+            # Queued requests join the batch even past the deadline: under
+            # load, the first request has often waited longer than that.
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if request is None:
+                # Runs this batch, then stops.
+                self._queue.put(None)
+                break
+            if batch_size + len(request.instances) > self.max_batch_size:
+                # Starts the next batch.
+                self._pending_request = request
+                break
+            batch.append(request)
+            batch_size += len(request.instances)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self.batch_size_histogram.observe(
+                sum(len(request.instances) for request in batch)
+            )
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        instances = [
+            instance for request in batch for instance in request.instances
+        ]
+        try:
+            predictions = self._predict_fn(instances)
+        except Exception as error:  # Failed requests must not stop the batcher.
+            if len(batch) == 1:
+                logging.exception("Prediction failed.")
+                batch[0].future.set_exception(error)
+                self._observe_latencies(batch)
+                return
+            logging.warning(
+                f"Prediction of a batch of {len(batch)} requests failed: {error!r}. "
+                "Retrying each request on its own."
+            )
+        else:
+            start = 0
+            for request in batch:
+                end = start + len(request.instances)
+                request.future.set_result(predictions[start:end])
+                start = end
+            self._observe_latencies(batch)
+            return
+
+        # Only the requests that fail on their own get the exception.
+        for request in batch:
+            self._run_batch([request])
+
+    def _observe_latencies(self, batch):
+        end_time = time.perf_counter()
+        for request in batch:
+            self.latency_histogram.observe(end_time - request.enqueue_time)
@@ -0,0 +1,177 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A local prediction server standing in for a Vertex AI endpoint.
+
+It serves the serving_default signature of a model exported by
+exporter.export_serving_model, with the Vertex AI request and response
+formats: {"instances": [...]} and {"predictions": [...]}. Concurrent requests
+are batched into one signature call. Latency and batch size histograms are
+exported on /metrics, in the Prometheus text format.
+
+    python -m src.model_serving.server --model-dir=... \
+        --max-batch-size=64 --max-batch-wait-ms=5
+"""
+
+import argparse
+import json
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import tensorflow as tf
+
+from src.model_serving import batching
+
+SIGNATURE_NAME = "serving_default"
+METRICS_ROUTE = "/metrics"
+# Set by Vertex AI in custom serving containers.
+DEFAULT_PORT = int(os.getenv("AIP_HTTP_PORT", "8080"))
+PREDICT_ROUTE = os.getenv("AIP_PREDICT_ROUTE", "/predict")
+HEALTH_ROUTE = os.getenv("AIP_HEALTH_ROUTE", "/health")
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return [_to_json(item) for item in value]
+    if isinstance(value, bytes):
+        return value.decode()
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def load_predict_fn(model_dir, signature_name=SIGNATURE_NAME):
+    """Returns a function from a list of instances to their predictions.
+
+    Each instance maps every signature input name to a list of one value, as in
+    the requests to the Vertex AI endpoint.
+    """
+    saved_model = tf.saved_model.load(model_dir)
+    signature = saved_model.signatures[signature_name]
+    input_specs = signature.structured_input_signature[1]
+
+    def predict_fn(instances):
+        inputs = {
+            name: tf.constant(
+                [instance[name] for instance in instances], dtype=spec.dtype
+            )
+            for name, spec in input_specs.items()
+        }
+        outputs = {name: value.numpy() for name, value in signature(**inputs).items()}
+        return [
+            {name: _to_json(values[index]) for name, values in outputs.items()}
+            for index in range(len(instances))
+        ]
+
+    # The signature does not keep the loaded model alive.
+    predict_fn.saved_model = saved_model
+    return predict_fn
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _respond(self, status, body, content_type="application/json"):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == HEALTH_ROUTE:
+            self._respond(200, {})
+        elif self.path == METRICS_ROUTE:
+            self._respond(200, self.server.metrics_text(), "text/plain")
+        else:
+            self._respond(404, {"error": f"Unknown route {self.path}."})
+
+    def do_POST(self):
+        if self.path != PREDICT_ROUTE:
+            self._respond(404, {"error": f"Unknown route {self.path}."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            instances = json.loads(self.rfile.read(length))["instances"]
+        except (ValueError, KeyError, TypeError) as error:
+            self._respond(400, {"error": f"Invalid request: {error}"})
+            return
+        try:
+            predictions = self.server.batcher.predict(instances)
+        except (ValueError, KeyError, tf.errors.InvalidArgumentError) as error:
+            self._respond(400, {"error": f"Invalid instances: {error}"})
+            return
+        self._respond(200, {"predictions": predictions})
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """Serves a batching.DynamicBatcher over HTTP, one thread per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, batcher, port=DEFAULT_PORT, host=""):
+        super().__init__((host, port), _Handler)
+        self.batcher = batcher
+
+    def metrics_text(self):
+        return (
+            "\n".join(
+                histogram.to_prometheus()
+                for histogram in [
+                    self.batcher.latency_histogram,
+                    self.batcher.batch_size_histogram,
+                ]
+            )
+            + "\n"
+        )
+
+
+def create_server(model_dir, port=DEFAULT_PORT, max_batch_size=64, max_batch_wait_ms=5):
+    """Returns a server of the model, with its batcher started."""
+    logging.info(f"Loading the model from {model_dir}")
+    batcher = batching.DynamicBatcher(
+        load_predict_fn(model_dir),
+        max_batch_size=max_batch_size,
+        max_wait_seconds=max_batch_wait_ms / 1000,
+    ).start()
+    return PredictionServer(batcher, port)
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model-dir", default=os.getenv("AIP_STORAGE_URI"), type=str
+    )
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int)
+    parser.add_argument("--max-batch-size", default=64, type=int)
+    parser.add_argument("--max-batch-wait-ms", default=5, type=float)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    server = create_server(
+        args.model_dir, args.port, args.max_batch_size, args.max_batch_wait_ms
+    )
+    logging.info(f"Serving predictions on port {server.server_address[1]}...")
+    try:
+        server.serve_forever()
+    finally:
+        server.batcher.stop()
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,104 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Training checkpoints, to resume a preempted training job."""
+
+import os
+import logging
+
+import tensorflow as tf
+from tensorflow import keras
+
+from src.model_training import distribution
+
+MAX_CHECKPOINTS_TO_KEEP = 3
+
+
+def _get_save_dir(checkpoint_dir):
+    """Returns where this task writes checkpoints.
+
+    Every multi-worker replica must save, but only the chief writes to
+    checkpoint_dir. The other workers write to a directory deleted after training.
+    """
+    if distribution.is_chief():
+        return checkpoint_dir
+    task = distribution.get_tf_config().get("task", {})
+    return os.path.join(
+        checkpoint_dir, "workers", f"{task.get('type')}-{task.get('index', 0)}"
+    )
+
+
+class CheckpointCallback(keras.callbacks.Callback):
+    """Saves the model, optimizer, and epoch during training, and restores them.
+
+    A checkpoint is written at the end of every epoch, and every
+    checkpoint_interval training steps if it is set. Only the last
+    MAX_CHECKPOINTS_TO_KEEP checkpoints are kept.
+    """
+
+    def __init__(self, classifier, checkpoint_dir, checkpoint_interval=0):
+        super().__init__()
+        self._checkpoint_dir = checkpoint_dir
+        self._save_dir = _get_save_dir(checkpoint_dir)
+        self._checkpoint_interval = int(checkpoint_interval)
+        self._epoch = tf.Variable(0, trainable=False, dtype=tf.int64)
+        self._checkpoint = tf.train.Checkpoint(
+            model=classifier, optimizer=classifier.optimizer, epoch=self._epoch
+        )
+        self._manager = tf.train.CheckpointManager(
+            self._checkpoint, self._save_dir, max_to_keep=MAX_CHECKPOINTS_TO_KEEP
+        )
+        self._last_saved_step = 0
+
+    def restore(self):
+        """Restores the latest checkpoint, and returns the epoch to resume from.
+
+        Returns None if there is no checkpoint to resume from.
+        """
+        latest_checkpoint = tf.train.latest_checkpoint(self._checkpoint_dir)
+        if not latest_checkpoint:
+            return None
+        self._checkpoint.restore(latest_checkpoint)
+        logging.info(
+            f"Resuming training at epoch {int(self._epoch.numpy())} "
+            f"from {latest_checkpoint}"
+        )
+        return int(self._epoch.numpy())
+
+    def _save(self):
+        step = int(self.model.optimizer.iterations.numpy())
+        self._manager.save(checkpoint_number=step)
+        self._last_saved_step = step
+
+    def on_train_begin(self, logs=None):
+        self._last_saved_step = int(self.model.optimizer.iterations.numpy())
+
+    def on_epoch_begin(self, epoch, logs=None):
+        # Checkpoints saved within an epoch resume at the start of that epoch.
+        self._epoch.assign(epoch)
+
+    def on_train_batch_end(self, batch, logs=None):
+        if not self._checkpoint_interval:
+            return
+        # With steps_per_execution, batches end every several optimizer steps.
+        step = int(self.model.optimizer.iterations.numpy())
+        if step - self._last_saved_step >= self._checkpoint_interval:
+            self._save()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._epoch.assign(epoch + 1)
+        self._save()
+
+    def on_train_end(self, logs=None):
+        if self._save_dir != self._checkpoint_dir:
+            tf.io.gfile.rmtree(self._save_dir)
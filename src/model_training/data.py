@@ -15,7 +15,10 @@
 
 import tensorflow as tf
 
-from src.common import features
+from src.common import features, data_manifest
+
+NO_CACHE = "none"
+MEMORY_CACHE = "memory"
 
 
 def _gzip_reader_fn(filenames):
@@ -23,26 +26,218 @@ def _gzip_reader_fn(filenames):
     return tf.data.TFRecordDataset(filenames, compression_type="GZIP")
 
 
-def get_dataset(file_pattern, feature_spec, batch_size=200):
+def _get_reader_fn(compression_type):
+    """Returns a record reader for the given TFRecord codec."""
+    compression_type = data_manifest.validate_compression_type(compression_type)
+    if compression_type == "GZIP":
+        return _gzip_reader_fn
+
+    def reader_fn(filenames):
+        return tf.data.TFRecordDataset(
+            filenames,
+            compression_type=data_manifest.COMPRESSION_TYPES[compression_type],
+        )
+
+    return reader_fn
+
+
+def _apply_cache(dataset, cache):
+    """Caches the dataset in memory, or on disk if cache is a file prefix."""
+    if not cache or cache == NO_CACHE:
+        return dataset
+    if cache == MEMORY_CACHE:
+        return dataset.cache()
+    return dataset.cache(cache)
+
+
+def _glob(file_pattern):
+    """Returns the files matching a file pattern, or any of a list of patterns."""
+    if isinstance(file_pattern, (list, tuple)):
+        return [
+            file_path
+            for pattern in file_pattern
+            for file_path in tf.io.gfile.glob(pattern)
+        ]
+    return tf.io.gfile.glob(file_pattern)
+
+
+def _read_parquet_batches(file_pattern, columns, batch_size, shuffle):
+    """Yields dictionaries of column arrays with batch_size rows each.
+
+    Whole files are decoded column-wise by pyarrow; there is no per-example
+    parsing. The final partial batch is dropped.
+    """
+    import numpy as np
+    import pyarrow.parquet as pq
+
+    rng = np.random.default_rng()
+    file_paths = _glob(file_pattern)
+    if shuffle:
+        rng.shuffle(file_paths)
+
+    remainder = None
+    for file_path in file_paths:
+        with tf.io.gfile.GFile(file_path, "rb") as f:
+            table = pq.read_table(f, columns=columns, use_threads=True)
+        values = {name: table.column(name).to_numpy() for name in columns}
+        if shuffle:
+            permutation = rng.permutation(table.num_rows)
+            values = {name: column[permutation] for name, column in values.items()}
+        if remainder:
+            values = {
+                name: np.concatenate([remainder[name], column])
+                for name, column in values.items()
+            }
+
+        num_rows = len(values[columns[0]])
+        end = num_rows - num_rows % batch_size
+        for start in range(0, end, batch_size):
+            yield {
+                name: column[start : start + batch_size]
+                for name, column in values.items()
+            }
+        remainder = {name: column[end:] for name, column in values.items()}
+
+
+def _get_input_shard(file_pattern, input_context):
+    """Returns the files read by this input pipeline.
+
+    Returns None if there are fewer files than input pipelines, in which case
+    the pipelines have to shard the batches instead.
+    """
+    file_paths = sorted(_glob(file_pattern))
+    if len(file_paths) < input_context.num_input_pipelines:
+        return None
+    return file_paths[
+        input_context.input_pipeline_id :: input_context.num_input_pipelines
+    ]
+
+
+def _get_parquet_dataset(file_pattern, feature_spec, batch_size, shuffle):
+    """Returns a dataset of batched columns read from Parquet files."""
+    columns = sorted(feature_spec.keys())
+    output_signature = {
+        name: tf.TensorSpec(shape=[batch_size], dtype=feature_spec[name].dtype)
+        for name in columns
+    }
+    dataset = tf.data.Dataset.from_generator(
+        lambda: _read_parquet_batches(file_pattern, columns, batch_size, shuffle),
+        output_signature=output_signature,
+    )
+
+    def split_label(batch):
+        label = batch.pop(features.TARGET_FEATURE_NAME)
+        return batch, label
+
+    return dataset.map(split_label)
+
+
+def get_dataset(
+    file_pattern,
+    feature_spec,
+    batch_size=200,
+    num_epochs=1,
+    shuffle=True,
+    shuffle_buffer_size=10000,
+    num_parallel_reads=tf.data.AUTOTUNE,
+    num_parallel_calls=tf.data.AUTOTUNE,
+    prefetch_buffer_size=tf.data.AUTOTUNE,
+    cache=None,
+    compression_type=None,
+    data_format=None,
+    input_context=None,
+):
     """Generates features and label for tuning/training.
     Args:
-      file_pattern: input tfrecord file pattern.
+      file_pattern: input tfrecord or parquet file pattern, or list of patterns.
       feature_spec: a dictionary of feature specifications.
       batch_size: representing the number of consecutive elements of returned
         dataset to combine in a single batch
+      num_epochs: number of times to read through the data. None repeats the
+        dataset indefinitely.
+      shuffle: whether to shuffle the files and the records.
+      shuffle_buffer_size: size of the record shuffle buffer.
+      num_parallel_reads: number of files read (and decompressed) in parallel,
+        interleaved into a single stream. tf.data.AUTOTUNE lets tf.data decide.
+      num_parallel_calls: number of threads used to parse batches of records.
+      prefetch_buffer_size: number of batches to prefetch.
+      cache: "memory" to cache the parsed batches in memory, a file prefix to
+        cache them on disk, or None / "none" to disable caching. Caching is only
+        applied when shuffle is False, since a cached dataset replays the same
+        order every epoch.
+      compression_type: TFRecord codec, one of "NONE", "GZIP" or "ZLIB". If None,
+        the codec recorded in the transformed data manifest is used.
+      data_format: "tfrecord" or "parquet". If None, the format recorded in the
+        transformed data manifest is used.
+      input_context: a tf.distribute.InputContext when the dataset is created
+        per input pipeline of a distribution strategy. batch_size is then the
+        global batch size, and each input pipeline reads a disjoint shard of
+        the files, batched with the per-replica batch size.
     Returns:
       A dataset that contains (features, indices) tuple where features is a
         dictionary of Tensors, and indices is a single Tensor of label indices.
     """
 
+    manifest = data_manifest.read_manifest(file_pattern) or {}
+    if compression_type is None:
+        compression_type = manifest.get(
+            "compression_type", data_manifest.DEFAULT_COMPRESSION_TYPE
+        )
+    data_format = data_manifest.validate_data_format(
+        data_format or manifest.get("data_format")
+    )
+
+    caching = cache and cache != NO_CACHE and not shuffle
+
+    shard_batches = False
+    if input_context:
+        batch_size = input_context.get_per_replica_batch_size(batch_size)
+        if input_context.num_input_pipelines > 1:
+            file_shard = _get_input_shard(file_pattern, input_context)
+            shard_batches = file_shard is None
+            if file_shard:
+                file_pattern = file_shard
+
+    if data_format == data_manifest.PARQUET_FORMAT:
+        dataset = _get_parquet_dataset(
+            file_pattern, feature_spec, batch_size, shuffle
+        )
+        if shard_batches:
+            dataset = dataset.shard(
+                input_context.num_input_pipelines, input_context.input_pipeline_id
+            )
+        if caching:
+            dataset = _apply_cache(dataset, cache)
+        if num_epochs != 1:
+            dataset = dataset.repeat(num_epochs)
+        return dataset.prefetch(prefetch_buffer_size)
+
     dataset = tf.data.experimental.make_batched_features_dataset(
         file_pattern=file_pattern,
         batch_size=batch_size,
         features=feature_spec,
         label_key=features.TARGET_FEATURE_NAME,
-        reader=_gzip_reader_fn,
-        num_epochs=1,
+        reader=_get_reader_fn(compression_type),
+        # A cached dataset is repeated after the cache step instead.
+        num_epochs=1 if caching else num_epochs,
+        shuffle=shuffle,
+        shuffle_buffer_size=shuffle_buffer_size,
+        reader_num_threads=num_parallel_reads,
+        parser_num_threads=num_parallel_calls,
+        prefetch_buffer_size=prefetch_buffer_size,
+        sloppy_ordering=shuffle,
         drop_final_batch=True,
     )
 
+    if shard_batches:
+        dataset = dataset.shard(
+            input_context.num_input_pipelines, input_context.input_pipeline_id
+        )
+
+    if caching:
+        dataset = _apply_cache(dataset, cache)
+        if num_epochs != 1:
+            dataset = dataset.repeat(num_epochs)
+        dataset = dataset.prefetch(prefetch_buffer_size)
+
     return dataset
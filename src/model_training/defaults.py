@@ -23,6 +23,39 @@ BATCH_SIZE = 512
 NUM_EPOCHS = 10
 NUM_EVAL_STEPS = 100
 
+# Validation accuracy, as reported to the Vertex AI hyperparameter tuning service.
+HYPERTUNE_METRIC_NAME = "ACCURACY"
+
+# Input pipeline settings. -1 stands for tf.data.AUTOTUNE.
+SHUFFLE_BUFFER_SIZE = 10000
+NUM_PARALLEL_READS = -1
+NUM_PARALLEL_CALLS = -1
+PREFETCH_BUFFER_SIZE = -1
+# "none", "memory", or a file prefix to cache the eval split on disk.
+EVAL_CACHE = "memory"
+
+# tf.distribute settings. "auto" picks the strategy from TF_CONFIG and devices.
+DISTRIBUTION_STRATEGY = "auto"
+NUM_CPU_REPLICAS = 1
+# 0 trains on one pass over the data per epoch. Required with parameter servers.
+STEPS_PER_EPOCH = 0
+
+# Training step settings. The model is small, so per-step dispatch overhead
+# matters: XLA fuses its ops, and steps_per_execution runs several steps per
+# host call. MIXED_PRECISION is a Keras policy name such as "mixed_bfloat16".
+JIT_COMPILE = False
+MIXED_PRECISION = "float32"
+STEPS_PER_EXECUTION = 1
+
+# Training steps between checkpoints, on top of the one saved at each epoch end.
+CHECKPOINT_INTERVAL = 1000
+
+# Successive halving of hyperparameter trials: trials are pruned after
+# SCHEDULER_MIN_EPOCHS * SCHEDULER_REDUCTION_FACTOR ** k epochs, unless they are
+# in the top 1 / SCHEDULER_REDUCTION_FACTOR of the trials so far.
+SCHEDULER_MIN_EPOCHS = 1
+SCHEDULER_REDUCTION_FACTOR = 3
+
 
 def update_hyperparams(hyperparams: dict) -> dict:
     if "hidden_units" not in hyperparams:
@@ -38,4 +71,32 @@ def update_hyperparams(hyperparams: dict) -> dict:
         hyperparams["batch_size"] = BATCH_SIZE
     if "num_epochs" not in hyperparams:
         hyperparams["num_epochs"] = NUM_EPOCHS
+    if "shuffle_buffer_size" not in hyperparams:
+        hyperparams["shuffle_buffer_size"] = SHUFFLE_BUFFER_SIZE
+    if "num_parallel_reads" not in hyperparams:
+        hyperparams["num_parallel_reads"] = NUM_PARALLEL_READS
+    if "num_parallel_calls" not in hyperparams:
+        hyperparams["num_parallel_calls"] = NUM_PARALLEL_CALLS
+    if "prefetch_buffer_size" not in hyperparams:
+        hyperparams["prefetch_buffer_size"] = PREFETCH_BUFFER_SIZE
+    if "eval_cache" not in hyperparams:
+        hyperparams["eval_cache"] = EVAL_CACHE
+    if "distribution_strategy" not in hyperparams:
+        hyperparams["distribution_strategy"] = DISTRIBUTION_STRATEGY
+    if "num_cpu_replicas" not in hyperparams:
+        hyperparams["num_cpu_replicas"] = NUM_CPU_REPLICAS
+    if "steps_per_epoch" not in hyperparams:
+        hyperparams["steps_per_epoch"] = STEPS_PER_EPOCH
+    if "jit_compile" not in hyperparams:
+        hyperparams["jit_compile"] = JIT_COMPILE
+    if "mixed_precision" not in hyperparams:
+        hyperparams["mixed_precision"] = MIXED_PRECISION
+    if "steps_per_execution" not in hyperparams:
+        hyperparams["steps_per_execution"] = STEPS_PER_EXECUTION
+    if "checkpoint_interval" not in hyperparams:
+        hyperparams["checkpoint_interval"] = CHECKPOINT_INTERVAL
+    if "scheduler_min_epochs" not in hyperparams:
+        hyperparams["scheduler_min_epochs"] = SCHEDULER_MIN_EPOCHS
+    if "scheduler_reduction_factor" not in hyperparams:
+        hyperparams["scheduler_reduction_factor"] = SCHEDULER_REDUCTION_FACTOR
     return hyperparams
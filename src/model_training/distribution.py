@@ -0,0 +1,177 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""tf.distribute strategy selection for training.
+
+The cluster is described by the TF_CONFIG environment variable, as set by
+Vertex AI for multi-replica worker pools.
+"""
+
+import os
+import json
+import logging
+
+import tensorflow as tf
+
+NO_STRATEGY = "none"
+AUTO_STRATEGY = "auto"
+MIRRORED_STRATEGY = "mirrored"
+MULTI_WORKER_MIRRORED_STRATEGY = "multi_worker_mirrored"
+PARAMETER_SERVER_STRATEGY = "parameter_server"
+STRATEGIES = [
+    NO_STRATEGY,
+    AUTO_STRATEGY,
+    MIRRORED_STRATEGY,
+    MULTI_WORKER_MIRRORED_STRATEGY,
+    PARAMETER_SERVER_STRATEGY,
+]
+
+# Embedding tables larger than this are partitioned across parameter servers.
+MIN_SHARD_BYTES = 256 << 10
+
+
+def get_tf_config():
+    return json.loads(os.environ.get("TF_CONFIG", "{}"))
+
+
+def _num_workers(tf_config):
+    cluster = tf_config.get("cluster", {})
+    return len(cluster.get("chief", [])) + len(cluster.get("worker", []))
+
+
+def is_chief(tf_config=None):
+    """Returns True if this task should write the model, logs, and metrics."""
+    tf_config = get_tf_config() if tf_config is None else tf_config
+    task = tf_config.get("task", {})
+    task_type = task.get("type")
+    if not task_type or task_type == "chief":
+        return True
+    # Without a chief, the first worker acts as chief.
+    return (
+        task_type == "worker"
+        and task.get("index", 0) == 0
+        and "chief" not in tf_config.get("cluster", {})
+    )
+
+
+def resolve_strategy_name(strategy_name, tf_config=None):
+    """Returns the strategy to use, resolving "auto" from TF_CONFIG and devices."""
+    tf_config = get_tf_config() if tf_config is None else tf_config
+    strategy_name = (strategy_name or AUTO_STRATEGY).lower()
+    if strategy_name not in STRATEGIES:
+        raise ValueError(
+            f"Invalid distribution strategy {strategy_name}. "
+            f"Supported strategies: {STRATEGIES}."
+        )
+    if strategy_name != AUTO_STRATEGY:
+        return strategy_name
+
+    if tf_config.get("cluster", {}).get("ps"):
+        return PARAMETER_SERVER_STRATEGY
+    if _num_workers(tf_config) > 1:
+        return MULTI_WORKER_MIRRORED_STRATEGY
+    if len(tf.config.list_physical_devices("GPU")) > 1:
+        return MIRRORED_STRATEGY
+    return NO_STRATEGY
+
+
+def _configure_cpu_replicas(num_cpu_replicas):
+    """Splits the CPU into num_cpu_replicas logical devices."""
+    cpus = tf.config.list_physical_devices("CPU")
+    tf.config.set_logical_device_configuration(
+        cpus[0],
+        [tf.config.LogicalDeviceConfiguration() for _ in range(num_cpu_replicas)],
+    )
+
+
+def is_parameter_server_task(strategy_name):
+    """Returns True if this task serves variables or runs steps for the chief."""
+    if resolve_strategy_name(strategy_name) != PARAMETER_SERVER_STRATEGY:
+        return False
+    return get_tf_config().get("task", {}).get("type") in ["worker", "ps"]
+
+
+def run_parameter_server_task():
+    """Starts the server of a parameter server strategy worker or ps task."""
+    cluster_resolver = tf.distribute.cluster_resolver.TFConfigClusterResolver()
+    logging.info(
+        f"Starting {cluster_resolver.task_type} {cluster_resolver.task_id} server..."
+    )
+    server = tf.distribute.Server(
+        cluster_resolver.cluster_spec(),
+        job_name=cluster_resolver.task_type,
+        task_index=cluster_resolver.task_id,
+        protocol=cluster_resolver.rpc_layer or "grpc",
+        start=True,
+    )
+    server.join()
+
+
+def get_strategy(strategy_name=AUTO_STRATEGY, num_cpu_replicas=1):
+    """Returns the tf.distribute strategy to build and train the model in.
+
+    Args:
+      strategy_name: one of STRATEGIES. "auto" picks the parameter server
+        strategy if TF_CONFIG lists ps tasks, the multi-worker mirrored strategy
+        if it lists several workers, the mirrored strategy on multi-GPU hosts,
+        and the default strategy otherwise.
+      num_cpu_replicas: number of replicas the mirrored strategy creates on the
+        CPU when there is no GPU. Must be set before TensorFlow initializes its
+        devices.
+    Returns:
+      A tf.distribute.Strategy.
+    """
+    strategy_name = resolve_strategy_name(strategy_name)
+    logging.info(f"Distribution strategy: {strategy_name}")
+
+    if strategy_name == MULTI_WORKER_MIRRORED_STRATEGY:
+        return tf.distribute.MultiWorkerMirroredStrategy()
+
+    if strategy_name == PARAMETER_SERVER_STRATEGY:
+        cluster_resolver = tf.distribute.cluster_resolver.TFConfigClusterResolver()
+        num_ps = len(cluster_resolver.cluster_spec().as_dict().get("ps", []))
+        return tf.distribute.experimental.ParameterServerStrategy(
+            cluster_resolver,
+            variable_partitioner=tf.distribute.experimental.partitioners.MinSizePartitioner(
+                min_shard_bytes=MIN_SHARD_BYTES, max_shards=num_ps
+            ),
+        )
+
+    if strategy_name == MIRRORED_STRATEGY:
+        devices = tf.config.list_logical_devices("GPU")
+        if not devices:
+            if num_cpu_replicas > 1:
+                _configure_cpu_replicas(num_cpu_replicas)
+            devices = tf.config.list_logical_devices("CPU")
+        return tf.distribute.MirroredStrategy(
+            devices=[device.name for device in devices]
+        )
+
+    return tf.distribute.get_strategy()
+
+
+def is_parameter_server_strategy(strategy):
+    return isinstance(strategy, tf.distribute.experimental.ParameterServerStrategy)
+
+
+def distribute_dataset(strategy, dataset_fn):
+    """Creates the input of Model.fit from a per-input-pipeline dataset_fn.
+
+    dataset_fn receives a tf.distribute.InputContext, used to shard the files
+    and derive the per-replica batch size from the global batch size.
+    """
+    if is_parameter_server_strategy(strategy):
+        return tf.keras.utils.experimental.DatasetCreator(dataset_fn)
+    if strategy.num_replicas_in_sync == 1 and not _num_workers(get_tf_config()) > 1:
+        return dataset_fn(tf.distribute.InputContext())
+    return strategy.distribute_datasets_from_function(dataset_fn)
@@ -0,0 +1,227 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compact embedding layers for high-cardinality categorical features.
+
+Inputs are the vocabulary indices produced by tft.compute_and_apply_vocabulary,
+ordered by decreasing frequency, followed by the OOV bucket indices.
+"""
+
+import math
+
+import tensorflow as tf
+from tensorflow import keras
+
+from src.common import features
+
+
+class CompactEmbedding(keras.layers.Layer):
+    """Base class of embeddings without one row per vocabulary index."""
+
+    def __init__(self, output_dim, embeddings_initializer="uniform", **kwargs):
+        super().__init__(**kwargs)
+        self.output_dim = output_dim
+        self.embeddings_initializer = keras.initializers.get(embeddings_initializer)
+
+    def _add_table(self, name, num_rows, output_dim):
+        return self.add_weight(
+            name=name,
+            shape=[num_rows, output_dim],
+            initializer=self.embeddings_initializer,
+        )
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            {
+                "output_dim": self.output_dim,
+                "embeddings_initializer": keras.initializers.serialize(
+                    self.embeddings_initializer
+                ),
+            }
+        )
+        return config
+
+
+class HashEmbedding(CompactEmbedding):
+    """Shares num_buckets rows among the indices with the hashing trick.
+
+    Indices are hashed by their remainder: the num_buckets most frequent values
+    keep a row of their own, and the other values share those rows.
+    """
+
+    def __init__(self, num_buckets, output_dim, **kwargs):
+        super().__init__(output_dim, **kwargs)
+        self.num_buckets = num_buckets
+
+    def build(self, input_shape):
+        self.embeddings = self._add_table(
+            "embeddings", self.num_buckets, self.output_dim
+        )
+        super().build(input_shape)
+
+    def call(self, inputs):
+        inputs = tf.cast(inputs, tf.int64)
+        return tf.nn.embedding_lookup(
+            self.embeddings, tf.math.floormod(inputs, self.num_buckets)
+        )
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({"num_buckets": self.num_buckets})
+        return config
+
+
+class QuotientRemainderEmbedding(CompactEmbedding):
+    """Quotient-remainder compositional embedding.
+
+    An index is embedded as the element-wise product of the rows of its
+    quotient and its remainder by num_buckets, so every index has a distinct
+    embedding with about input_dim / num_buckets + num_buckets rows.
+    """
+
+    def __init__(self, input_dim, num_buckets, output_dim, **kwargs):
+        super().__init__(output_dim, **kwargs)
+        self.input_dim = input_dim
+        self.num_buckets = num_buckets
+
+    def build(self, input_shape):
+        self.quotient_embeddings = self._add_table(
+            "quotient_embeddings",
+            math.ceil(self.input_dim / self.num_buckets),
+            self.output_dim,
+        )
+        self.remainder_embeddings = self._add_table(
+            "remainder_embeddings", self.num_buckets, self.output_dim
+        )
+        super().build(input_shape)
+
+    def call(self, inputs):
+        inputs = tf.cast(inputs, tf.int64)
+        quotient = tf.nn.embedding_lookup(
+            self.quotient_embeddings, tf.math.floordiv(inputs, self.num_buckets)
+        )
+        remainder = tf.nn.embedding_lookup(
+            self.remainder_embeddings, tf.math.floormod(inputs, self.num_buckets)
+        )
+        return quotient * remainder
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({"input_dim": self.input_dim, "num_buckets": self.num_buckets})
+        return config
+
+
+class MixedDimensionEmbedding(CompactEmbedding):
+    """Mixed-dimension embedding over two frequency blocks.
+
+    The head_size most frequent indices have output_dim rows. The remaining
+    indices have tail_output_dim rows, projected to output_dim.
+    """
+
+    def __init__(self, input_dim, head_size, output_dim, tail_output_dim, **kwargs):
+        super().__init__(output_dim, **kwargs)
+        self.input_dim = input_dim
+        self.head_size = min(head_size, input_dim)
+        self.tail_output_dim = tail_output_dim
+
+    def build(self, input_shape):
+        self.head_embeddings = self._add_table(
+            "head_embeddings", self.head_size, self.output_dim
+        )
+        self.tail_embeddings = self._add_table(
+            "tail_embeddings",
+            max(self.input_dim - self.head_size, 1),
+            self.tail_output_dim,
+        )
+        self.tail_projection = self.add_weight(
+            name="tail_projection",
+            shape=[self.tail_output_dim, self.output_dim],
+            initializer="glorot_uniform",
+        )
+        super().build(input_shape)
+
+    def call(self, inputs):
+        inputs = tf.cast(inputs, tf.int64)
+        is_head = inputs < self.head_size
+        head = tf.nn.embedding_lookup(
+            self.head_embeddings, tf.minimum(inputs, self.head_size - 1)
+        )
+        tail = tf.nn.embedding_lookup(
+            self.tail_embeddings, tf.maximum(inputs - self.head_size, 0)
+        )
+        tail = tf.tensordot(tail, self.tail_projection, axes=1)
+        return tf.where(tf.expand_dims(is_head, -1), head, tail)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            {
+                "input_dim": self.input_dim,
+                "head_size": self.head_size,
+                "tail_output_dim": self.tail_output_dim,
+            }
+        )
+        return config
+
+
+def _required(config, key, feature_name):
+    if not config[key]:
+        raise ValueError(
+            f"{key} must be set for the {config['embedding_mode']} embedding "
+            f"of {feature_name}."
+        )
+    return config[key]
+
+
+def create_embedding(feature_name, input_dim, name):
+    """Returns the embedding layer configured for feature_name.
+
+    Args:
+      feature_name: a key of features.EMBEDDING_CATEGORICAL_FEATURES.
+      input_dim: the number of indices: vocabulary size plus OOV buckets.
+      name: the layer name.
+    """
+    config = features.embedding_config(feature_name)
+    embedding_mode = config["embedding_mode"]
+    embedding_size = config["embedding_size"]
+
+    if embedding_mode == features.DENSE_EMBEDDING:
+        return keras.layers.Embedding(
+            input_dim=input_dim, output_dim=embedding_size, name=name
+        )
+    if embedding_mode == features.HASH_EMBEDDING:
+        return HashEmbedding(
+            num_buckets=_required(config, "num_buckets", feature_name),
+            output_dim=embedding_size,
+            name=name,
+        )
+    if embedding_mode == features.QUOTIENT_REMAINDER_EMBEDDING:
+        return QuotientRemainderEmbedding(
+            input_dim=input_dim,
+            num_buckets=_required(config, "num_buckets", feature_name),
+            output_dim=embedding_size,
+            name=name,
+        )
+    if embedding_mode == features.MIXED_DIMENSION_EMBEDDING:
+        return MixedDimensionEmbedding(
+            input_dim=input_dim,
+            head_size=_required(config, "head_size", feature_name),
+            output_dim=embedding_size,
+            tail_output_dim=_required(config, "tail_embedding_size", feature_name),
+            name=name,
+        )
+    raise ValueError(
+        f"Invalid embedding mode {embedding_mode} for {feature_name}. "
+        f"Supported modes: {features.EMBEDDING_MODES}."
+    )
@@ -0,0 +1,129 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming evaluation metrics of the classifier, computed from its logits."""
+
+import tensorflow as tf
+from tensorflow import keras
+
+# Probability thresholds of the precision and recall metrics.
+THRESHOLDS = [0.25, 0.5, 0.75]
+NUM_CALIBRATION_BINS = 10
+
+
+class _FromLogits:
+    """Applies the sigmoid to the logits before updating a probability metric."""
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        return super().update_state(
+            y_true, tf.sigmoid(tf.cast(y_pred, tf.float32)), sample_weight
+        )
+
+
+class AUC(_FromLogits, keras.metrics.AUC):
+    pass
+
+
+class Precision(_FromLogits, keras.metrics.Precision):
+    pass
+
+
+class Recall(_FromLogits, keras.metrics.Recall):
+    pass
+
+
+class Calibration(keras.metrics.Metric):
+    """The mean predicted probability over the mean label. 1 is well calibrated."""
+
+    def __init__(self, name="calibration", **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.predictions = self.add_weight("predictions", initializer="zeros")
+        self.labels = self.add_weight("labels", initializer="zeros")
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        self.predictions.assign_add(
+            tf.reduce_sum(tf.sigmoid(tf.cast(y_pred, tf.float32)))
+        )
+        self.labels.assign_add(tf.reduce_sum(tf.cast(y_true, tf.float32)))
+
+    def result(self):
+        return tf.math.divide_no_nan(self.predictions, self.labels)
+
+
+class ExpectedCalibrationError(keras.metrics.Metric):
+    """The gap between predicted probabilities and observed labels.
+
+    Predictions are grouped in num_bins equal-width probability bins, and the
+    gap between the mean prediction and the mean label of each bin is weighted
+    by the number of predictions in the bin.
+    """
+
+    def __init__(
+        self,
+        num_bins=NUM_CALIBRATION_BINS,
+        name="expected_calibration_error",
+        **kwargs
+    ):
+        super().__init__(name=name, **kwargs)
+        self.num_bins = num_bins
+        self.counts = self.add_weight("counts", [num_bins], initializer="zeros")
+        self.predictions = self.add_weight(
+            "predictions", [num_bins], initializer="zeros"
+        )
+        self.labels = self.add_weight("labels", [num_bins], initializer="zeros")
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        probabilities = tf.reshape(tf.sigmoid(tf.cast(y_pred, tf.float32)), [-1])
+        labels = tf.reshape(tf.cast(y_true, tf.float32), [-1])
+        bins = tf.minimum(
+            tf.cast(probabilities * self.num_bins, tf.int32), self.num_bins - 1
+        )
+        self.counts.assign_add(
+            tf.math.unsorted_segment_sum(
+                tf.ones_like(probabilities), bins, self.num_bins
+            )
+        )
+        self.predictions.assign_add(
+            tf.math.unsorted_segment_sum(probabilities, bins, self.num_bins)
+        )
+        self.labels.assign_add(
+            tf.math.unsorted_segment_sum(labels, bins, self.num_bins)
+        )
+
+    def result(self):
+        gaps = tf.abs(self.predictions - self.labels)
+        return tf.math.divide_no_nan(tf.reduce_sum(gaps), tf.reduce_sum(self.counts))
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({"num_bins": self.num_bins})
+        return config
+
+
+def get_evaluation_metrics():
+    """Returns the metrics computed in the evaluation pass, next to the loss."""
+    evaluation_metrics = [
+        # The same accuracy as during training, reported to hypertune.
+        keras.metrics.BinaryAccuracy(name="accuracy"),
+        AUC(name="auc"),
+        AUC(name="auc_pr", curve="PR"),
+        Calibration(),
+        ExpectedCalibrationError(),
+    ]
+    for threshold in THRESHOLDS:
+        suffix = f"at_{int(threshold * 100)}"
+        evaluation_metrics.append(
+            Precision(thresholds=threshold, name=f"precision_{suffix}")
+        )
+        evaluation_metrics.append(Recall(thresholds=threshold, name=f"recall_{suffix}"))
+    return evaluation_metrics
@@ -20,28 +20,37 @@ import tensorflow_transform as tft
 import tensorflow_data_validation as tfdv
 from tensorflow_transform.tf_metadata import schema_utils
 import tensorflow.keras as keras
+from tensorflow.python.framework import convert_to_constants
 
 from src.common import features
+from src.model_training import warmstart
 
 
 def _get_serve_tf_examples_fn(classifier, tft_output, raw_feature_spec):
     """Returns a function that parses a serialized tf.Example and applies TFT."""
 
     classifier.tft_layer = tft_output.transform_features_layer()
+    # Only the model features are parsed: the label and other raw columns that
+    # may be in the examples are skipped by tf.io.parse_example.
+    serving_feature_spec = {
+        feature_name: spec
+        for feature_name, spec in raw_feature_spec.items()
+        if feature_name in features.FEATURE_NAMES
+    }
 
-    @tf.function
+    @tf.function(
+        input_signature=[tf.TensorSpec(shape=[None], dtype=tf.string, name="examples")]
+    )
     def serve_tf_examples_fn(serialized_tf_examples):
         """Returns the output to be used in the serving signature."""
-        for key in list(raw_feature_spec.keys()):
-            if key not in features.FEATURE_NAMES:
-                raw_feature_spec.pop(key)
-
-        parsed_features = tf.io.parse_example(serialized_tf_examples, raw_feature_spec)
+        parsed_features = tf.io.parse_example(
+            serialized_tf_examples, serving_feature_spec
+        )
 
         transformed_features = classifier.tft_layer(parsed_features)
         logits = classifier(transformed_features)
         probabilities = keras.activations.sigmoid(logits)
-        return {"probabilities": probabilities}
+        return {"probabilities": tf.ensure_shape(probabilities, [None, 1])}
 
     return serve_tf_examples_fn
 
@@ -67,15 +76,9 @@ def _get_serve_features_fn(classifier, tft_output):
     return serve_features_fn
 
 
-def export_serving_model(
-    classifier, serving_model_dir, raw_schema_location, tft_output_dir
+def _get_signatures(
+    classifier, tft_output, raw_feature_spec, include_tf_example_signature=True
 ):
-
-    raw_schema = tfdv.load_schema_text(raw_schema_location)
-    raw_feature_spec = schema_utils.schema_as_feature_spec(raw_schema).feature_spec
-
-    tft_output = tft.TFTransformOutput(tft_output_dir)
-
     features_input_signature = {
         feature_name: tf.TensorSpec(
             shape=(None, 1), dtype=spec.dtype, name=feature_name
@@ -88,13 +91,69 @@ def export_serving_model(
         "serving_default": _get_serve_features_fn(
             classifier, tft_output
         ).get_concrete_function(features_input_signature),
-        "serving_tf_example": _get_serve_tf_examples_fn(
+    }
+    if include_tf_example_signature:
+        signatures["serving_tf_example"] = _get_serve_tf_examples_fn(
             classifier, tft_output, raw_feature_spec
-        ).get_concrete_function(
-            tf.TensorSpec(shape=[None], dtype=tf.string, name="examples")
-        ),
+        ).get_concrete_function()
+    return signatures
+
+
+def _save_optimized(classifier, serving_model_dir, signatures):
+    """Saves the signatures only, with the model weights frozen into constants.
+
+    The transform layer is tracked for its lookup tables and vocabulary assets,
+    which stay resources of the frozen graph. Keras metadata, the optimizer, and
+    the training functions are not saved.
+    """
+    module = tf.Module()
+    module.tft_layer = classifier.tft_layer
+    frozen_signatures = {
+        name: convert_to_constants.convert_variables_to_constants_v2(signature)
+        for name, signature in signatures.items()
     }
+    tf.saved_model.save(module, serving_model_dir, signatures=frozen_signatures)
+
+
+def export_serving_model(
+    classifier,
+    serving_model_dir,
+    raw_schema_location,
+    tft_output_dir,
+    optimize=False,
+    include_tf_example_signature=True,
+):
+    """Exports the model with the transform graph as a serving SavedModel.
+
+    Args:
+      classifier: the trained Keras model.
+      serving_model_dir: the SavedModel directory.
+      raw_schema_location: the raw data schema, to parse serving inputs.
+      tft_output_dir: the transform artifacts directory.
+      optimize: if True, exports a serving-only SavedModel with frozen weights.
+        Its graph has no variable reads, so that Grappler constant-folds and
+        fuses the transform and model ops when the model is loaded. It cannot
+        be trained or warm-started from.
+      include_tf_example_signature: if False, only serving_default is exported.
+        The TFX Evaluator requires serving_tf_example.
+    """
+
+    raw_schema = tfdv.load_schema_text(raw_schema_location)
+    raw_feature_spec = schema_utils.schema_as_feature_spec(raw_schema).feature_spec
+
+    tft_output = tft.TFTransformOutput(tft_output_dir)
+
+    signatures = _get_signatures(
+        classifier, tft_output, raw_feature_spec, include_tf_example_signature
+    )
 
     logging.info("Model export started...")
-    classifier.save(serving_model_dir, signatures=signatures)
+    if optimize:
+        _save_optimized(classifier, serving_model_dir, signatures)
+    else:
+        classifier.save(serving_model_dir, signatures=signatures)
+        # The vocabularies let the next training run warm-start from this model.
+        warmstart.write_vocabularies(
+            serving_model_dir, warmstart.read_vocabularies(tft_output)
+        )
     logging.info("Model export completed.")
@@ -17,6 +17,7 @@ import tensorflow as tf
 from tensorflow import keras
 
 from src.common import features
+from src.model_training import embeddings
 
 
 def create_model_inputs():
@@ -40,10 +41,9 @@ def _create_binary_classifier(feature_vocab_sizes, hyperparams):
         feature_name = features.original_name(key)
         if feature_name in features.EMBEDDING_CATEGORICAL_FEATURES:
             vocab_size = feature_vocab_sizes[feature_name]
-            embedding_size = features.EMBEDDING_CATEGORICAL_FEATURES[feature_name]
-            embedding_output = keras.layers.Embedding(
-                input_dim=vocab_size + 1,
-                output_dim=embedding_size,
+            embedding_output = embeddings.create_embedding(
+                feature_name,
+                input_dim=vocab_size + features.num_oov_buckets(feature_name),
                 name=f"{key}_embedding",
             )(input_layers[key])
             layers.append(embedding_output)
@@ -69,7 +69,10 @@ def _create_binary_classifier(feature_vocab_sizes, hyperparams):
         ],
         name="feedforward_network",
     )(joined)
-    logits = keras.layers.Dense(units=1, name="logits")(feedforward_output)
+    # Logits are kept in float32 under a mixed precision policy.
+    logits = keras.layers.Dense(units=1, name="logits", dtype="float32")(
+        feedforward_output
+    )
 
     model = keras.Model(inputs=input_layers, outputs=[logits])
     return model
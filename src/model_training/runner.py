@@ -18,6 +18,8 @@ import logging
 
 from src.model_training import trainer, exporter, defaults
 
+CHECKPOINT_DIRNAME = "checkpoints"
+
 
 # TFX Trainer will call this function.
 def run_fn(fn_args):
@@ -51,6 +53,8 @@ def run_fn(fn_args):
         hyperparams=hyperparams,
         log_dir=log_dir,
         base_model_dir=fn_args.base_model,
+        # A restarted Trainer resumes from the checkpoints of its run directory.
+        checkpoint_dir=os.path.join(log_dir, CHECKPOINT_DIRNAME),
     )
 
     logging.info("Runner executing exporter...")
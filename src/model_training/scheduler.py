@@ -0,0 +1,193 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Asynchronous successive halving (ASHA) of hyperparameter trials.
+
+Trials report their validation metrics at the end of every epoch. At each rung,
+after min_epochs * reduction_factor ** k epochs, a trial is pruned unless its
+metric is in the top 1 / reduction_factor of the trials that reached that rung.
+
+Each trial state is a JSON file of its own under state_dir, so concurrent trials
+never write the same file, and a restarted trial does not repeat work.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+import tensorflow as tf
+from tensorflow import keras
+
+from src.model_training import distribution
+
+RUNNING = "running"
+PRUNED = "pruned"
+COMPLETED = "completed"
+
+# The scheduled metric, higher is better.
+METRIC_NAME = "val_accuracy"
+
+
+def get_rungs(min_epochs, reduction_factor, max_epochs):
+    """Returns the epochs at which trials are pruned or promoted."""
+    if min_epochs < 1 or reduction_factor < 2:
+        raise ValueError(
+            "min_epochs must be at least 1, and reduction_factor at least 2. "
+            f"Got {min_epochs} and {reduction_factor}."
+        )
+    rungs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= reduction_factor
+    return rungs
+
+
+def get_trial_id(hyperparams):
+    """Returns the Vertex AI trial id, or a digest of the hyperparameters."""
+    trial_id = os.getenv("CLOUD_ML_TRIAL_ID")
+    if trial_id:
+        return trial_id
+    digest = hashlib.sha1(
+        json.dumps(hyperparams, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"trial-{digest[:12]}"
+
+
+class SuccessiveHalvingScheduler:
+    """Decides after every epoch whether a trial keeps training."""
+
+    def __init__(self, state_dir, max_epochs, min_epochs=1, reduction_factor=3):
+        self.state_dir = state_dir
+        self.max_epochs = int(max_epochs)
+        self.reduction_factor = int(reduction_factor)
+        self.rungs = get_rungs(int(min_epochs), self.reduction_factor, self.max_epochs)
+        tf.io.gfile.makedirs(state_dir)
+
+    def _trial_path(self, trial_id):
+        return os.path.join(self.state_dir, f"{trial_id}.json")
+
+    def load_trial(self, trial_id):
+        """Returns the state of a trial: its status, epoch, and metrics per epoch."""
+        trial_path = self._trial_path(trial_id)
+        if not tf.io.gfile.exists(trial_path):
+            return {"trial_id": trial_id, "status": RUNNING, "epoch": 0, "metrics": {}}
+        with tf.io.gfile.GFile(trial_path) as f:
+            return json.load(f)
+
+    def _save_trial(self, state):
+        # Written then renamed, so other trials never read a partial file.
+        trial_path = self._trial_path(state["trial_id"])
+        with tf.io.gfile.GFile(f"{trial_path}.tmp", "w") as f:
+            json.dump(state, f)
+        tf.io.gfile.rename(f"{trial_path}.tmp", trial_path, overwrite=True)
+
+    def _rung_values(self, trial_id, rung):
+        values = []
+        for file_name in tf.io.gfile.listdir(self.state_dir):
+            if not file_name.endswith(".json") or file_name == f"{trial_id}.json":
+                continue
+            with tf.io.gfile.GFile(os.path.join(self.state_dir, file_name)) as f:
+                metrics = json.load(f)["metrics"]
+            if str(rung) in metrics:
+                values.append(metrics[str(rung)][METRIC_NAME])
+        return values
+
+    def _promoted(self, trial_id, rung, value):
+        other_values = self._rung_values(trial_id, rung)
+        num_promoted = max(1, (len(other_values) + 1) // self.reduction_factor)
+        num_better = sum(other_value > value for other_value in other_values)
+        return num_better < num_promoted
+
+    def report(self, trial_id, epoch, metrics):
+        """Records the metrics of a trial after epoch epochs.
+
+        Returns:
+          True if the trial should keep training.
+        """
+        return self.report_many(epoch, {trial_id: metrics})[trial_id]
+
+    def report_many(self, epoch, trials_metrics):
+        """Records the metrics of trials that reached epoch at the same time.
+
+        The trials are ranked against each other, as well as against the trials
+        that reported before them.
+
+        Args:
+          epoch: the number of epochs the trials trained for.
+          trials_metrics: the metrics of each trial id.
+        Returns:
+          Whether each trial id should keep training.
+        """
+        states = {}
+        for trial_id, metrics in trials_metrics.items():
+            state = self.load_trial(trial_id)
+            state["metrics"][str(epoch)] = {
+                name: float(value) for name, value in metrics.items()
+            }
+            self._save_trial(state)
+            states[trial_id] = state
+
+        keep_training = {}
+        for trial_id, state in states.items():
+            # The epoch is only updated with the decision other replicas wait for.
+            state["epoch"] = epoch
+            value = state["metrics"][str(epoch)][METRIC_NAME]
+            if epoch >= self.max_epochs:
+                state["status"] = COMPLETED
+            elif epoch in self.rungs and not self._promoted(trial_id, epoch, value):
+                state["status"] = PRUNED
+                logging.info(f"Pruned {trial_id} at epoch {epoch}: {METRIC_NAME}={value}")
+            self._save_trial(state)
+            keep_training[trial_id] = state["status"] == RUNNING
+        return keep_training
+
+    def wait_for_decision(self, trial_id, epoch, poll_interval=1):
+        """Waits for another task to report the trial epoch, and returns its decision."""
+        while True:
+            state = self.load_trial(trial_id)
+            if state["epoch"] >= epoch:
+                return state["status"] == RUNNING
+            time.sleep(poll_interval)
+
+
+class SchedulerCallback(keras.callbacks.Callback):
+    """Reports the metrics of every epoch, and stops the trial when it is pruned.
+
+    Only the chief reports. The other multi-worker replicas read its decision, so
+    that all of them stop at the same epoch.
+    """
+
+    def __init__(self, scheduler, trial_id, report_fn=None):
+        super().__init__()
+        self._scheduler = scheduler
+        self._trial_id = trial_id
+        self._report_fn = report_fn
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        # Parameter server training has no validation metrics.
+        metrics = {
+            METRIC_NAME: logs.get(METRIC_NAME, logs.get("accuracy")),
+            "val_loss": logs.get("val_loss", logs.get("loss")),
+        }
+        if not distribution.is_chief():
+            keep_training = self._scheduler.wait_for_decision(self._trial_id, epoch + 1)
+        else:
+            keep_training = self._scheduler.report(self._trial_id, epoch + 1, metrics)
+            if self._report_fn:
+                self._report_fn(epoch + 1, metrics[METRIC_NAME])
+        if not keep_training:
+            self.model.stop_training = True
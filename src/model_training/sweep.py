@@ -0,0 +1,390 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local hyperparameter sweep training many small classifiers at once.
+
+Every trial trains on the same batches: each batch is read and parsed once by
+data.get_dataset, then fed to all the classifiers in a single training step.
+
+    python -m src.model_training.sweep \
+        --train-data-dir=... --eval-data-dir=... --tft-output-dir=... \
+        --hidden-units="64,32;128,64" --learning-rates=0.001,0.0001 \
+        --scheduler-dir=...
+
+With --scheduler-dir, weak trials are pruned early by successive halving (see
+scheduler.py), and an interrupted sweep resumes where it stopped.
+"""
+
+import os
+import argparse
+import itertools
+import json
+import logging
+
+import tensorflow as tf
+import tensorflow_transform as tft
+from tensorflow import keras
+
+from src.common import features
+from src.model_training import data, defaults, model, trainer, scheduler
+
+
+def get_grid_trials(hidden_units_values, learning_rates):
+    """Returns the trial hyperparameters of a grid search."""
+    return [
+        {"hidden_units": hidden_units, "learning_rate": learning_rate}
+        for hidden_units, learning_rate in itertools.product(
+            hidden_units_values, learning_rates
+        )
+    ]
+
+
+class _Trial:
+    """A classifier, its optimizer, its metrics, and its progress."""
+
+    def __init__(self, trial_id, hyperparams, feature_vocab_sizes):
+        self.trial_id = trial_id
+        self.name = f"trial-{trial_id}"
+        self.hyperparams = hyperparams
+        self.num_epochs = int(hyperparams["num_epochs"])
+        self.classifier = model._create_binary_classifier(
+            feature_vocab_sizes, hyperparams
+        )
+        self.optimizer = keras.optimizers.Adam(
+            learning_rate=hyperparams["learning_rate"]
+        )
+        self.loss = keras.metrics.Mean()
+        self.accuracy = keras.metrics.BinaryAccuracy(threshold=0.0)
+        self.status = scheduler.RUNNING
+        self.epoch = 0
+        # The validation metrics of each epoch.
+        self.history = []
+
+    def reset_metrics(self):
+        self.loss.reset_states()
+        self.accuracy.reset_states()
+
+    @property
+    def best_metrics(self):
+        return min(self.history, key=lambda metrics: metrics["val_loss"])
+
+
+class _TrialCheckpoints:
+    """Saves the running trials at every epoch, to resume a sweep."""
+
+    def __init__(self, trial, checkpoint_dir):
+        self._trial = trial
+        self._manager = tf.train.CheckpointManager(
+            tf.train.Checkpoint(model=trial.classifier, optimizer=trial.optimizer),
+            os.path.join(checkpoint_dir, trial.name),
+            max_to_keep=1,
+        )
+
+    def restore(self, epoch):
+        """Restores the checkpoint of epoch, and returns whether it exists."""
+        latest_checkpoint = self._manager.latest_checkpoint
+        if not latest_checkpoint or not latest_checkpoint.endswith(f"-{epoch}"):
+            return False
+        self._manager.checkpoint.restore(latest_checkpoint)
+        return True
+
+    def save(self):
+        self._manager.save(checkpoint_number=self._trial.epoch)
+
+
+def _restore_trial(trial, trial_scheduler, checkpoints):
+    """Resumes a trial from the state saved by a previous run of the sweep."""
+    state = trial_scheduler.load_trial(trial.name)
+    if state["epoch"] >= trial.num_epochs:
+        state["status"] = scheduler.COMPLETED
+    if state["status"] == scheduler.RUNNING and not checkpoints.restore(
+        state["epoch"]
+    ):
+        # Without weights, a running trial starts over.
+        return
+    trial.status = state["status"]
+    trial.epoch = state["epoch"]
+    trial.history = [
+        dict(state["metrics"][str(epoch)], epoch=epoch)
+        for epoch in range(1, trial.epoch + 1)
+    ]
+    if trial.epoch:
+        logging.info(f"Resuming {trial.name} at epoch {trial.epoch}: {trial.status}.")
+
+
+def _validate_batch_size(trials_hyperparams):
+    batch_sizes = {int(hyperparams["batch_size"]) for hyperparams in trials_hyperparams}
+    if len(batch_sizes) != 1:
+        raise ValueError(
+            f"All trials must share the same batch size. Got {sorted(batch_sizes)}."
+        )
+    return batch_sizes.pop()
+
+
+def _get_steps(trials, loss_fn):
+    """Returns the train and eval steps of the classifiers of trials."""
+
+    @tf.function
+    def train_step(input_features, labels):
+        labels = tf.cast(tf.expand_dims(labels, -1), tf.float32)
+        for trial in trials:
+            with tf.GradientTape() as tape:
+                logits = trial.classifier(input_features, training=True)
+                loss = loss_fn(labels, logits)
+            variables = trial.classifier.trainable_variables
+            gradients = tape.gradient(loss, variables)
+            trial.optimizer.apply_gradients(zip(gradients, variables))
+
+    @tf.function
+    def eval_step(input_features, labels):
+        labels = tf.cast(tf.expand_dims(labels, -1), tf.float32)
+        for trial in trials:
+            logits = trial.classifier(input_features, training=False)
+            trial.loss.update_state(loss_fn(labels, logits))
+            trial.accuracy.update_state(labels, logits)
+
+    return train_step, eval_step
+
+
+def train_trials(
+    trials_hyperparams,
+    feature_vocab_sizes,
+    train_dataset,
+    eval_dataset,
+    trial_scheduler=None,
+):
+    """Trains one classifier per trial on shared batches.
+
+    Args:
+      trials_hyperparams: the complete hyperparameters of each trial.
+      feature_vocab_sizes: the vocabulary size of each categorical feature.
+      train_dataset: batches of (features, label), as returned by data.get_dataset.
+      eval_dataset: the validation batches.
+      trial_scheduler: a scheduler.SuccessiveHalvingScheduler to prune trials
+        after each epoch. Its state, and checkpoints of the running trials, are
+        kept in its state_dir, so that an interrupted sweep resumes from there.
+    Returns:
+      The metrics of each trial at its epoch with the lowest validation loss,
+      which is the epoch trainer.train keeps with early stopping. The sweep runs
+      no early stopping and returns no weights: the trained models are dropped.
+    """
+    trials = [
+        _Trial(trial_id, hyperparams, feature_vocab_sizes)
+        for trial_id, hyperparams in enumerate(trials_hyperparams)
+    ]
+    checkpoints = {}
+    if trial_scheduler:
+        checkpoint_dir = os.path.join(trial_scheduler.state_dir, "checkpoints")
+        for trial in trials:
+            checkpoints[trial.name] = _TrialCheckpoints(trial, checkpoint_dir)
+            _restore_trial(trial, trial_scheduler, checkpoints[trial.name])
+
+    loss_fn = keras.losses.BinaryCrossentropy(from_logits=True)
+    # Steps are traced again only when the set of trials to train changes.
+    steps = {}
+
+    num_epochs = max(trial.num_epochs for trial in trials)
+    for epoch in range(num_epochs):
+        active_trials = [
+            trial
+            for trial in trials
+            if trial.status == scheduler.RUNNING and trial.epoch == epoch
+        ]
+        if not active_trials:
+            continue
+        trial_ids = tuple(trial.trial_id for trial in active_trials)
+        if trial_ids not in steps:
+            steps[trial_ids] = _get_steps(active_trials, loss_fn)
+        train_step, eval_step = steps[trial_ids]
+
+        for input_features, labels in train_dataset:
+            train_step(input_features, labels)
+
+        for trial in active_trials:
+            trial.reset_metrics()
+        for input_features, labels in eval_dataset:
+            eval_step(input_features, labels)
+
+        trials_metrics = {}
+        for trial in active_trials:
+            trial.epoch = epoch + 1
+            trials_metrics[trial.name] = {
+                "val_loss": float(trial.loss.result()),
+                scheduler.METRIC_NAME: float(trial.accuracy.result()),
+            }
+            trial.history.append(dict(trials_metrics[trial.name], epoch=trial.epoch))
+            if trial.epoch >= trial.num_epochs:
+                trial.status = scheduler.COMPLETED
+
+        if trial_scheduler:
+            keep_training = trial_scheduler.report_many(epoch + 1, trials_metrics)
+            for trial in active_trials:
+                if trial.status == scheduler.RUNNING and not keep_training[trial.name]:
+                    trial.status = scheduler.PRUNED
+                if trial.status == scheduler.RUNNING:
+                    checkpoints[trial.name].save()
+
+        num_running = sum(trial.status == scheduler.RUNNING for trial in trials)
+        logging.info(
+            f"Sweep epoch {epoch + 1} of {num_epochs} completed: "
+            f"{len(active_trials)} trials trained, {num_running} still running."
+        )
+
+    return [
+        {
+            "trial_id": trial.trial_id,
+            "hyperparams": {
+                "hidden_units": trial.hyperparams["hidden_units"],
+                "learning_rate": trial.hyperparams["learning_rate"],
+            },
+            "status": trial.status,
+            # Reported under the metric name task.py reports to hypertune.
+            defaults.HYPERTUNE_METRIC_NAME: trial.best_metrics[scheduler.METRIC_NAME],
+            **trial.best_metrics,
+        }
+        for trial in trials
+    ]
+
+
+def run_sweep(
+    train_data_dir,
+    eval_data_dir,
+    tft_output_dir,
+    trials,
+    hyperparams=None,
+    scheduler_dir=None,
+):
+    """Runs the trials, sharing one pass over the data per epoch.
+
+    Args:
+      train_data_dir: transformed train data file pattern.
+      eval_data_dir: transformed eval data file pattern.
+      tft_output_dir: the transform artifacts directory.
+      trials: the hyperparameters set by each trial, e.g. from get_grid_trials.
+      hyperparams: hyperparameters shared by all the trials.
+      scheduler_dir: if set, weak trials are pruned by successive halving, and
+        the sweep state is kept there to resume it.
+    Returns:
+      The metrics of each trial, best first.
+    """
+    hyperparams = hyperparams or {}
+    trials_hyperparams = [
+        defaults.update_hyperparams(dict(hyperparams, **trial)) for trial in trials
+    ]
+    batch_size = _validate_batch_size(trials_hyperparams)
+
+    tft_output = tft.TFTransformOutput(tft_output_dir)
+    transformed_feature_spec = tft_output.transformed_feature_spec()
+    feature_vocab_sizes = {
+        feature_name: tft_output.vocabulary_size_by_name(feature_name)
+        for feature_name in features.categorical_feature_names()
+    }
+
+    base_hyperparams = trials_hyperparams[0]
+    input_pipeline_args = trainer._get_input_pipeline_args(base_hyperparams)
+    train_dataset = data.get_dataset(
+        train_data_dir,
+        transformed_feature_spec,
+        batch_size,
+        shuffle_buffer_size=int(base_hyperparams["shuffle_buffer_size"]),
+        **input_pipeline_args,
+    )
+    eval_dataset = data.get_dataset(
+        eval_data_dir,
+        transformed_feature_spec,
+        batch_size,
+        shuffle=False,
+        cache=base_hyperparams["eval_cache"],
+        **input_pipeline_args,
+    )
+
+    trial_scheduler = None
+    if scheduler_dir:
+        trial_scheduler = scheduler.SuccessiveHalvingScheduler(
+            scheduler_dir,
+            max_epochs=max(int(h["num_epochs"]) for h in trials_hyperparams),
+            min_epochs=int(base_hyperparams["scheduler_min_epochs"]),
+            reduction_factor=int(base_hyperparams["scheduler_reduction_factor"]),
+        )
+
+    logging.info(f"Sweeping {len(trials)} trials...")
+    results = train_trials(
+        trials_hyperparams,
+        feature_vocab_sizes,
+        train_dataset,
+        eval_dataset,
+        trial_scheduler,
+    )
+    results.sort(key=lambda result: -result[defaults.HYPERTUNE_METRIC_NAME])
+    for result in results:
+        logging.info(f"Trial {result['trial_id']}: {result}")
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train-data-dir", type=str)
+    parser.add_argument("--eval-data-dir", type=str)
+    parser.add_argument("--tft-output-dir", type=str)
+    parser.add_argument(
+        "--hidden-units",
+        default="64,32",
+        type=str,
+        help="Semicolon separated hidden_units values, e.g. '64,32;128,64'.",
+    )
+    parser.add_argument("--learning-rates", default="0.001", type=str)
+    parser.add_argument("--batch-size", default=defaults.BATCH_SIZE, type=int)
+    parser.add_argument("--num-epochs", default=defaults.NUM_EPOCHS, type=int)
+    parser.add_argument("--scheduler-dir", type=str)
+    parser.add_argument(
+        "--scheduler-min-epochs", default=defaults.SCHEDULER_MIN_EPOCHS, type=int
+    )
+    parser.add_argument(
+        "--scheduler-reduction-factor",
+        default=defaults.SCHEDULER_REDUCTION_FACTOR,
+        type=int,
+    )
+    parser.add_argument("--output-file", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    trials = get_grid_trials(
+        [
+            [int(units) for units in hidden_units.split(",")]
+            for hidden_units in args.hidden_units.split(";")
+        ],
+        [float(learning_rate) for learning_rate in args.learning_rates.split(",")],
+    )
+    results = run_sweep(
+        args.train_data_dir,
+        args.eval_data_dir,
+        args.tft_output_dir,
+        trials,
+        {
+            "batch_size": args.batch_size,
+            "num_epochs": args.num_epochs,
+            "scheduler_min_epochs": args.scheduler_min_epochs,
+            "scheduler_reduction_factor": args.scheduler_reduction_factor,
+        },
+        scheduler_dir=args.scheduler_dir,
+    )
+    if args.output_file:
+        with tf.io.gfile.GFile(args.output_file, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
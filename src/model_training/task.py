@@ -15,22 +15,22 @@
 
 import os
 import sys
+import tempfile
 from datetime import datetime
 import logging
 import tensorflow as tf
-from tensorflow.python.client import device_lib
 import argparse
 
 from google.cloud import aiplatform as vertex_ai
 import hypertune
 
-from src.model_training import defaults, trainer, exporter
+from src.model_training import defaults, trainer, exporter, distribution, scheduler
 
 
 dirname = os.path.dirname(__file__)
 dirname = dirname.replace("/model_training", "")
 RAW_SCHEMA_LOCATION = os.path.join(dirname, "raw_schema/schema.pbtxt")
-HYPERTUNE_METRIC_NAME = 'ACCURACY'
+HYPERTUNE_METRIC_NAME = defaults.HYPERTUNE_METRIC_NAME
 
 
 def get_args():
@@ -48,6 +48,18 @@ def get_args():
         type=str,
     )
 
+    parser.add_argument(
+        "--checkpoint-dir",
+        default=os.getenv("AIP_CHECKPOINT_DIR"),
+        type=str,
+    )
+
+    parser.add_argument(
+        "--scheduler-dir",
+        type=str,
+        help="Directory shared by the trials of a sweep, to prune them early.",
+    )
+
     parser.add_argument(
         "--train-data-dir",
         type=str,
@@ -67,6 +79,52 @@ def get_args():
     parser.add_argument("--batch-size", default=512, type=float)
     parser.add_argument("--hidden-units", default="64,32", type=str)
     parser.add_argument("--num-epochs", default=10, type=int)
+    parser.add_argument(
+        "--shuffle-buffer-size", default=defaults.SHUFFLE_BUFFER_SIZE, type=int
+    )
+    parser.add_argument(
+        "--num-parallel-reads", default=defaults.NUM_PARALLEL_READS, type=int
+    )
+    parser.add_argument(
+        "--num-parallel-calls", default=defaults.NUM_PARALLEL_CALLS, type=int
+    )
+    parser.add_argument(
+        "--prefetch-buffer-size", default=defaults.PREFETCH_BUFFER_SIZE, type=int
+    )
+    parser.add_argument("--eval-cache", default=defaults.EVAL_CACHE, type=str)
+    parser.add_argument(
+        "--distribution-strategy", default=defaults.DISTRIBUTION_STRATEGY, type=str
+    )
+    parser.add_argument(
+        "--num-cpu-replicas", default=defaults.NUM_CPU_REPLICAS, type=int
+    )
+    parser.add_argument("--steps-per-epoch", default=defaults.STEPS_PER_EPOCH, type=int)
+    parser.add_argument("--jit-compile", default=int(defaults.JIT_COMPILE), type=int)
+    parser.add_argument(
+        "--mixed-precision", default=defaults.MIXED_PRECISION, type=str
+    )
+    parser.add_argument(
+        "--steps-per-execution", default=defaults.STEPS_PER_EXECUTION, type=int
+    )
+    parser.add_argument(
+        "--checkpoint-interval", default=defaults.CHECKPOINT_INTERVAL, type=int
+    )
+    parser.add_argument(
+        "--scheduler-min-epochs", default=defaults.SCHEDULER_MIN_EPOCHS, type=int
+    )
+    parser.add_argument(
+        "--scheduler-reduction-factor",
+        default=defaults.SCHEDULER_REDUCTION_FACTOR,
+        type=int,
+    )
+
+    parser.add_argument(
+        "--optimize-export",
+        default=0,
+        type=int,
+        help="Export a serving-only SavedModel with frozen weights.",
+    )
+    parser.add_argument("--include-tf-example-signature", default=1, type=int)
 
     parser.add_argument("--project", type=str)
     parser.add_argument("--region", type=str)
@@ -84,7 +142,50 @@ def main():
     hyperparams = defaults.update_hyperparams(hyperparams)
     logging.info(f"Hyperparameter: {hyperparams}")
 
-    if args.experiment_name:
+    if distribution.is_parameter_server_task(args.distribution_strategy):
+        # Parameter server workers and ps tasks only run steps for the chief.
+        distribution.run_parameter_server_task()
+        return
+
+    # Every multi-worker replica trains, but only the chief reports and exports.
+    is_chief = distribution.is_chief()
+
+    hpt = hypertune.HyperTune()
+    callbacks = []
+    if args.scheduler_dir:
+        trial_scheduler = scheduler.SuccessiveHalvingScheduler(
+            args.scheduler_dir,
+            max_epochs=args.num_epochs,
+            min_epochs=args.scheduler_min_epochs,
+            reduction_factor=args.scheduler_reduction_factor,
+        )
+        trial_id = scheduler.get_trial_id(hyperparams)
+        trial = trial_scheduler.load_trial(trial_id)
+        if trial["status"] == scheduler.PRUNED:
+            # A restarted pruned trial only reports its last metric again.
+            logging.info(f"Trial {trial_id} was pruned at epoch {trial['epoch']}.")
+            if is_chief:
+                hpt.report_hyperparameter_tuning_metric(
+                    hyperparameter_metric_tag=HYPERTUNE_METRIC_NAME,
+                    metric_value=trial["metrics"][str(trial["epoch"])][
+                        scheduler.METRIC_NAME
+                    ],
+                    global_step=trial["epoch"],
+                )
+            return
+
+        def report_fn(epoch, value):
+            hpt.report_hyperparameter_tuning_metric(
+                hyperparameter_metric_tag=HYPERTUNE_METRIC_NAME,
+                metric_value=value,
+                global_step=epoch,
+            )
+
+        callbacks.append(
+            scheduler.SchedulerCallback(trial_scheduler, trial_id, report_fn)
+        )
+
+    if args.experiment_name and is_chief:
         vertex_ai.init(
             project=args.project,
             staging_bucket=args.staging_bucket,
@@ -102,47 +203,63 @@ def main():
 
         vertex_ai.log_params(hyperparams)
 
-    classifier = trainer.train(
+    # The model is evaluated on the eval split cached while training.
+    classifier, evaluation_results = trainer.train_and_evaluate(
         train_data_dir=args.train_data_dir,
         eval_data_dir=args.eval_data_dir,
         tft_output_dir=args.tft_output_dir,
         hyperparams=hyperparams,
         log_dir=args.log_dir,
+        # A restarted job resumes from the checkpoints of the same directory.
+        # Only an explicit directory is checkpointed: a rerun with the same
+        # log_dir must train again, not resume a completed run.
+        checkpoint_dir=args.checkpoint_dir,
+        callbacks=callbacks,
     )
+    val_accuracy = evaluation_results["accuracy"]
 
-    val_loss, val_accuracy = trainer.evaluate(
-        model=classifier,
-        data_dir=args.eval_data_dir,
-        raw_schema_location=RAW_SCHEMA_LOCATION,
-        tft_output_dir=args.tft_output_dir,
-        hyperparams=hyperparams,
-    )
-    
-    
-    # Report val_accuracy to Vertex hypertuner.
-    logging.info(f'Reporting metric {HYPERTUNE_METRIC_NAME}={val_accuracy} to Vertex hypertuner...')
-    hpt = hypertune.HyperTune()
-    hpt.report_hyperparameter_tuning_metric(
-        hyperparameter_metric_tag=HYPERTUNE_METRIC_NAME,
-        metric_value=val_accuracy,
-        global_step=args.num_epochs * args.batch_size
-    )
+    if is_chief:
+        # Report val_accuracy to Vertex hypertuner.
+        logging.info(f'Reporting metric {HYPERTUNE_METRIC_NAME}={val_accuracy} to Vertex hypertuner...')
+        hpt.report_hyperparameter_tuning_metric(
+            hyperparameter_metric_tag=HYPERTUNE_METRIC_NAME,
+            metric_value=val_accuracy,
+            global_step=args.num_epochs * args.batch_size
+        )
+
+        # Log metrics in Vertex Experiments.
+        logging.info(f'Logging metrics to Vertex Experiments...')
+        if args.experiment_name:
+            vertex_ai.log_metrics(
+                {f"val_{name}": value for name, value in evaluation_results.items()}
+            )
 
-    # Log metrics in Vertex Experiments.
-    logging.info(f'Logging metrics to Vertex Experiments...')
-    if args.experiment_name:
-        vertex_ai.log_metrics({"val_loss": val_loss, "val_accuracy": val_accuracy})
+    if (
+        args.scheduler_dir
+        and trial_scheduler.load_trial(trial_id)["status"] == scheduler.PRUNED
+    ):
+        logging.info(f"Not exporting the model of pruned trial {trial_id}.")
+        return
 
+    # Every multi-worker replica must run the save, which holds collective ops,
+    # but only the chief writes to model_dir. The others write to a directory
+    # deleted after the export.
+    serving_model_dir = args.model_dir if is_chief else tempfile.mkdtemp()
     try:
         exporter.export_serving_model(
             classifier=classifier,
-            serving_model_dir=args.model_dir,
+            serving_model_dir=serving_model_dir,
             raw_schema_location=RAW_SCHEMA_LOCATION,
             tft_output_dir=args.tft_output_dir,
+            optimize=bool(args.optimize_export),
+            include_tf_example_signature=bool(args.include_tf_example_signature),
         )
     except:
         # Swallow Ignored Errors while exporting the model.
         pass
+    finally:
+        if not is_chief:
+            tf.io.gfile.rmtree(serving_model_dir)
 
 
 if __name__ == "__main__":
@@ -150,7 +267,9 @@ if __name__ == "__main__":
     logging.info(f"Python Version = {sys.version}")
     logging.info(f"TensorFlow Version = {tf.__version__}")
     logging.info(f'TF_CONFIG = {os.environ.get("TF_CONFIG", "Not found")}')
-    logging.info(f"DEVICES = {device_lib.list_local_devices()}")
+    # Physical devices are listed without initializing them, so that the CPU can
+    # still be split into logical devices for the mirrored strategy.
+    logging.info(f"DEVICES = {tf.config.list_physical_devices()}")
     logging.info(f"Task started...")
     main()
     logging.info(f"Task completed.")
@@ -19,79 +19,279 @@ import tensorflow_transform as tft
 from tensorflow import keras
 
 
-from src.model_training import data, model
+from src.model_training import (
+    data,
+    model,
+    distribution,
+    warmstart,
+    checkpointing,
+    evaluation_metrics,
+)
 
 
-def train(
+def _get_input_pipeline_args(hyperparams):
+    """Returns the data.get_dataset keyword arguments set in hyperparams."""
+    return {
+        "num_parallel_reads": int(hyperparams["num_parallel_reads"]),
+        "num_parallel_calls": int(hyperparams["num_parallel_calls"]),
+        "prefetch_buffer_size": int(hyperparams["prefetch_buffer_size"]),
+    }
+
+
+def _get_distributed_dataset(strategy, file_pattern, feature_spec, batch_size, **kwargs):
+    """Returns the dataset read by every replica, with a global batch size."""
+    global_batch_size = int(batch_size) * strategy.num_replicas_in_sync
+
+    def dataset_fn(input_context):
+        return data.get_dataset(
+            file_pattern,
+            feature_spec,
+            global_batch_size,
+            input_context=input_context,
+            **kwargs,
+        )
+
+    return distribution.distribute_dataset(strategy, dataset_fn)
+
+
+def set_precision_policy(hyperparams):
+    """Sets the global Keras dtype policy. Must be called before building the model."""
+    policy = hyperparams["mixed_precision"] or "float32"
+    logging.info(f"Precision policy: {policy}")
+    keras.mixed_precision.set_global_policy(policy)
+
+
+def _compile(classifier, hyperparams, metrics=None, optimizer=None):
+    optimizer = optimizer or keras.optimizers.Adam(
+        learning_rate=hyperparams["learning_rate"]
+    )
+    loss = keras.losses.BinaryCrossentropy(from_logits=True)
+    metrics = metrics or [keras.metrics.BinaryAccuracy(name="accuracy")]
+
+    compile_args = {"steps_per_execution": int(hyperparams["steps_per_execution"])}
+    if bool(int(hyperparams["jit_compile"])):
+        compile_args["jit_compile"] = True
+
+    classifier.compile(
+        optimizer=optimizer, loss=loss, metrics=metrics, **compile_args
+    )
+
+
+def _train(
+    tft_output,
     train_data_dir,
     eval_data_dir,
-    tft_output_dir,
     hyperparams,
     log_dir,
     base_model_dir=None,
+    checkpoint_dir=None,
+    callbacks=None,
 ):
-
-    logging.info(f"Loading tft output from {tft_output_dir}")
-    tft_output = tft.TFTransformOutput(tft_output_dir)
+    """Trains the model, and returns it with its validation dataset, if any."""
     transformed_feature_spec = tft_output.transformed_feature_spec()
 
-    train_dataset = data.get_dataset(
-        train_data_dir,
-        transformed_feature_spec,
-        hyperparams["batch_size"],
+    strategy = distribution.get_strategy(
+        hyperparams["distribution_strategy"], int(hyperparams["num_cpu_replicas"])
     )
+    logging.info(f"Number of replicas: {strategy.num_replicas_in_sync}")
 
-    eval_dataset = data.get_dataset(
-        eval_data_dir,
+    # Parameter server training runs a fixed number of steps on an infinite
+    # dataset, and Model.fit does not support validation data with it.
+    parameter_server = distribution.is_parameter_server_strategy(strategy)
+    steps_per_epoch = int(hyperparams["steps_per_epoch"]) or None
+    if parameter_server and not steps_per_epoch:
+        raise ValueError("steps_per_epoch must be set with parameter server training.")
+
+    input_pipeline_args = _get_input_pipeline_args(hyperparams)
+
+    train_dataset = _get_distributed_dataset(
+        strategy,
+        train_data_dir,
         transformed_feature_spec,
         hyperparams["batch_size"],
+        num_epochs=None if parameter_server else 1,
+        shuffle_buffer_size=int(hyperparams["shuffle_buffer_size"]),
+        **input_pipeline_args,
     )
 
-    optimizer = keras.optimizers.Adam(learning_rate=hyperparams["learning_rate"])
-    loss = keras.losses.BinaryCrossentropy(from_logits=True)
-    metrics = [keras.metrics.BinaryAccuracy(name="accuracy")]
+    eval_dataset = None
+    if not parameter_server:
+        eval_dataset = _get_distributed_dataset(
+            strategy,
+            eval_data_dir,
+            transformed_feature_spec,
+            hyperparams["batch_size"],
+            shuffle=False,
+            cache=hyperparams["eval_cache"],
+            **input_pipeline_args,
+        )
 
     early_stopping = tf.keras.callbacks.EarlyStopping(
-        monitor="val_loss", patience=5, restore_best_weights=True
+        monitor="loss" if parameter_server else "val_loss",
+        patience=5,
+        restore_best_weights=True,
     )
     tensorboard_callback = tf.keras.callbacks.TensorBoard(log_dir=log_dir)
 
-    classifier = model.create_binary_classifier(tft_output, hyperparams)
-    if base_model_dir:
-        try:
-            classifier = keras.load_model(base_model_dir)
-        except:
-            pass
+    set_precision_policy(hyperparams)
+
+    with strategy.scope():
+        classifier = model.create_binary_classifier(tft_output, hyperparams)
+        _compile(classifier, hyperparams)
 
-    classifier.compile(optimizer=optimizer, loss=loss, metrics=metrics)
+    callbacks = [early_stopping, tensorboard_callback] + list(callbacks or [])
+    initial_epoch = None
+    if checkpoint_dir:
+        checkpoint_callback = checkpointing.CheckpointCallback(
+            classifier, checkpoint_dir, hyperparams["checkpoint_interval"]
+        )
+        callbacks.append(checkpoint_callback)
+        initial_epoch = checkpoint_callback.restore()
+        num_epochs = int(hyperparams["num_epochs"])
+        if initial_epoch is not None and initial_epoch >= num_epochs:
+            logging.warning(
+                f"The checkpoints of {checkpoint_dir} are from a completed run of "
+                f"{initial_epoch} epochs: no epoch is trained."
+            )
+
+    # A resumed run continues from its own checkpoint instead.
+    warm_started = False
+    if base_model_dir and initial_epoch is None:
+        warm_started = warmstart.warm_start(
+            classifier, base_model_dir, warmstart.read_vocabularies(tft_output)
+        )
 
     logging.info("Model training started...")
-    classifier.fit(
+    history = classifier.fit(
         train_dataset,
         epochs=hyperparams["num_epochs"],
+        initial_epoch=initial_epoch or 0,
+        steps_per_epoch=steps_per_epoch,
         validation_data=eval_dataset,
-        callbacks=[early_stopping, tensorboard_callback],
+        callbacks=callbacks,
     )
     logging.info("Model training completed.")
 
-    return classifier
+    num_epochs = int(hyperparams["num_epochs"])
+    trained_epochs = (initial_epoch or 0) + len(history.epoch)
+    logging.info(
+        f"{'Warm' if warm_started else 'Cold'}-started training ran {trained_epochs} "
+        f"of {num_epochs} epochs, saving {num_epochs - trained_epochs} epochs."
+    )
 
+    return classifier, eval_dataset
 
-def evaluate(model, data_dir, raw_schema_location, tft_output_dir, hyperparams):
-    logging.info(f"Loading raw schema from {raw_schema_location}")
+
+def train(
+    train_data_dir,
+    eval_data_dir,
+    tft_output_dir,
+    hyperparams,
+    log_dir,
+    base_model_dir=None,
+    checkpoint_dir=None,
+    callbacks=None,
+):
 
     logging.info(f"Loading tft output from {tft_output_dir}")
     tft_output = tft.TFTransformOutput(tft_output_dir)
-    transformed_feature_spec = tft_output.transformed_feature_spec()
 
-    logging.info("Model evaluation started...")
-    eval_dataset = data.get_dataset(
+    classifier, _ = _train(
+        tft_output,
+        train_data_dir,
+        eval_data_dir,
+        hyperparams,
+        log_dir,
+        base_model_dir=base_model_dir,
+        checkpoint_dir=checkpoint_dir,
+        callbacks=callbacks,
+    )
+    return classifier
+
+
+def _get_eval_dataset(data_dir, tft_output, hyperparams):
+    return data.get_dataset(
         data_dir,
-        transformed_feature_spec,
+        tft_output.transformed_feature_spec(),
         hyperparams["batch_size"],
+        shuffle=False,
+        **_get_input_pipeline_args(hyperparams),
     )
 
-    evaluation_metrics = model.evaluate(eval_dataset)
+
+def _evaluate(classifier, eval_dataset, hyperparams):
+    """Returns the loss and evaluation_metrics of the classifier, in one pass."""
+    logging.info("Model evaluation started...")
+    if distribution.is_parameter_server_strategy(classifier.distribute_strategy):
+        # Model.evaluate does not support parameter servers: evaluate a local
+        # copy of the trained model on the chief instead.
+        local_model = keras.models.clone_model(classifier)
+        local_model.set_weights(classifier.get_weights())
+        _compile(local_model, hyperparams, evaluation_metrics.get_evaluation_metrics())
+        classifier = local_model
+    else:
+        # Compiled again for the evaluation metrics only, keeping the optimizer.
+        _compile(
+            classifier,
+            hyperparams,
+            evaluation_metrics.get_evaluation_metrics(),
+            optimizer=classifier.optimizer,
+        )
+
+    results = classifier.evaluate(eval_dataset, return_dict=True)
+    logging.info(f"Model evaluation completed: {results}")
+    return results
+
+
+def evaluate(model, data_dir, raw_schema_location, tft_output_dir, hyperparams):
+    """Returns the [loss, accuracy] of the model, with its compiled metrics.
+
+    train_and_evaluate returns the evaluation_metrics too, as a dict.
+    """
+    logging.info(f"Loading raw schema from {raw_schema_location}")
+
+    logging.info(f"Loading tft output from {tft_output_dir}")
+    tft_output = tft.TFTransformOutput(tft_output_dir)
+
+    logging.info("Model evaluation started...")
+    results = model.evaluate(_get_eval_dataset(data_dir, tft_output, hyperparams))
     logging.info("Model evaluation completed.")
 
-    return evaluation_metrics
+    return results
+
+
+def train_and_evaluate(
+    train_data_dir,
+    eval_data_dir,
+    tft_output_dir,
+    hyperparams,
+    log_dir,
+    base_model_dir=None,
+    checkpoint_dir=None,
+    callbacks=None,
+):
+    """Trains the model, then evaluates it on the dataset used for validation.
+
+    The transform output is loaded once. With eval_cache set, the eval split
+    cached during validation is evaluated without reading its files again.
+
+    Returns:
+      The trained classifier, and a dict of its loss and evaluation metrics.
+    """
+    logging.info(f"Loading tft output from {tft_output_dir}")
+    tft_output = tft.TFTransformOutput(tft_output_dir)
+
+    classifier, eval_dataset = _train(
+        tft_output,
+        train_data_dir,
+        eval_data_dir,
+        hyperparams,
+        log_dir,
+        base_model_dir=base_model_dir,
+        checkpoint_dir=checkpoint_dir,
+        callbacks=callbacks,
+    )
+    if eval_dataset is None:
+        # Parameter server training had no validation dataset.
+        eval_dataset = _get_eval_dataset(eval_data_dir, tft_output, hyperparams)
+    return classifier, _evaluate(classifier, eval_dataset, hyperparams)
@@ -0,0 +1,192 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Warm-start the classifier from the weights of a previous model.
+
+Weights are read directly from the variables checkpoint of a SavedModel (or
+from a Keras checkpoint), without deserializing the model. Embedding rows are
+remapped by token, using the vocabularies written next to the previous model,
+since vocabulary indices change between transform runs.
+"""
+
+import os
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+from src.common import features
+from src.model_training import embeddings
+
+VOCABULARIES_DIR = os.path.join("assets.extra", "vocabularies")
+VARIABLE_SUFFIX = ".ATTRIBUTES/VARIABLE_VALUE"
+
+
+def read_vocabularies(tft_output):
+    """Returns the vocabulary of each embedded feature, as lists of tokens."""
+    return {
+        feature_name: [
+            tf.compat.as_text(token)
+            for token in tft_output.vocabulary_by_name(feature_name)
+        ]
+        for feature_name in features.EMBEDDING_CATEGORICAL_FEATURES
+    }
+
+
+def write_vocabularies(model_dir, vocabularies):
+    """Writes the vocabularies next to a model, to remap it when warm-starting."""
+    vocabularies_dir = os.path.join(model_dir, VOCABULARIES_DIR)
+    tf.io.gfile.makedirs(vocabularies_dir)
+    for feature_name, vocabulary in vocabularies.items():
+        with tf.io.gfile.GFile(os.path.join(vocabularies_dir, feature_name), "w") as f:
+            f.write("".join(f"{token}\n" for token in vocabulary))
+
+
+def load_vocabularies(model_dir):
+    """Returns the vocabularies written next to a model, if any."""
+    vocabularies_dir = os.path.join(model_dir, VOCABULARIES_DIR)
+    if not tf.io.gfile.isdir(vocabularies_dir):
+        return {}
+    vocabularies = {}
+    for feature_name in tf.io.gfile.listdir(vocabularies_dir):
+        with tf.io.gfile.GFile(os.path.join(vocabularies_dir, feature_name)) as f:
+            vocabularies[feature_name] = f.read().splitlines()
+    return vocabularies
+
+
+def get_checkpoint_path(base_model_dir):
+    """Returns the checkpoint holding the weights of a SavedModel or checkpoint dir."""
+    saved_model_variables = os.path.join(base_model_dir, "variables", "variables")
+    if tf.io.gfile.exists(f"{saved_model_variables}.index"):
+        return saved_model_variables
+    if tf.io.gfile.isdir(base_model_dir):
+        return tf.train.latest_checkpoint(base_model_dir)
+    if tf.io.gfile.exists(f"{base_model_dir}.index"):
+        return base_model_dir
+    return None
+
+
+def _checkpoint_variables(layer, prefix=""):
+    """Yields (checkpoint key, layer, variable) for the weights of a Keras model.
+
+    Functional models track the layers with weights as layer_with_weights-<i>,
+    so the keys match the checkpoints of any model with the same architecture.
+    """
+    if isinstance(layer, tf.keras.Model):
+        weighted_layers = [sublayer for sublayer in layer.layers if sublayer.weights]
+        for index, sublayer in enumerate(weighted_layers):
+            yield from _checkpoint_variables(
+                sublayer, f"{prefix}layer_with_weights-{index}/"
+            )
+        return
+    for variable in layer.weights:
+        attribute = variable.name.split("/")[-1].split(":")[0]
+        yield f"{prefix}{attribute}/{VARIABLE_SUFFIX}", layer, variable
+
+
+def _embedding_feature_name(layer):
+    if isinstance(layer, tf.keras.layers.Embedding) and layer.name.endswith(
+        "_embedding"
+    ):
+        return features.original_name(layer.name[: -len("_embedding")])
+    return None
+
+
+def remap_embedding(old_embedding, new_embedding, old_vocabulary, new_vocabulary):
+    """Returns new_embedding with the rows of the tokens found in old_vocabulary.
+
+    The out-of-vocabulary bucket rows, which follow the vocabulary rows, are
+    copied as well if the number of buckets did not change. Rows of new tokens
+    keep their initial values.
+    """
+    old_indices = {token: index for index, token in enumerate(old_vocabulary)}
+    new_rows, old_rows = [], []
+    for new_index, token in enumerate(new_vocabulary):
+        old_index = old_indices.get(token)
+        if old_index is not None:
+            new_rows.append(new_index)
+            old_rows.append(old_index)
+
+    remapped = np.array(new_embedding, copy=True)
+    remapped[new_rows] = old_embedding[old_rows]
+
+    old_oov = old_embedding[len(old_vocabulary) :]
+    if len(old_oov) == len(remapped) - len(new_vocabulary):
+        remapped[len(new_vocabulary) :] = old_oov
+    return remapped, len(new_rows)
+
+
+def warm_start(classifier, base_model_dir, vocabularies):
+    """Restores the classifier weights from the model in base_model_dir.
+
+    Args:
+      classifier: the new Keras model, built with the current vocabularies.
+      base_model_dir: a SavedModel directory, a checkpoint directory, or a
+        checkpoint prefix, of a model with the same architecture.
+      vocabularies: the current vocabulary of each embedded feature.
+    Returns:
+      True if any weights were restored.
+    """
+    checkpoint_path = get_checkpoint_path(base_model_dir)
+    if not checkpoint_path:
+        logging.warning(f"No weights found in {base_model_dir}: cold start.")
+        return False
+
+    logging.info(f"Warm-starting from {checkpoint_path}")
+    reader = tf.train.load_checkpoint(checkpoint_path)
+    model_dir = (
+        base_model_dir
+        if tf.io.gfile.isdir(base_model_dir)
+        else os.path.dirname(base_model_dir)
+    )
+    old_vocabularies = load_vocabularies(model_dir)
+
+    num_restored = 0
+    for key, layer, variable in _checkpoint_variables(classifier):
+        if not reader.has_tensor(key):
+            logging.info(f"Not restoring {layer.name}: missing from the base model.")
+            continue
+        value = reader.get_tensor(key)
+
+        if isinstance(layer, embeddings.CompactEmbedding):
+            # Compact embedding rows are shared by values, and cannot be remapped.
+            logging.info(f"Not restoring {variable.name}: compact embedding.")
+            continue
+
+        feature_name = _embedding_feature_name(layer)
+        if feature_name:
+            if feature_name not in old_vocabularies:
+                logging.info(f"Not restoring {layer.name}: no base vocabulary.")
+                continue
+            value, num_tokens = remap_embedding(
+                value,
+                tf.convert_to_tensor(variable).numpy(),
+                old_vocabularies[feature_name],
+                vocabularies[feature_name],
+            )
+            logging.info(
+                f"Remapped {num_tokens} of {len(vocabularies[feature_name])} "
+                f"{feature_name} embedding rows."
+            )
+        elif tuple(value.shape) != tuple(variable.shape):
+            logging.info(
+                f"Not restoring {variable.name}: shape {value.shape} in the base "
+                f"model, {variable.shape} now."
+            )
+            continue
+
+        variable.assign(value)
+        num_restored += 1
+
+    logging.info(f"Restored {num_restored} variables from the base model.")
+    return num_restored > 0
@@ -14,20 +14,95 @@
 """Data preprocessing pipelines."""
 
 import os
+import re
+import json
+import logging
 
+import numpy as np
+import tensorflow as tf
 import tensorflow_transform as tft
 import tensorflow_data_validation as tfdv
 import apache_beam as beam
+from apache_beam.io.filesystem import CompressionTypes
 from apache_beam.io.gcp.datastore.v1new.datastoreio import WriteToDatastore
+from apache_beam.utils import shared
 import tensorflow_transform.beam as tft_beam
 from tensorflow_transform.tf_metadata import dataset_metadata
 from tensorflow_transform.tf_metadata import schema_utils
+from tfx_bsl.tfxio import tensor_adapter
+from tfx_bsl.tfxio import tensor_representation_util
 
 
-from src.preprocessing import transformations
+from src.common import data_manifest
+from src.preprocessing import sources, transformations
 
 RAW_SCHEMA_LOCATION = "src/raw_schema/schema.pbtxt"
 
+TRAIN_SPLIT = "train"
+EVAL_SPLIT = "eval"
+DEFAULT_SPLIT_RATIOS = {TRAIN_SPLIT: 8, EVAL_SPLIT: 2}
+SPLIT_HASH_BUCKETS = 1000000
+SPLIT_BATCH_SIZE = 1000
+# Analyzer cache entries are only readable by the tf.Transform version that wrote them.
+ANALYZER_CACHE_VERSION = f"tft-{tft.__version__}"
+
+BEAM_COMPRESSION_TYPES = {
+    "NONE": CompressionTypes.UNCOMPRESSED,
+    "GZIP": CompressionTypes.GZIP,
+    # Beam DEFLATE files are zlib streams, as read by tf.data ZLIB.
+    "ZLIB": CompressionTypes.DEFLATE,
+}
+
+
+def _get_parquet_schema(schema):
+    """Returns the pyarrow schema of the transformed features."""
+    import pyarrow as pa
+
+    arrow_types = {
+        tf.float32: pa.float32(),
+        tf.int64: pa.int64(),
+        tf.string: pa.binary(),
+    }
+    feature_spec = schema_utils.schema_as_feature_spec(schema).feature_spec
+    return pa.schema(
+        [(name, arrow_types[spec.dtype]) for name, spec in sorted(feature_spec.items())]
+    )
+
+
+def to_parquet_record(instance):
+    """Converts the numpy scalars of a transformed instance to Python values."""
+    return {key: value.item() for key, value in instance.items()}
+
+
+@beam.ptransform_fn
+def WriteTransformedData(
+    pcoll, file_path_prefix, schema, data_format, compression_type, num_shards
+):
+    """Writes transformed instances as tf.Example TFRecords or Parquet files."""
+    file_name_suffix = data_manifest.get_file_suffix(compression_type, data_format)
+
+    if data_format == data_manifest.PARQUET_FORMAT:
+        return (
+            pcoll
+            | "To Parquet Records" >> beam.Map(to_parquet_record)
+            | "Write Parquet"
+            >> beam.io.WriteToParquet(
+                file_path_prefix=file_path_prefix,
+                schema=_get_parquet_schema(schema),
+                codec=compression_type.lower(),
+                file_name_suffix=file_name_suffix,
+                num_shards=num_shards,
+            )
+        )
+
+    return pcoll | "Write TFRecords" >> beam.io.tfrecordio.WriteToTFRecord(
+        file_path_prefix=file_path_prefix,
+        file_name_suffix=file_name_suffix,
+        num_shards=num_shards,
+        compression_type=BEAM_COMPRESSION_TYPES[compression_type],
+        coder=tft.coders.ExampleProtoCoder(schema),
+    )
+
 
 def parse_bq_record(bq_record):
     output = {}
@@ -36,31 +111,255 @@ def parse_bq_record(bq_record):
     return output
 
 
-def split_dataset(bq_row, num_partitions, ratio):
-    import json
+def get_raw_arrow_schema(raw_feature_spec):
+    """Returns the pyarrow schema of raw data record batches.
+
+    Every feature is a list column holding the single value of each row, as
+    parse_bq_record wraps each value in a list.
+    """
+    import pyarrow as pa
+
+    arrow_types = {
+        tf.float32: pa.float32(),
+        tf.int64: pa.int64(),
+        tf.string: pa.binary(),
+    }
+    return pa.schema(
+        [
+            (name, pa.list_(arrow_types[spec.dtype]))
+            for name, spec in sorted(raw_feature_spec.items())
+        ]
+    )
+
+
+def get_raw_tensor_adapter_config(raw_schema, arrow_schema):
+    """Returns the TensorAdapterConfig of raw data record batches."""
+    return tensor_adapter.TensorAdapterConfig(
+        arrow_schema,
+        tensor_representation_util.GetTensorRepresentationsFromSchema(raw_schema),
+    )
+
+
+def parse_bq_records(bq_records, arrow_schema):
+    """Batched parse_bq_record: converts BigQuery rows to a pyarrow RecordBatch.
+
+    Columns are built with one conversion per feature rather than one dict and
+    one list per row and feature.
+    """
+    import pyarrow as pa
+
+    offsets = pa.array(np.arange(len(bq_records) + 1, dtype=np.int32))
+    columns = []
+    for field in arrow_schema:
+        values = pa.array(
+            [bq_record[field.name] for bq_record in bq_records],
+            type=field.type.value_type,
+        )
+        columns.append(pa.ListArray.from_arrays(offsets, values))
+    return pa.RecordBatch.from_arrays(columns, schema=arrow_schema)
+
+
+def record_batch_to_instances(record_batch):
+    """Converts a RecordBatch produced by parse_bq_records to instance dicts."""
+    columns = record_batch.to_pydict()
+    names = list(columns.keys())
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def _key_value(value):
+    """Unwraps the single value of a parsed feature."""
+    return value[0] if isinstance(value, list) else value
+
+
+def _split_keys(rows, key_column=None):
+    """Returns the string keys hashed to assign rows to splits.
+
+    The key is the value of key_column, or all the row values ordered by column
+    name when key_column is None. Raw BigQuery rows and rows parsed with
+    parse_bq_record get the same keys.
+    """
+    if key_column:
+        return [str(_key_value(row[key_column])) for row in rows]
+    return [
+        "\x1f".join(str(_key_value(row[key])) for key in sorted(row)) for row in rows
+    ]
+
+
+def hash_split(rows, split_ratios, key_column=None):
+    """Returns the index of the split of each row, in the order of split_ratios.
+
+    Rows are assigned by the FarmHash fingerprint of their key, computed for the
+    whole batch in a single vectorized call, so the assignment is stable across
+    runs, workers and batch boundaries.
+    """
+    ratios = np.array(list(split_ratios.values()), dtype=np.float64)
+    boundaries = np.cumsum(ratios) / ratios.sum() * SPLIT_HASH_BUCKETS
+    buckets = tf.strings.to_hash_bucket_fast(
+        _split_keys(rows, key_column), SPLIT_HASH_BUCKETS
+    ).numpy()
+    return np.searchsorted(boundaries, buckets, side="right")
+
+
+class HashSplitFn(beam.DoFn):
+    """Assigns batches of rows to named splits, emitted as tagged outputs.
+
+    If arrow_schema is set, the input rows are raw BigQuery rows and each split
+    of a batch is emitted as a single RecordBatch built by parse_bq_records.
+    """
+
+    def __init__(self, split_ratios, key_column=None, arrow_schema=None):
+        self._split_ratios = split_ratios
+        self._split_names = list(split_ratios.keys())
+        self._key_column = key_column
+        self._arrow_schema = arrow_schema
+
+    def process(self, rows):
+        split_indices = hash_split(rows, self._split_ratios, self._key_column)
+
+        if self._arrow_schema is None:
+            for row, split_index in zip(rows, split_indices):
+                yield beam.pvalue.TaggedOutput(self._split_names[split_index], row)
+            return
+
+        for split_index, split_name in enumerate(self._split_names):
+            split_rows = [
+                row for row, index in zip(rows, split_indices) if index == split_index
+            ]
+            if split_rows:
+                yield beam.pvalue.TaggedOutput(
+                    split_name, parse_bq_records(split_rows, self._arrow_schema)
+                )
 
-    assert num_partitions == len(ratio)
-    bucket = sum(map(ord, json.dumps(bq_row))) % sum(ratio)
-    total = 0
-    for i, part in enumerate(ratio):
-        total += part
-        if bucket < total:
-            return i
-    return len(ratio) - 1
+
+def _validate_split_ratios(split_ratios, write_raw_data=False):
+    if TRAIN_SPLIT not in split_ratios:
+        raise ValueError(f"split_ratios must contain a {TRAIN_SPLIT} split.")
+    if write_raw_data and EVAL_SPLIT not in split_ratios:
+        raise ValueError(
+            f"split_ratios must contain an {EVAL_SPLIT} split, whose raw data is "
+            "written when write_raw_data is set."
+        )
+    if any(ratio <= 0 for ratio in split_ratios.values()):
+        raise ValueError(f"split_ratios must be positive: {split_ratios}.")
+    return split_ratios
+
+
+@beam.ptransform_fn
+def ReadRawSplits(
+    pipeline,
+    source_format,
+    query,
+    file_pattern,
+    project,
+    gcs_location,
+    split_ratios,
+    split_key_column=None,
+    arrow_schema=None,
+):
+    """Reads raw rows and assigns them to splits.
+
+    Returns a dictionary of PCollections keyed by split name. Rows are parsed
+    instance dicts, or RecordBatches if arrow_schema is set.
+    """
+    raw_data = pipeline | "Read Raw Data" >> sources.ReadRawData(
+        source_format,
+        query=query,
+        file_pattern=file_pattern,
+        project=project,
+        gcs_location=gcs_location,
+    )
+    if arrow_schema is None:
+        raw_data = raw_data | "Parse Data" >> beam.Map(parse_bq_record)
+
+    raw_splits = (
+        raw_data
+        | "Batch" >> beam.BatchElements(max_batch_size=SPLIT_BATCH_SIZE)
+        | "Split"
+        >> beam.ParDo(
+            HashSplitFn(split_ratios, split_key_column, arrow_schema)
+        ).with_outputs(*split_ratios.keys())
+    )
+    return {split_name: raw_splits[split_name] for split_name in split_ratios}
+
+
+def list_source_partitions(source_format, source_file_pattern, partition_name=None):
+    """Returns the names of the source partitions of an incremental transform.
+
+    Each file of a snapshot source is a partition. A BigQuery query is a single
+    partition, named by partition_name (e.g. the date of the data it selects).
+    """
+    if source_format == sources.BIGQUERY_SOURCE:
+        if not partition_name:
+            raise ValueError(
+                "partition_name must be supplied to incrementally transform "
+                "BigQuery data."
+            )
+        return [partition_name]
+
+    partitions = sorted(tf.io.gfile.glob(source_file_pattern))
+    partition_ids = [_partition_id(partition) for partition in partitions]
+    if len(set(partition_ids)) != len(partition_ids):
+        raise ValueError(
+            f"Source files matching {source_file_pattern} must have distinct names "
+            "to be used as partitions."
+        )
+    return partitions
+
+
+def _partition_id(partition_name):
+    """Returns a file name safe identifier of a source partition."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(partition_name))
+
+
+def _transform_fn_exists(transform_artifact_dir):
+    return tf.io.gfile.exists(
+        os.path.join(transform_artifact_dir, tft.TFTransformOutput.TRANSFORM_FN_DIR)
+    )
+
+
+def get_analyzer_cache_dir(analyzer_cache_dir):
+    """Returns the versioned analyzer cache location under analyzer_cache_dir."""
+    return os.path.join(analyzer_cache_dir, ANALYZER_CACHE_VERSION)
 
 
 def run_transform_pipeline(args):
 
     pipeline_options = beam.pipeline.PipelineOptions(flags=[], **args)
 
-    raw_data_query = args["raw_data_query"]
+    raw_data_query = args.get("raw_data_query")
     write_raw_data = args["write_raw_data"]
     exported_data_prefix = args["exported_data_prefix"]
     transformed_data_prefix = args["transformed_data_prefix"]
     transform_artifact_dir = args["transform_artifact_dir"]
     temporary_dir = args["temporary_dir"]
-    gcs_location = args["gcs_location"]
-    project = args["project"]
+    gcs_location = args.get("gcs_location")
+    project = args.get("project")
+    source_format = sources.validate_source_format(args.get("source_format"))
+    source_file_pattern = args.get("source_file_pattern")
+    data_format = data_manifest.validate_data_format(args.get("data_format"))
+    compression_type = data_manifest.validate_compression_type(
+        args.get(
+            "compression_type", data_manifest.default_compression_type(data_format)
+        ),
+        data_format,
+    )
+    num_shards = int(args.get("num_shards", 0))
+    split_ratios = _validate_split_ratios(
+        args.get("split_ratios", DEFAULT_SPLIT_RATIOS), write_raw_data
+    )
+    split_key_column = args.get("split_key_column")
+    batched_parse = bool(args.get("batched_parse", False))
+    incremental = bool(args.get("incremental", False))
+    analyzer_cache_dir = args.get("analyzer_cache_dir")
+
+    if incremental and _transform_fn_exists(transform_artifact_dir):
+        return run_incremental_transform_pipeline(args)
+
+    partitions = []
+    if incremental or analyzer_cache_dir:
+        partitions = list_source_partitions(
+            source_format, source_file_pattern, args.get("partition_name")
+        )
 
     source_raw_schema = tfdv.load_schema_text(RAW_SCHEMA_LOCATION)
     raw_feature_spec = schema_utils.schema_as_feature_spec(
@@ -71,32 +370,112 @@ def run_transform_pipeline(args):
         schema_utils.schema_from_feature_spec(raw_feature_spec)
     )
 
+    # Batched parsing feeds RecordBatches to tf.Transform, described by a
+    # TensorAdapterConfig instead of the raw metadata.
+    arrow_schema = None
+    raw_data_metadata = raw_metadata
+    if batched_parse:
+        arrow_schema = get_raw_arrow_schema(raw_feature_spec)
+        raw_data_metadata = get_raw_tensor_adapter_config(
+            raw_metadata.schema, arrow_schema
+        )
+
     with beam.Pipeline(options=pipeline_options) as pipeline:
         with tft_beam.Context(temporary_dir):
 
-            # Read raw BigQuery data.
-            raw_train_data, raw_eval_data = (
-                pipeline
-                | "Read Raw Data"
-                >> beam.io.ReadFromBigQuery(
+            if analyzer_cache_dir:
+                # Read each source partition (span) separately, so that its
+                # analyzer accumulators are cached under its own dataset key.
+                partition_splits = {}
+                for partition_name in partitions:
+                    partition_id = _partition_id(partition_name)
+                    partition_splits[partition_id] = (
+                        pipeline
+                        | f"Read & Split {partition_id}"
+                        >> ReadRawSplits(
+                            source_format,
+                            query=raw_data_query,
+                            file_pattern=partition_name,
+                            project=project,
+                            gcs_location=gcs_location,
+                            split_ratios=split_ratios,
+                            split_key_column=split_key_column,
+                            arrow_schema=arrow_schema,
+                        )
+                    )
+
+                dataset_keys = [
+                    tft_beam.analyzer_cache.DatasetKey(partition_id)
+                    for partition_id in partition_splits
+                ]
+                raw_train_data_dict = {
+                    dataset_key: partition_splits[dataset_key.key][TRAIN_SPLIT]
+                    for dataset_key in dataset_keys
+                }
+                cache_dir = get_analyzer_cache_dir(analyzer_cache_dir)
+
+                # Read the accumulators of the spans analyzed by previous runs.
+                input_cache = (
+                    pipeline
+                    | "Read Analyzer Cache"
+                    >> tft_beam.analyzer_cache.ReadAnalysisCacheFromFS(
+                        cache_dir, dataset_keys
+                    )
+                )
+
+                # Analyze only the spans missing from the cache.
+                transform_fn, output_cache = (
+                    raw_train_data_dict,
+                    input_cache,
+                    raw_data_metadata,
+                ) | "Analyze" >> tft_beam.AnalyzeDatasetWithCache(
+                    transformations.preprocessing_fn
+                )
+
+                # Write the accumulators of the newly analyzed spans.
+                _ = (
+                    output_cache
+                    | "Write Analyzer Cache"
+                    >> tft_beam.analyzer_cache.WriteAnalysisCacheToFS(
+                        pipeline, cache_dir, dataset_keys
+                    )
+                )
+
+                raw_splits = {
+                    split_name: [
+                        splits[split_name] for splits in partition_splits.values()
+                    ]
+                    | f"Flatten {split_name}" >> beam.Flatten()
+                    for split_name in split_ratios
+                }
+
+                # Transform the raw train data using transform_fn.
+                transformed_train_dataset = (
+                    (raw_splits[TRAIN_SPLIT], raw_data_metadata),
+                    transform_fn,
+                ) | "Transform train" >> tft_beam.TransformDataset()
+            else:
+                # Read raw data from BigQuery or from a file snapshot, and split it.
+                raw_splits = pipeline | "Read & Split Raw Data" >> ReadRawSplits(
+                    source_format,
                     query=raw_data_query,
+                    file_pattern=source_file_pattern,
                     project=project,
-                    use_standard_sql=True,
                     gcs_location=gcs_location,
+                    split_ratios=split_ratios,
+                    split_key_column=split_key_column,
+                    arrow_schema=arrow_schema,
                 )
-                | "Parse Data" >> beam.Map(parse_bq_record)
-                | "Split" >> beam.Partition(split_dataset, 2, ratio=[8, 2])
-            )
 
-            # Create a train_dataset from the data and schema.
-            raw_train_dataset = (raw_train_data, raw_metadata)
+                # Create a train_dataset from the data and schema.
+                raw_train_dataset = (raw_splits[TRAIN_SPLIT], raw_data_metadata)
 
-            # Analyze and transform raw_train_dataset to produced transformed_train_dataset and transform_fn.
-            transformed_train_dataset, transform_fn = (
-                raw_train_dataset
-                | "Analyze & Transform"
-                >> tft_beam.AnalyzeAndTransformDataset(transformations.preprocessing_fn)
-            )
+                # Analyze and transform raw_train_dataset to produced transformed_train_dataset and transform_fn.
+                transformed_train_dataset, transform_fn = (
+                    raw_train_dataset
+                    | "Analyze & Transform"
+                    >> tft_beam.AnalyzeAndTransformDataset(transformations.preprocessing_fn)
+                )
 
             # Get data and schema separately from the transformed_dataset.
             transformed_train_data, transformed_metadata = transformed_train_dataset
@@ -105,37 +484,47 @@ def run_transform_pipeline(args):
             _ = (
                 transformed_train_data
                 | "Write Transformed Train Data"
-                >> beam.io.tfrecordio.WriteToTFRecord(
+                >> WriteTransformedData(
                     file_path_prefix=os.path.join(
                         transformed_data_prefix, "train/data"
                     ),
-                    file_name_suffix=".gz",
-                    coder=tft.coders.ExampleProtoCoder(transformed_metadata.schema),
+                    schema=transformed_metadata.schema,
+                    data_format=data_format,
+                    compression_type=compression_type,
+                    num_shards=num_shards,
                 )
             )
 
-            # Create a eval_dataset from the data and schema.
-            raw_eval_dataset = (raw_eval_data, raw_metadata)
+            for split_name in split_ratios:
+                if split_name == TRAIN_SPLIT:
+                    continue
 
-            # Transform raw_eval_dataset to produced transformed_eval_dataset using transform_fn.
-            transformed_eval_dataset = (
-                raw_eval_dataset,
-                transform_fn,
-            ) | "Transform" >> tft_beam.TransformDataset()
+                # Create a dataset from the split data and schema.
+                raw_split_dataset = (raw_splits[split_name], raw_data_metadata)
 
-            # Get data from the transformed_eval_dataset.
-            transformed_eval_data, _ = transformed_eval_dataset
+                # Transform raw_split_dataset using transform_fn.
+                transformed_split_dataset = (
+                    raw_split_dataset,
+                    transform_fn,
+                ) | f"Transform {split_name}" >> tft_beam.TransformDataset()
 
-            # write transformed train data.
-            _ = (
-                transformed_eval_data
-                | "Write Transformed Eval Data"
-                >> beam.io.tfrecordio.WriteToTFRecord(
-                    file_path_prefix=os.path.join(transformed_data_prefix, "eval/data"),
-                    file_name_suffix=".gz",
-                    coder=tft.coders.ExampleProtoCoder(transformed_metadata.schema),
+                # Get data from the transformed_split_dataset.
+                transformed_split_data, _ = transformed_split_dataset
+
+                # write transformed split data.
+                _ = (
+                    transformed_split_data
+                    | f"Write Transformed {split_name} Data"
+                    >> WriteTransformedData(
+                        file_path_prefix=os.path.join(
+                            transformed_data_prefix, f"{split_name}/data"
+                        ),
+                        schema=transformed_metadata.schema,
+                        data_format=data_format,
+                        compression_type=compression_type,
+                        num_shards=num_shards,
+                    )
                 )
-            )
 
             # Write transform_fn.
             _ = transform_fn | "Write Transform Artifacts" >> tft_beam.WriteTransformFn(
@@ -143,6 +532,12 @@ def run_transform_pipeline(args):
             )
 
             if write_raw_data:
+                raw_eval_data = raw_splits[EVAL_SPLIT]
+                if batched_parse:
+                    raw_eval_data = raw_eval_data | "To Raw Instances" >> beam.FlatMap(
+                        record_batch_to_instances
+                    )
+
                 # write raw eval data.
                 _ = (
                     raw_eval_data
@@ -154,60 +549,212 @@ def run_transform_pipeline(args):
                     )
                 )
 
+    # Record the format and codec so that data.get_dataset picks the matching reader.
+    data_manifest.write_manifest(
+        transformed_data_prefix, compression_type, num_shards, data_format, partitions
+    )
 
-def convert_to_jsonl(bq_record):
-    import json
 
+def run_incremental_transform_pipeline(args):
+    """Transforms only the source partitions that were not transformed yet.
+
+    The transform_fn previously written to transform_artifact_dir is reused as
+    is: no analysis runs, so the cost is proportional to the new data. Values
+    unseen by the existing vocabularies map to their OOV bucket. Refreshing the
+    vocabularies and statistics requires a full run (without incremental), as
+    new vocabulary indices invalidate the previously transformed data.
+    """
+
+    pipeline_options = beam.pipeline.PipelineOptions(flags=[], **args)
+
+    raw_data_query = args.get("raw_data_query")
+    transformed_data_prefix = args["transformed_data_prefix"]
+    transform_artifact_dir = args["transform_artifact_dir"]
+    temporary_dir = args["temporary_dir"]
+    gcs_location = args.get("gcs_location")
+    project = args.get("project")
+    source_format = sources.validate_source_format(args.get("source_format"))
+    source_file_pattern = args.get("source_file_pattern")
+    split_ratios = _validate_split_ratios(
+        args.get("split_ratios", DEFAULT_SPLIT_RATIOS)
+    )
+    split_key_column = args.get("split_key_column")
+    batched_parse = bool(args.get("batched_parse", False))
+
+    # The format and codec of the existing transformed data are kept.
+    manifest = data_manifest.load_manifest(transformed_data_prefix) or {}
+    data_format = data_manifest.validate_data_format(
+        manifest.get("data_format", args.get("data_format"))
+    )
+    compression_type = data_manifest.validate_compression_type(
+        manifest.get(
+            "compression_type",
+            args.get(
+                "compression_type", data_manifest.default_compression_type(data_format)
+            ),
+        ),
+        data_format,
+    )
+    num_shards = int(manifest.get("num_shards", args.get("num_shards", 0)))
+
+    transformed_partitions = set(manifest.get("partitions", []))
+    partitions = list_source_partitions(
+        source_format, source_file_pattern, args.get("partition_name")
+    )
+    new_partitions = [p for p in partitions if p not in transformed_partitions]
+    if not new_partitions:
+        logging.info("All source partitions are already transformed.")
+        return
+    logging.info(f"Transforming new source partitions: {new_partitions}")
+
+    source_raw_schema = tfdv.load_schema_text(RAW_SCHEMA_LOCATION)
+    raw_feature_spec = schema_utils.schema_as_feature_spec(
+        source_raw_schema
+    ).feature_spec
+
+    raw_data_metadata = dataset_metadata.DatasetMetadata(
+        schema_utils.schema_from_feature_spec(raw_feature_spec)
+    )
+    arrow_schema = None
+    if batched_parse:
+        arrow_schema = get_raw_arrow_schema(raw_feature_spec)
+        raw_data_metadata = get_raw_tensor_adapter_config(
+            raw_data_metadata.schema, arrow_schema
+        )
+
+    transformed_schema = tft.TFTransformOutput(
+        transform_artifact_dir
+    ).transformed_metadata.schema
+
+    with beam.Pipeline(options=pipeline_options) as pipeline:
+        with tft_beam.Context(temporary_dir):
+
+            # Read the existing transform_fn.
+            transform_fn = pipeline | "Read Transform Artifacts" >> tft_beam.ReadTransformFn(
+                transform_artifact_dir
+            )
+
+            for partition_name in new_partitions:
+                partition_id = _partition_id(partition_name)
+
+                # Read and split the partition data.
+                raw_splits = pipeline | f"Read & Split {partition_id}" >> ReadRawSplits(
+                    source_format,
+                    query=raw_data_query,
+                    file_pattern=partition_name,
+                    project=project,
+                    gcs_location=gcs_location,
+                    split_ratios=split_ratios,
+                    split_key_column=split_key_column,
+                    arrow_schema=arrow_schema,
+                )
+
+                for split_name in split_ratios:
+                    # Transform the partition split using the existing transform_fn.
+                    transformed_split_data, _ = (
+                        (raw_splits[split_name], raw_data_metadata),
+                        transform_fn,
+                    ) | f"Transform {partition_id} {split_name}" >> tft_beam.TransformDataset()
+
+                    # Write the transformed partition split next to the existing data.
+                    _ = (
+                        transformed_split_data
+                        | f"Write Transformed {partition_id} {split_name} Data"
+                        >> WriteTransformedData(
+                            file_path_prefix=os.path.join(
+                                transformed_data_prefix,
+                                f"{split_name}/data-{partition_id}",
+                            ),
+                            schema=transformed_schema,
+                            data_format=data_format,
+                            compression_type=compression_type,
+                            num_shards=num_shards,
+                        )
+                    )
+
+    data_manifest.write_manifest(
+        transformed_data_prefix,
+        compression_type,
+        num_shards,
+        data_format,
+        sorted(transformed_partitions.union(new_partitions)),
+    )
+
+
+def convert_to_jsonl(bq_record):
     output = {}
     for key in bq_record:
         output[key] = [bq_record[key]]
     return json.dumps(output)
 
 
+def convert_to_jsonl_block(bq_records):
+    """Batched convert_to_jsonl: returns the JSONL lines of the rows as one block."""
+    return "\n".join(
+        json.dumps({key: [value] for key, value in bq_record.items()})
+        for bq_record in bq_records
+    )
+
+
 def run_extract_pipeline(args):
 
     pipeline_options = beam.pipeline.PipelineOptions(flags=[], **args)
 
-    sql_query = args["sql_query"]
+    sql_query = args.get("sql_query")
     exported_data_prefix = args["exported_data_prefix"]
     temporary_dir = args["temporary_dir"]
-    gcs_location = args["gcs_location"]
-    project = args["project"]
+    gcs_location = args.get("gcs_location")
+    project = args.get("project")
+    source_format = sources.validate_source_format(args.get("source_format"))
+    source_file_pattern = args.get("source_file_pattern")
+    batched_convert = bool(args.get("batched_convert", False))
 
     with beam.Pipeline(options=pipeline_options) as pipeline:
         with tft_beam.Context(temporary_dir):
 
-            # Read BigQuery data.
-            raw_data = (
-                pipeline
-                | "Read Data"
-                >> beam.io.ReadFromBigQuery(
-                    query=sql_query,
-                    project=project,
-                    use_standard_sql=True,
-                    gcs_location=gcs_location,
-                )
-                | "Parse Data" >> beam.Map(convert_to_jsonl)
+            # Read data from BigQuery or from a file snapshot.
+            raw_data = pipeline | "Read Data" >> sources.ReadRawData(
+                source_format,
+                query=sql_query,
+                file_pattern=source_file_pattern,
+                project=project,
+                gcs_location=gcs_location,
             )
 
+            if batched_convert:
+                # Each element is a block of JSONL lines, written as is.
+                raw_data = (
+                    raw_data
+                    | "Batch Data" >> beam.BatchElements()
+                    | "Parse Data" >> beam.Map(convert_to_jsonl_block)
+                )
+            else:
+                raw_data = raw_data | "Parse Data" >> beam.Map(convert_to_jsonl)
+
             # Write raw data to GCS as JSONL files.
             _ = raw_data | "Write Data" >> beam.io.WriteToText(
                 file_path_prefix=exported_data_prefix, file_name_suffix=".jsonl"
             )
 
 
-def parse_prediction_results(jsonl):
+def get_prediction_properties(prediction_result):
+    """Returns the Datastore properties of an {"instance", "prediction"} result."""
     import uuid
-    import json
 
-    prediction_results = json.loads(jsonl)["prediction"]
+    prediction = prediction_result["prediction"]
     prediction_id = str(uuid.uuid4())
-    scores = prediction_results["scores"]
-    classes = prediction_results["classes"]
+    scores = prediction["scores"]
+    classes = prediction["classes"]
 
     return {"prediction_id": prediction_id, "scores": scores, "classes": classes}
 
 
+def parse_prediction_results(jsonl):
+    import json
+
+    return get_prediction_properties(json.loads(jsonl))
+
+
 def create_datastore_entity(prediction_response, kind):
     from apache_beam.io.gcp.datastore.v1new.types import Entity
     from apache_beam.io.gcp.datastore.v1new.types import Key
@@ -235,3 +782,84 @@ def run_store_predictions_pipeline(args):
             >> beam.Map(create_datastore_entity, datastore_kind)
             | "WriteToDatastore" >> WriteToDatastore(project=project)
         )
+
+
+class PredictDoFn(beam.DoFn):
+    """Scores batches of instances with the serving_default signature of a model.
+
+    As in Beam RunInference, the model is loaded once per worker process, and
+    shared by the threads running the DoFn.
+    """
+
+    def __init__(self, model_dir, shared_handle):
+        self._model_dir = model_dir
+        self._shared_handle = shared_handle
+        self._predict_fn = None
+
+    def setup(self):
+        from src.model_serving import server
+
+        self._predict_fn = self._shared_handle.acquire(
+            lambda: server.load_predict_fn(self._model_dir)
+        )
+
+    def process(self, instances):
+        for instance, prediction in zip(instances, self._predict_fn(instances)):
+            yield {"instance": instance, "prediction": prediction}
+
+
+def run_fused_prediction_pipeline(args):
+    """Scores the serving data as it is read, without materializing it as JSONL.
+
+    Predictions are written to Datastore when datastore_kind is set, and as
+    JSONL prediction results when prediction_results_prefix is set.
+    """
+
+    pipeline_options = beam.pipeline.PipelineOptions(flags=[], **args)
+
+    model_dir = args["model_dir"]
+    datastore_kind = args.get("datastore_kind")
+    prediction_results_prefix = args.get("prediction_results_prefix")
+    if not datastore_kind and not prediction_results_prefix:
+        raise ValueError(
+            "At least one of datastore_kind and prediction_results_prefix must be set."
+        )
+    source_format = sources.validate_source_format(args.get("source_format"))
+
+    with beam.Pipeline(options=pipeline_options) as pipeline:
+        prediction_results = (
+            pipeline
+            | "Read Data"
+            >> sources.ReadRawData(
+                source_format,
+                query=args.get("sql_query"),
+                file_pattern=args.get("source_file_pattern"),
+                project=args.get("project"),
+                gcs_location=args.get("gcs_location"),
+            )
+            | "Convert To Instances"
+            >> beam.Map(lambda row: {key: [value] for key, value in row.items()})
+            | "Batch Instances"
+            >> beam.BatchElements(
+                min_batch_size=int(args.get("min_batch_size", 64)),
+                max_batch_size=int(args.get("max_batch_size", 4096)),
+            )
+            | "Predict" >> beam.ParDo(PredictDoFn(model_dir, shared.Shared()))
+        )
+
+        if prediction_results_prefix:
+            _ = (
+                prediction_results
+                | "Format Prediction Results" >> beam.Map(json.dumps)
+                | "Write Prediction Results"
+                >> beam.io.WriteToText(prediction_results_prefix)
+            )
+
+        if datastore_kind:
+            _ = (
+                prediction_results
+                | "Get Prediction Properties" >> beam.Map(get_prediction_properties)
+                | "ConvertToDatastoreEntity"
+                >> beam.Map(create_datastore_entity, datastore_kind)
+                | "WriteToDatastore" >> WriteToDatastore(project=args["project"])
+            )
@@ -0,0 +1,310 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Raw data sources for the ETL pipelines.
+
+Raw rows are read either from BigQuery or from a local or GCS snapshot of a
+BigQuery query in CSV, Avro, Parquet, or JSONL format. Every source yields the
+same rows: dictionaries of scalar values keyed by column name.
+
+To materialize a query once as a snapshot for reuse:
+
+    python -m src.preprocessing.sources \
+        --query="SELECT ..." --project=PROJECT --gcs-location=gs://BUCKET/tmp \
+        --output-prefix=snapshots/train/data --source-format=avro
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+
+import tensorflow as tf
+import tensorflow_data_validation as tfdv
+import apache_beam as beam
+from tensorflow_transform.tf_metadata import schema_utils
+
+BIGQUERY_SOURCE = "bigquery"
+CSV_SOURCE = "csv"
+AVRO_SOURCE = "avro"
+PARQUET_SOURCE = "parquet"
+JSONL_SOURCE = "jsonl"
+SNAPSHOT_FORMATS = [CSV_SOURCE, AVRO_SOURCE, PARQUET_SOURCE, JSONL_SOURCE]
+SOURCE_FORMATS = [BIGQUERY_SOURCE] + SNAPSHOT_FORMATS
+
+FILE_SUFFIXES = {
+    CSV_SOURCE: ".csv",
+    AVRO_SOURCE: ".avro",
+    PARQUET_SOURCE: ".parquet",
+    JSONL_SOURCE: ".jsonl",
+}
+
+RAW_SCHEMA_LOCATION = "src/raw_schema/schema.pbtxt"
+
+
+def validate_source_format(source_format):
+    """Returns the normalized source format, or raises ValueError if unsupported."""
+    source_format = (source_format or BIGQUERY_SOURCE).lower()
+    if source_format not in SOURCE_FORMATS:
+        raise ValueError(
+            f"Invalid source format {source_format}. "
+            f"Supported formats: {SOURCE_FORMATS}."
+        )
+    return source_format
+
+
+def get_column_types(raw_schema_location=RAW_SCHEMA_LOCATION):
+    """Returns the ordered mapping of raw column names to tf dtypes."""
+    raw_schema = tfdv.load_schema_text(raw_schema_location)
+    feature_spec = schema_utils.schema_as_feature_spec(raw_schema).feature_spec
+    return {
+        feature.name: feature_spec[feature.name].dtype
+        for feature in raw_schema.feature
+        if feature.name in feature_spec
+    }
+
+
+def _to_python_value(value, dtype):
+    if dtype == tf.int64:
+        return int(value)
+    if dtype == tf.float32:
+        return float(value)
+    return value
+
+
+def parse_csv_line(line, column_names, column_types):
+    """Converts a CSV line into a row, typed as in the raw schema."""
+    values = next(csv.reader([line]))
+    return {
+        name: _to_python_value(value, column_types.get(name, tf.string))
+        for name, value in zip(column_names, values)
+    }
+
+
+def parse_json_line(line):
+    """Converts a JSONL line into a row.
+
+    Single-value lists, as written by etl.convert_to_jsonl, are unwrapped so
+    the output of the extract pipeline can be read back as well.
+    """
+    row = json.loads(line)
+    return {
+        key: value[0] if isinstance(value, list) and len(value) == 1 else value
+        for key, value in row.items()
+    }
+
+
+def format_csv_line(row, column_names):
+    output = io.StringIO()
+    csv.writer(output, lineterminator="").writerow(
+        [row[name] for name in column_names]
+    )
+    return output.getvalue()
+
+
+def select_columns(row, column_names):
+    return {name: row[name] for name in column_names}
+
+
+def get_avro_schema(column_names, column_types):
+    avro_types = {tf.int64: "long", tf.float32: "double", tf.string: "string"}
+    return {
+        "type": "record",
+        "name": "RawRow",
+        "fields": [
+            {"name": name, "type": avro_types[column_types[name]]}
+            for name in column_names
+        ],
+    }
+
+
+def get_parquet_schema(column_names, column_types):
+    import pyarrow as pa
+
+    arrow_types = {
+        tf.int64: pa.int64(),
+        tf.float32: pa.float64(),
+        tf.string: pa.string(),
+    }
+    return pa.schema(
+        [(name, arrow_types[column_types[name]]) for name in column_names]
+    )
+
+
+@beam.ptransform_fn
+def ReadRawData(
+    pipeline,
+    source_format,
+    query=None,
+    file_pattern=None,
+    project=None,
+    gcs_location=None,
+    column_names=None,
+):
+    """Reads raw rows from BigQuery or from a snapshot in source_format.
+
+    Args:
+      pipeline: the Beam pipeline.
+      source_format: one of SOURCE_FORMATS.
+      query: BigQuery SQL query, for the bigquery source.
+      file_pattern: local or GCS file pattern, for snapshot sources.
+      project: GCP project, for the bigquery source.
+      gcs_location: GCS location of the BigQuery export, for the bigquery source.
+      column_names: ordered CSV column names. Defaults to the raw schema columns.
+    Returns:
+      A PCollection of dictionaries of scalar values keyed by column name.
+    """
+    source_format = validate_source_format(source_format)
+
+    if source_format == BIGQUERY_SOURCE:
+        return pipeline | "Read From BigQuery" >> beam.io.ReadFromBigQuery(
+            query=query,
+            project=project,
+            use_standard_sql=True,
+            gcs_location=gcs_location,
+        )
+
+    if not file_pattern:
+        raise ValueError(f"A file pattern must be supplied for {source_format} data.")
+
+    if source_format == AVRO_SOURCE:
+        return pipeline | "Read From Avro" >> beam.io.ReadFromAvro(file_pattern)
+    if source_format == PARQUET_SOURCE:
+        return pipeline | "Read From Parquet" >> beam.io.ReadFromParquet(file_pattern)
+    if source_format == JSONL_SOURCE:
+        return (
+            pipeline
+            | "Read From JSONL" >> beam.io.ReadFromText(file_pattern)
+            | "Parse JSONL" >> beam.Map(parse_json_line)
+        )
+
+    column_types = get_column_types()
+    return (
+        pipeline
+        | "Read From CSV" >> beam.io.ReadFromText(file_pattern, skip_header_lines=1)
+        | "Parse CSV"
+        >> beam.Map(
+            parse_csv_line, column_names or list(column_types.keys()), column_types
+        )
+    )
+
+
+@beam.ptransform_fn
+def WriteRawData(rows, source_format, output_prefix, column_names):
+    """Writes raw rows as a snapshot readable by ReadRawData."""
+    column_types = get_column_types()
+    file_name_suffix = FILE_SUFFIXES[source_format]
+
+    if source_format == AVRO_SOURCE:
+        return rows | "Write Avro" >> beam.io.WriteToAvro(
+            output_prefix,
+            schema=get_avro_schema(column_names, column_types),
+            file_name_suffix=file_name_suffix,
+            use_fastavro=True,
+        )
+    if source_format == PARQUET_SOURCE:
+        return rows | "Write Parquet" >> beam.io.WriteToParquet(
+            output_prefix,
+            schema=get_parquet_schema(column_names, column_types),
+            file_name_suffix=file_name_suffix,
+        )
+    if source_format == JSONL_SOURCE:
+        return (
+            rows
+            | "Format JSONL" >> beam.Map(json.dumps)
+            | "Write JSONL"
+            >> beam.io.WriteToText(output_prefix, file_name_suffix=file_name_suffix)
+        )
+    return (
+        rows
+        | "Format CSV" >> beam.Map(format_csv_line, column_names)
+        | "Write CSV"
+        >> beam.io.WriteToText(
+            output_prefix,
+            file_name_suffix=file_name_suffix,
+            header=",".join(column_names),
+        )
+    )
+
+
+def run_snapshot_pipeline(args):
+    """Materializes a BigQuery query once as a file snapshot."""
+
+    pipeline_options = beam.pipeline.PipelineOptions(flags=[], **args)
+
+    query = args["query"]
+    output_prefix = args["output_prefix"]
+    source_format = validate_source_format(args["source_format"])
+    if source_format not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Snapshot format must be one of {SNAPSHOT_FORMATS}.")
+    column_names = args.get("column_names") or list(get_column_types().keys())
+
+    with beam.Pipeline(options=pipeline_options) as pipeline:
+        _ = (
+            pipeline
+            | "Read Raw Data"
+            >> ReadRawData(
+                BIGQUERY_SOURCE,
+                query=query,
+                project=args["project"],
+                gcs_location=args["gcs_location"],
+            )
+            | "Select Columns"
+            >> beam.Map(select_columns, column_names)
+            | "Write Snapshot"
+            >> WriteRawData(source_format, output_prefix, column_names)
+        )
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--query", type=str)
+    parser.add_argument("--project", type=str)
+    parser.add_argument("--gcs-location", type=str)
+    parser.add_argument("--output-prefix", type=str)
+    parser.add_argument("--source-format", default=AVRO_SOURCE, type=str)
+    parser.add_argument(
+        "--column-names",
+        type=str,
+        help="Comma separated columns to keep. Defaults to the raw schema columns.",
+    )
+    parser.add_argument("--runner", default="DirectRunner", type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    if not args.query:
+        raise ValueError("query must be supplied.")
+    if not args.output_prefix:
+        raise ValueError("output-prefix must be supplied.")
+
+    pipeline_args = {
+        "runner": args.runner,
+        "query": args.query,
+        "project": args.project,
+        "gcs_location": args.gcs_location,
+        "output_prefix": args.output_prefix,
+        "source_format": args.source_format,
+        "column_names": args.column_names.split(",") if args.column_names else None,
+    }
+    logging.info(f"Snapshot pipeline args: {pipeline_args}")
+    run_snapshot_pipeline(pipeline_args)
+    logging.info("Snapshot completed.")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
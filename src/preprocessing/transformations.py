@@ -34,9 +34,12 @@ def preprocessing_fn(inputs):
             outputs[features.transformed_name(key)] = tft.scale_to_z_score(inputs[key])
 
         elif key in features.categorical_feature_names():
+            vocabulary_config = features.vocabulary_config(key)
             outputs[features.transformed_name(key)] = tft.compute_and_apply_vocabulary(
                 inputs[key],
-                num_oov_buckets=1,
+                top_k=vocabulary_config["top_k"],
+                frequency_threshold=vocabulary_config["frequency_threshold"],
+                num_oov_buckets=vocabulary_config["num_oov_buckets"],
                 vocab_filename=key,
             )
 
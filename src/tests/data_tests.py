@@ -0,0 +1,133 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test the training input pipeline."""
+
+import sys
+import os
+import logging
+import numpy as np
+import tensorflow as tf
+
+from src.common import features, data_manifest
+from src.model_training import data
+from src.tests import fixtures
+
+root = logging.getLogger()
+root.setLevel(logging.INFO)
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+root.addHandler(handler)
+
+BATCH_SIZE = 8
+NUM_FILES = 2
+EXAMPLES_PER_FILE = 32
+NUM_EXAMPLES = NUM_FILES * EXAMPLES_PER_FILE
+
+FEATURE_SPEC = fixtures.transformed_feature_spec()
+
+
+def _write_tfrecords(data_dir, compression_type="GZIP"):
+    fixtures.write_tfrecords(data_dir, NUM_FILES, EXAMPLES_PER_FILE, compression_type)
+
+
+def _read_indices(dataset):
+    indices = []
+    for input_features, target in dataset:
+        assert features.TARGET_FEATURE_NAME not in input_features
+        assert target.shape == (BATCH_SIZE,)
+        batch_indices = fixtures.read_indices(input_features)
+        # Even examples are labeled 1, so each example is read with its label.
+        np.testing.assert_array_equal(
+            target.numpy(), np.array(batch_indices) % 2 == 0
+        )
+        indices.extend(batch_indices)
+    return sorted(indices)
+
+
+def test_get_dataset(tmp_path):
+    _write_tfrecords(str(tmp_path))
+
+    dataset = data.get_dataset(
+        os.path.join(str(tmp_path), "data-*.gz"),
+        FEATURE_SPEC,
+        batch_size=BATCH_SIZE,
+        num_epochs=2,
+        shuffle=False,
+        cache=data.MEMORY_CACHE,
+    )
+
+    # Every example is read once per epoch, with its own label.
+    assert _read_indices(dataset) == sorted(list(range(NUM_EXAMPLES)) * 2)
+
+
+def test_get_dataset_reads_manifest_codec(tmp_path):
+    for compression_type in data_manifest.COMPRESSION_TYPES:
+        data_dir = os.path.join(str(tmp_path), compression_type)
+        _write_tfrecords(data_dir, compression_type)
+
+        # The codec is not given: it is read from the manifest.
+        dataset = data.get_dataset(
+            os.path.join(data_dir, "data-*"), FEATURE_SPEC, batch_size=BATCH_SIZE
+        )
+        assert _read_indices(dataset) == list(range(NUM_EXAMPLES))
+
+
+def test_get_dataset_parquet(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    data_manifest.write_manifest(
+        str(tmp_path), "SNAPPY", NUM_FILES, data_manifest.PARQUET_FORMAT
+    )
+    for shard in range(NUM_FILES):
+        columns = fixtures.transformed_columns(
+            np.arange(shard * EXAMPLES_PER_FILE, (shard + 1) * EXAMPLES_PER_FILE)
+        )
+        pq.write_table(
+            pa.Table.from_pydict(columns),
+            os.path.join(str(tmp_path), f"data-{shard:05d}.parquet"),
+        )
+
+    dataset = data.get_dataset(
+        os.path.join(str(tmp_path), "data-*"), FEATURE_SPEC, batch_size=BATCH_SIZE
+    )
+
+    for input_features, _ in dataset.take(1):
+        assert set(input_features.keys()) == set(FEATURE_SPEC.keys()) - {
+            features.TARGET_FEATURE_NAME
+        }
+    assert _read_indices(dataset) == list(range(NUM_EXAMPLES))
+
+
+def test_get_dataset_list_pattern(tmp_path):
+    # The TFX Trainer passes lists of file patterns.
+    data_dir = os.path.join(str(tmp_path), "train")
+    _write_tfrecords(str(tmp_path), "ZLIB")
+    os.makedirs(data_dir)
+    for file_name in tf.io.gfile.listdir(str(tmp_path)):
+        if file_name.startswith("data-"):
+            os.rename(
+                os.path.join(str(tmp_path), file_name),
+                os.path.join(data_dir, file_name),
+            )
+
+    assert data_manifest.read_manifest([os.path.join(data_dir, "*")]) == (
+        data_manifest.load_manifest(str(tmp_path))
+    )
+    assert data_manifest.read_manifest([]) is None
+
+    dataset = data.get_dataset(
+        [os.path.join(data_dir, "*")], FEATURE_SPEC, batch_size=BATCH_SIZE
+    )
+    assert _read_indices(dataset) == list(range(NUM_EXAMPLES))
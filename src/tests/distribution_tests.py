@@ -0,0 +1,245 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test distributed training strategies and input sharding."""
+
+import sys
+import os
+import json
+import logging
+import socket
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+from src.model_training import data, defaults, distribution, model, trainer
+from src.tests import fixtures
+
+root = logging.getLogger()
+root.setLevel(logging.INFO)
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+root.addHandler(handler)
+
+NUM_FILES = 4
+EXAMPLES_PER_FILE = 64
+BATCH_SIZE = 8
+NUM_EPOCHS = 5
+PROCESS_TIMEOUT_SECONDS = 600
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TWO_WORKERS_TF_CONFIG = {
+    "cluster": {"worker": ["localhost:2222", "localhost:2223"]},
+    "task": {"type": "worker", "index": 1},
+}
+PARAMETER_SERVER_TF_CONFIG = {
+    "cluster": {
+        "chief": ["localhost:2222"],
+        "worker": ["localhost:2223"],
+        "ps": ["localhost:2224"],
+    },
+    "task": {"type": "chief", "index": 0},
+}
+
+
+def _write_tfrecords(data_dir, num_files=NUM_FILES):
+    return fixtures.write_tfrecords(
+        data_dir, num_files, EXAMPLES_PER_FILE, compression_type="NONE"
+    )
+
+
+def _read_shards(file_pattern, num_input_pipelines):
+    """Returns the example indices read by each input pipeline."""
+    shards = []
+    for input_pipeline_id in range(num_input_pipelines):
+        input_context = tf.distribute.InputContext(
+            num_input_pipelines=num_input_pipelines,
+            input_pipeline_id=input_pipeline_id,
+            num_replicas_in_sync=num_input_pipelines,
+        )
+        dataset = data.get_dataset(
+            file_pattern,
+            fixtures.transformed_feature_spec(),
+            batch_size=BATCH_SIZE * num_input_pipelines,
+            shuffle=False,
+            compression_type="NONE",
+            input_context=input_context,
+        )
+        indices = []
+        for input_features, target in dataset:
+            # Each pipeline batches with the per-replica batch size.
+            assert target.shape[0] == BATCH_SIZE
+            indices.extend(fixtures.read_indices(input_features))
+        shards.append(set(indices))
+    return shards
+
+
+def test_resolve_strategy_name():
+    assert (
+        distribution.resolve_strategy_name("auto", TWO_WORKERS_TF_CONFIG)
+        == distribution.MULTI_WORKER_MIRRORED_STRATEGY
+    )
+    assert (
+        distribution.resolve_strategy_name("auto", PARAMETER_SERVER_TF_CONFIG)
+        == distribution.PARAMETER_SERVER_STRATEGY
+    )
+    assert (
+        distribution.resolve_strategy_name("mirrored", TWO_WORKERS_TF_CONFIG)
+        == distribution.MIRRORED_STRATEGY
+    )
+    assert not distribution.is_chief(TWO_WORKERS_TF_CONFIG)
+    assert distribution.is_chief(PARAMETER_SERVER_TF_CONFIG)
+
+
+def test_get_dataset_input_context_shards_files(tmp_path):
+    file_pattern = _write_tfrecords(os.path.join(str(tmp_path), "data"))
+
+    # The TFX Trainer passes lists of file patterns.
+    for pattern in [file_pattern, [file_pattern]]:
+        shards = _read_shards(pattern, num_input_pipelines=2)
+        assert not shards[0] & shards[1]
+        assert shards[0] | shards[1] == set(range(NUM_FILES * EXAMPLES_PER_FILE))
+
+
+def test_get_dataset_input_context_shards_batches(tmp_path):
+    # With fewer files than input pipelines, the batches are sharded instead.
+    file_pattern = _write_tfrecords(os.path.join(str(tmp_path), "data"), num_files=1)
+
+    shards = _read_shards(file_pattern, num_input_pipelines=2)
+    assert not shards[0] & shards[1]
+    assert shards[0] | shards[1] == set(range(EXAMPLES_PER_FILE))
+
+
+def _train(file_pattern, strategy_name, num_cpu_replicas, output_file):
+    """Trains in its own process, and writes the replicas, losses, and weights."""
+    tf.random.set_seed(0)
+    strategy = distribution.get_strategy(strategy_name, num_cpu_replicas)
+    hyperparams = defaults.update_hyperparams(
+        {"hidden_units": [8], "learning_rate": 0.01}
+    )
+    dataset = trainer._get_distributed_dataset(
+        strategy,
+        file_pattern,
+        fixtures.transformed_feature_spec(),
+        BATCH_SIZE,
+        shuffle=False,
+        compression_type="NONE",
+    )
+    with strategy.scope():
+        classifier = model._create_binary_classifier(
+            fixtures.feature_vocab_sizes(), hyperparams
+        )
+        trainer._compile(classifier, hyperparams)
+    history = classifier.fit(dataset, epochs=NUM_EPOCHS, verbose=0)
+
+    with open(output_file, "w") as f:
+        json.dump(
+            {
+                "num_replicas": strategy.num_replicas_in_sync,
+                "losses": history.history["loss"],
+                "accuracy": history.history["accuracy"][-1],
+                "weights": [
+                    weights.tolist() for weights in classifier.get_weights()
+                ],
+            },
+            f,
+        )
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def _run_training_processes(
+    output_dir, file_pattern, strategy_name, tf_configs, num_cpu_replicas=1
+):
+    """Runs _train in one process per TF_CONFIG, and returns their results.
+
+    Each process is started as Vertex AI starts the replicas of a worker pool,
+    with its TF_CONFIG in the environment.
+    """
+    processes = []
+    output_files = []
+    for index, tf_config in enumerate(tf_configs):
+        output_files.append(os.path.join(output_dir, f"worker-{index}.json"))
+        env = dict(os.environ)
+        env.pop("TF_CONFIG", None)
+        if tf_config:
+            env["TF_CONFIG"] = json.dumps(tf_config)
+        code = (
+            "from src.tests import distribution_tests; "
+            f"distribution_tests._train({file_pattern!r}, {strategy_name!r}, "
+            f"{num_cpu_replicas}, {output_files[-1]!r})"
+        )
+        processes.append(
+            subprocess.Popen([sys.executable, "-c", code], cwd=ROOT_DIR, env=env)
+        )
+
+    try:
+        for index, process in enumerate(processes):
+            assert (
+                process.wait(timeout=PROCESS_TIMEOUT_SECONDS) == 0
+            ), f"Worker {index} failed."
+    finally:
+        for process in processes:
+            process.kill()
+
+    results = []
+    for output_file in output_files:
+        with open(output_file) as f:
+            results.append(json.load(f))
+    return results
+
+
+def test_multi_worker_mirrored_strategy_training(tmp_path):
+    file_pattern = _write_tfrecords(os.path.join(str(tmp_path), "data"))
+    workers = [f"localhost:{_free_port()}" for _ in range(2)]
+    tf_configs = [
+        {"cluster": {"worker": workers}, "task": {"type": "worker", "index": index}}
+        for index in range(2)
+    ]
+
+    # "auto" resolves the multi-worker mirrored strategy from TF_CONFIG.
+    results = _run_training_processes(
+        str(tmp_path), file_pattern, distribution.AUTO_STRATEGY, tf_configs
+    )
+
+    for result in results:
+        assert result["num_replicas"] == 2
+        # The label is the sign of trip_miles_xf, which the model learns.
+        assert result["losses"][-1] < result["losses"][0]
+        assert result["accuracy"] > 0.9
+    # The gradients are all-reduced, so both workers hold the same model.
+    np.testing.assert_allclose(results[0]["losses"], results[1]["losses"], rtol=1e-5)
+    for weights, other_weights in zip(results[0]["weights"], results[1]["weights"]):
+        np.testing.assert_allclose(weights, other_weights, rtol=1e-5, atol=1e-6)
+
+
+def test_mirrored_strategy_training(tmp_path):
+    file_pattern = _write_tfrecords(os.path.join(str(tmp_path), "data"))
+
+    # Without GPUs, the CPU is split into 2 devices, so there are 2 replicas.
+    (result,) = _run_training_processes(
+        str(tmp_path),
+        file_pattern,
+        distribution.MIRRORED_STRATEGY,
+        [None],
+        num_cpu_replicas=2,
+    )
+
+    num_gpus = len(tf.config.list_physical_devices("GPU"))
+    assert result["num_replicas"] == (num_gpus or 2)
+    assert result["losses"][-1] < result["losses"][0]
+    assert result["accuracy"] > 0.9
@@ -15,13 +15,18 @@
 
 import sys
 import os
+import json
 import logging
+import pytest
 import tensorflow_transform as tft
+import tensorflow_data_validation as tfdv
+from tensorflow_transform.tf_metadata import schema_utils
 import tensorflow as tf
 from tensorflow.io import FixedLenFeature
 
 from src.preprocessing import etl
-from src.comm import datasource_utils
+from src.common import data_manifest, datasource_utils
+from src.tests import fixtures
 
 root = logging.getLogger()
 root.setLevel(logging.INFO)
@@ -30,6 +35,7 @@ handler.setLevel(logging.INFO)
 root.addHandler(handler)
 
 OUTPUT_DIR = "test_etl_output_dir"
+NUM_SPLIT_ROWS = 20000
 ML_USE = "UNASSIGNED"
 LIMIT = 100
 
@@ -92,8 +98,206 @@ def test_transform_pipeline():
 
     logging.info(f"Transform pipeline args: {args}")
     etl.run_transform_pipeline(args)
-    logging.info(f"Transform pipeline finished.")
+    logging.info("Transform pipeline finished.")
 
     tft_output = tft.TFTransformOutput(transform_artifacts_dir)
     transform_feature_spec = tft_output.transformed_feature_spec()
     assert transform_feature_spec == EXPECTED_FEATURE_SPEC
+
+
+def test_transform_pipeline_local_source(tmp_path):
+
+    source_file = os.path.join(str(tmp_path), "source", "data.jsonl")
+    os.makedirs(os.path.dirname(source_file))
+    with open(source_file, "w") as f:
+        for row in fixtures.bq_rows(LIMIT):
+            f.write(json.dumps(row) + "\n")
+
+    transform_artifacts_dir = os.path.join(str(tmp_path), "transform_artifacts")
+
+    args = {
+        "runner": "DirectRunner",
+        "source_format": "jsonl",
+        "source_file_pattern": source_file,
+        "write_raw_data": False,
+        "exported_data_prefix": os.path.join(str(tmp_path), "exported_data"),
+        "transformed_data_prefix": os.path.join(str(tmp_path), "transformed_data"),
+        "transform_artifact_dir": transform_artifacts_dir,
+        "temporary_dir": os.path.join(str(tmp_path), "tmp"),
+    }
+
+    logging.info(f"Transform pipeline args: {args}")
+    etl.run_transform_pipeline(args)
+    logging.info("Transform pipeline finished.")
+
+    tft_output = tft.TFTransformOutput(transform_artifacts_dir)
+    transform_feature_spec = tft_output.transformed_feature_spec()
+    assert transform_feature_spec == EXPECTED_FEATURE_SPEC
+
+
+def test_incremental_transform_pipeline(tmp_path):
+
+    source_dir = os.path.join(str(tmp_path), "source")
+    os.makedirs(source_dir)
+
+    def write_partition(name):
+        with open(os.path.join(source_dir, name), "w") as f:
+            for row in fixtures.bq_rows(LIMIT):
+                f.write(json.dumps(row) + "\n")
+
+    transformed_data_prefix = os.path.join(str(tmp_path), "transformed_data")
+    args = {
+        "runner": "DirectRunner",
+        "source_format": "jsonl",
+        "source_file_pattern": os.path.join(source_dir, "*.jsonl"),
+        "incremental": True,
+        "write_raw_data": False,
+        "exported_data_prefix": os.path.join(str(tmp_path), "exported_data"),
+        "transformed_data_prefix": transformed_data_prefix,
+        "transform_artifact_dir": os.path.join(str(tmp_path), "transform_artifacts"),
+        "temporary_dir": os.path.join(str(tmp_path), "tmp"),
+    }
+
+    write_partition("day-1.jsonl")
+    etl.run_transform_pipeline(args)
+    manifest = data_manifest.load_manifest(transformed_data_prefix)
+    assert len(manifest["partitions"]) == 1
+
+    write_partition("day-2.jsonl")
+    etl.run_transform_pipeline(args)
+    manifest = data_manifest.load_manifest(transformed_data_prefix)
+    assert len(manifest["partitions"]) == 2
+    assert tf.io.gfile.glob(
+        os.path.join(transformed_data_prefix, "train", "data-day-2.jsonl-*")
+    )
+
+
+def test_transform_pipeline_analyzer_cache(tmp_path):
+
+    source_dir = os.path.join(str(tmp_path), "source")
+    os.makedirs(source_dir)
+    for span in range(2):
+        with open(os.path.join(source_dir, f"span-{span}.jsonl"), "w") as f:
+            for row in fixtures.bq_rows(LIMIT):
+                f.write(json.dumps(row) + "\n")
+
+    analyzer_cache_dir = os.path.join(str(tmp_path), "analyzer_cache")
+    transform_artifacts_dir = os.path.join(str(tmp_path), "transform_artifacts")
+
+    for run in range(2):
+        args = {
+            "runner": "DirectRunner",
+            "source_format": "jsonl",
+            "source_file_pattern": os.path.join(source_dir, "*.jsonl"),
+            "analyzer_cache_dir": analyzer_cache_dir,
+            "write_raw_data": False,
+            "exported_data_prefix": os.path.join(str(tmp_path), "exported_data"),
+            "transformed_data_prefix": os.path.join(
+                str(tmp_path), f"transformed_data_{run}"
+            ),
+            "transform_artifact_dir": os.path.join(transform_artifacts_dir, str(run)),
+            "temporary_dir": os.path.join(str(tmp_path), "tmp"),
+        }
+        etl.run_transform_pipeline(args)
+
+    cache_dir = etl.get_analyzer_cache_dir(analyzer_cache_dir)
+    assert len(tf.io.gfile.listdir(cache_dir)) == 2
+
+    feature_specs = [
+        tft.TFTransformOutput(
+            os.path.join(transform_artifacts_dir, str(run))
+        ).transformed_feature_spec()
+        for run in range(2)
+    ]
+    assert feature_specs[0] == feature_specs[1] == EXPECTED_FEATURE_SPEC
+
+
+def test_hash_split_ratios():
+    # Rows as parsed by etl.parse_bq_record.
+    rows = [
+        {key: [value] for key, value in row.items()} for row in fixtures.bq_rows(NUM_SPLIT_ROWS)
+    ]
+    split_ratios = {"train": 7, "eval": 2, "test": 1}
+
+    split_indices = etl.hash_split(rows, split_ratios)
+    total = sum(split_ratios.values())
+    for i, ratio in enumerate(split_ratios.values()):
+        fraction = (split_indices == i).mean()
+        assert abs(fraction - ratio / total) < 0.02
+
+    # Assignments do not depend on how rows are batched.
+    batched_indices = [
+        index
+        for start in range(0, NUM_SPLIT_ROWS, 999)
+        for index in etl.hash_split(rows[start : start + 999], split_ratios)
+    ]
+    assert list(split_indices) == batched_indices
+
+    # Assignments are stable when the row key does not change.
+    key_indices = etl.hash_split(rows, split_ratios, key_column="loc_cross")
+    modified_rows = [dict(row, trip_miles=[0.0]) for row in rows]
+    assert list(key_indices) == list(
+        etl.hash_split(modified_rows, split_ratios, key_column="loc_cross")
+    )
+
+
+def test_write_raw_data_requires_eval_split(tmp_path):
+    args = {
+        "runner": "DirectRunner",
+        "source_format": "jsonl",
+        "source_file_pattern": os.path.join(str(tmp_path), "*.jsonl"),
+        "split_ratios": {"train": 8, "test": 2},
+        "write_raw_data": True,
+        "exported_data_prefix": os.path.join(str(tmp_path), "exported_data"),
+        "transformed_data_prefix": os.path.join(str(tmp_path), "transformed_data"),
+        "transform_artifact_dir": os.path.join(str(tmp_path), "transform_artifacts"),
+        "temporary_dir": os.path.join(str(tmp_path), "tmp"),
+    }
+    with pytest.raises(ValueError, match="eval split"):
+        etl.run_transform_pipeline(args)
+
+
+def test_batched_parse_and_convert():
+    bq_rows = fixtures.bq_rows(10)
+    raw_schema = tfdv.load_schema_text(etl.RAW_SCHEMA_LOCATION)
+    raw_feature_spec = schema_utils.schema_as_feature_spec(raw_schema).feature_spec
+    arrow_schema = etl.get_raw_arrow_schema(raw_feature_spec)
+
+    record_batch = etl.parse_bq_records(bq_rows, arrow_schema)
+    assert record_batch.num_rows == len(bq_rows)
+    instances = etl.record_batch_to_instances(record_batch)
+    assert instances[0]["trip_day"] == [bq_rows[0]["trip_day"]]
+
+    jsonl_block = etl.convert_to_jsonl_block(bq_rows)
+    assert jsonl_block.split("\n") == [etl.convert_to_jsonl(row) for row in bq_rows]
+
+
+def test_fused_prediction_pipeline(tmp_path):
+    saved_model_dirs = fixtures.export_serving_models(
+        os.path.join(str(tmp_path), "model"), include_tf_example_signature=False
+    )
+    source_file = os.path.join(str(tmp_path), "serving-data.jsonl")
+    with open(source_file, "w") as f:
+        for row in fixtures.bq_rows(LIMIT):
+            f.write(etl.convert_to_jsonl(row) + "\n")
+    prediction_results_prefix = os.path.join(str(tmp_path), "prediction.results")
+
+    args = {
+        "runner": "DirectRunner",
+        "source_format": "jsonl",
+        "source_file_pattern": source_file,
+        "model_dir": saved_model_dirs["keras"],
+        "prediction_results_prefix": prediction_results_prefix,
+        "min_batch_size": 8,
+    }
+    etl.run_fused_prediction_pipeline(args)
+
+    prediction_results = []
+    for file_path in tf.io.gfile.glob(prediction_results_prefix + "-*"):
+        with open(file_path) as f:
+            prediction_results.extend(json.loads(line) for line in f)
+    assert len(prediction_results) == LIMIT
+    for prediction_result in prediction_results:
+        properties = etl.get_prediction_properties(prediction_result)
+        assert len(properties["classes"]) == 2
+        assert abs(sum(properties["scores"]) - 1) < 1e-5
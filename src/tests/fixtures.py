@@ -0,0 +1,194 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Small inline data and models shared by the tests."""
+
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_transform as tft
+
+from src.common import data_manifest, features
+from src.model_training import defaults, exporter, model
+from src.preprocessing import etl
+
+VOCAB_SIZE = 10
+# Holds the index of each example, to check which examples are read. It is
+# scaled down so that training on it stays stable.
+INDEX_FEATURE_NAME = features.transformed_name("trip_seconds")
+INDEX_SCALE = 1000
+
+
+def transformed_feature_spec():
+    feature_spec = {
+        features.transformed_name(feature_name): tf.io.FixedLenFeature(
+            shape=[],
+            dtype=tf.float32
+            if feature_name in features.NUMERICAL_FEATURE_NAMES
+            else tf.int64,
+        )
+        for feature_name in features.FEATURE_NAMES
+    }
+    feature_spec[features.TARGET_FEATURE_NAME] = tf.io.FixedLenFeature(
+        shape=[], dtype=tf.int64
+    )
+    return feature_spec
+
+
+def feature_vocab_sizes():
+    return {
+        feature_name: VOCAB_SIZE
+        for feature_name in features.categorical_feature_names()
+    }
+
+
+def transformed_columns(indices):
+    """Returns transformed columns whose label is whether trip_miles_xf is positive."""
+    columns = {}
+    for name, spec in transformed_feature_spec().items():
+        if spec.dtype == tf.float32:
+            columns[name] = np.zeros(len(indices), np.float32)
+        else:
+            columns[name] = indices % VOCAB_SIZE
+    columns[INDEX_FEATURE_NAME] = (indices / INDEX_SCALE).astype(np.float32)
+    trip_miles = np.where(indices % 2 == 0, 1.0, -1.0).astype(np.float32)
+    columns[features.transformed_name("trip_miles")] = trip_miles
+    columns[features.TARGET_FEATURE_NAME] = (trip_miles > 0).astype(np.int64)
+    return columns
+
+
+def get_dataset(num_examples, batch_size=32):
+    """Returns an in-memory dataset of transformed_columns and their labels."""
+    columns = transformed_columns(np.arange(num_examples))
+    label = columns.pop(features.TARGET_FEATURE_NAME)
+    return tf.data.Dataset.from_tensor_slices((columns, label)).batch(batch_size)
+
+
+def read_indices(input_features):
+    """Returns the example indices of a batch of transformed_columns features."""
+    return (
+        np.rint(input_features[INDEX_FEATURE_NAME].numpy() * INDEX_SCALE)
+        .astype(np.int64)
+        .tolist()
+    )
+
+
+def serialize_example(columns, index):
+    feature = {}
+    for name, values in columns.items():
+        if values.dtype == np.float32:
+            feature[name] = tf.train.Feature(
+                float_list=tf.train.FloatList(value=[values[index]])
+            )
+        else:
+            feature[name] = tf.train.Feature(
+                int64_list=tf.train.Int64List(value=[values[index]])
+            )
+    example = tf.train.Example(features=tf.train.Features(feature=feature))
+    return example.SerializeToString()
+
+
+def write_tfrecords(data_dir, num_files, examples_per_file, compression_type="GZIP"):
+    """Writes transformed_columns files and their manifest.
+
+    Returns:
+      The file pattern of the files.
+    """
+    data_manifest.write_manifest(data_dir, compression_type, num_files)
+    options = tf.io.TFRecordOptions(
+        compression_type=data_manifest.COMPRESSION_TYPES[compression_type]
+    )
+    suffix = data_manifest.FILE_SUFFIXES[compression_type]
+    for shard in range(num_files):
+        columns = transformed_columns(
+            np.arange(shard * examples_per_file, (shard + 1) * examples_per_file)
+        )
+        file_path = os.path.join(
+            data_dir, f"data-{shard:05d}-of-{num_files:05d}{suffix}"
+        )
+        with tf.io.TFRecordWriter(file_path, options) as writer:
+            for index in range(examples_per_file):
+                writer.write(serialize_example(columns, index))
+    return os.path.join(data_dir, "data-*")
+
+
+def bq_rows(num_rows):
+    """Returns raw rows as read from BigQuery by the training and serving queries."""
+    rows = []
+    for index in range(num_rows):
+        pickup_grid = f"POINT(-87.{index % 7} 41.{index % 5})"
+        dropoff_grid = f"POINT(-87.{index % 3} 41.{index % 11})"
+        rows.append(
+            {
+                "trip_month": index % 12 + 1,
+                "trip_day": index % 31 + 1,
+                "trip_day_of_week": index % 7 + 1,
+                "trip_hour": index % 24,
+                "trip_seconds": 60 + index * 7 % 3600,
+                "trip_miles": 0.5 + index % 30,
+                "payment_type": ["Cash", "Credit Card"][index % 2],
+                "pickup_grid": pickup_grid,
+                "dropoff_grid": dropoff_grid,
+                "euclidean": 100.0 + index * 13 % 30000,
+                "loc_cross": f"{pickup_grid}{dropoff_grid}",
+                features.TARGET_FEATURE_NAME: index % 3 % 2,
+            }
+        )
+    return rows
+
+
+def export_serving_models(output_dir, include_tf_example_signature=True):
+    """Exports an untrained classifier with and without optimize.
+
+    The transform artifacts are analyzed from bq_rows.
+
+    Returns:
+      The SavedModel directory of each export, keyed by "keras" and "optimized".
+    """
+    source_file = os.path.join(output_dir, "data.jsonl")
+    os.makedirs(output_dir, exist_ok=True)
+    with open(source_file, "w") as f:
+        for row in bq_rows(200):
+            f.write(json.dumps(row) + "\n")
+    transform_artifact_dir = os.path.join(output_dir, "transform_artifacts")
+    etl.run_transform_pipeline(
+        {
+            "runner": "DirectRunner",
+            "source_format": "jsonl",
+            "source_file_pattern": source_file,
+            "write_raw_data": False,
+            "exported_data_prefix": os.path.join(output_dir, "exported_data"),
+            "transformed_data_prefix": os.path.join(output_dir, "transformed_data"),
+            "transform_artifact_dir": transform_artifact_dir,
+            "temporary_dir": os.path.join(output_dir, "tmp"),
+        }
+    )
+
+    tft_output = tft.TFTransformOutput(transform_artifact_dir)
+    classifier = model.create_binary_classifier(
+        tft_output, defaults.update_hyperparams({})
+    )
+    saved_model_dirs = {}
+    for export_mode, optimize in [("keras", False), ("optimized", True)]:
+        saved_model_dirs[export_mode] = os.path.join(output_dir, export_mode)
+        exporter.export_serving_model(
+            classifier,
+            saved_model_dirs[export_mode],
+            etl.RAW_SCHEMA_LOCATION,
+            transform_artifact_dir,
+            optimize=optimize,
+            include_tf_example_signature=include_tf_example_signature,
+        )
+    return saved_model_dirs
@@ -15,6 +15,7 @@
 
 import os
 import logging
+import pytest
 import tensorflow as tf
 
 test_instance = {
@@ -35,6 +36,8 @@ SERVING_DEFAULT_SIGNATURE_NAME = "serving_default"
 
 from google.cloud import aiplatform as vertex_ai
 
+from build import utils as build_utils
+
 
 def test_model_artifact():
 
@@ -149,3 +152,42 @@ def test_model_endpoint():
     ), f"Invalid number output scores: {len(prediction['scores'])}!"
 
     logging.info(f"Prediction output: {prediction}")
+
+
+def _report(machine_type, requests_per_second, p99_latency_ms, error_rate=0):
+    return {
+        "machine_type": machine_type,
+        "batch_size": 1,
+        "requests_per_second": requests_per_second,
+        "p99_latency_ms": p99_latency_ms,
+        "error_rate": error_rate,
+    }
+
+
+def test_recommend_serving_resources():
+    reports = [
+        _report("n1-standard-2", 100, 50),
+        _report("n1-standard-2", 150, 200),
+        _report("n1-standard-4", 250, 60),
+        _report("n1-standard-4", 300, 90, error_rate=0.05),
+    ]
+    spec = build_utils.recommend_serving_resources(
+        reports, target_qps=300, p99_slo_ms=100, base_spec={"traffic_percentage": 100}
+    )
+    # 2 n1-standard-4 replicas at 60% of 250 QPS cost less than 5 n1-standard-2.
+    assert spec["machine_type"] == "n1-standard-4"
+    assert spec["min_replica_count"] == 2
+    assert spec["max_replica_count"] == 3
+    assert spec["traffic_percentage"] == 100
+    assert spec["sizing"]["replica_capacity_qps"] == 250
+
+
+def test_recommend_serving_resources_requires_machine_type():
+    unlabeled_report = _report("n1-standard-4", 250, 60)
+    del unlabeled_report["machine_type"]
+    with pytest.raises(ValueError, match="machine_type"):
+        build_utils.recommend_serving_resources(
+            [_report("n1-standard-2", 100, 50), unlabeled_report],
+            target_qps=300,
+            p99_slo_ms=100,
+        )
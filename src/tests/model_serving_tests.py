@@ -0,0 +1,168 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test the local prediction server, its request batching, and batch scoring."""
+
+import json
+import os
+import threading
+import time
+import urllib.request
+from concurrent import futures
+
+import pytest
+
+from src.model_serving import batch_scoring, batching, server
+
+
+def _double_fn(batch_sizes):
+    def predict_fn(instances):
+        batch_sizes.append(len(instances))
+        time.sleep(0.01)
+        return [{"value": instance["x"][0] * 2} for instance in instances]
+
+    return predict_fn
+
+
+def test_batcher_coalesces_requests():
+    batch_sizes = []
+    batcher = batching.DynamicBatcher(
+        _double_fn(batch_sizes), max_batch_size=8, max_wait_seconds=0.05
+    ).start()
+    try:
+        with futures.ThreadPoolExecutor(32) as executor:
+            results = list(
+                executor.map(lambda x: batcher.predict([{"x": [x]}]), range(64))
+            )
+    finally:
+        batcher.stop()
+
+    assert results == [[{"value": x * 2}] for x in range(64)]
+    assert max(batch_sizes) <= 8
+    assert len(batch_sizes) < 64
+    assert batcher.batch_size_histogram.count == len(batch_sizes)
+    assert batcher.latency_histogram.count == 64
+
+
+def test_batcher_does_not_split_requests():
+    batch_sizes = []
+    batcher = batching.DynamicBatcher(
+        _double_fn(batch_sizes), max_batch_size=4, max_wait_seconds=0.01
+    ).start()
+    try:
+        predictions = batcher.predict([{"x": [x]} for x in range(10)])
+    finally:
+        batcher.stop()
+    assert len(predictions) == 10
+    assert batch_sizes == [10]
+
+
+def test_batcher_fails_only_the_failing_request():
+    batch_sizes = []
+    batcher = batching.DynamicBatcher(
+        _double_fn(batch_sizes), max_batch_size=2, max_wait_seconds=1
+    ).start()
+    try:
+        with futures.ThreadPoolExecutor(2) as executor:
+            bad_future = executor.submit(batcher.predict, [{"y": [1]}])
+            good_future = executor.submit(batcher.predict, [{"x": [1]}])
+            assert good_future.result() == [{"value": 2}]
+            with pytest.raises(KeyError):
+                bad_future.result()
+    finally:
+        batcher.stop()
+    # The batch of both requests, then each request on its own.
+    assert batch_sizes == [2, 1, 1]
+    assert batcher.batch_size_histogram.count == 1
+    assert batcher.latency_histogram.count == 2
+
+
+def test_batcher_batches_queued_requests_past_the_deadline():
+    batch_sizes = []
+    batcher = batching.DynamicBatcher(
+        _double_fn(batch_sizes), max_batch_size=8, max_wait_seconds=0.0001
+    ).start()
+    try:
+        # Requests queue up while the first batches run, so each waits longer
+        # than max_wait_seconds before its batch starts.
+        with futures.ThreadPoolExecutor(32) as executor:
+            results = list(
+                executor.map(lambda x: batcher.predict([{"x": [x]}]), range(64))
+            )
+    finally:
+        batcher.stop()
+
+    assert results == [[{"value": x * 2}] for x in range(64)]
+    # Batches hold several requests, instead of one request each.
+    assert len(batch_sizes) < 32
+    assert max(batch_sizes) <= 8
+
+
+def _start_server(predict_fn):
+    batcher = batching.DynamicBatcher(predict_fn, max_wait_seconds=0.001).start()
+    prediction_server = server.PredictionServer(batcher, port=0, host="localhost")
+    thread = threading.Thread(target=prediction_server.serve_forever, daemon=True)
+    thread.start()
+    return prediction_server, f"http://localhost:{prediction_server.server_address[1]}"
+
+
+def test_server_predicts_and_exports_metrics():
+    prediction_server, url = _start_server(_double_fn([]))
+    try:
+        request = urllib.request.Request(
+            url + server.PREDICT_ROUTE,
+            data=json.dumps({"instances": [{"x": [1]}, {"x": [2]}]}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            assert json.load(response) == {"predictions": [{"value": 2}, {"value": 4}]}
+
+        with urllib.request.urlopen(url + server.METRICS_ROUTE) as response:
+            metrics = response.read().decode()
+        assert 'batch_size_bucket{le="2"} 1' in metrics
+        assert "request_latency_seconds_count 1" in metrics
+    finally:
+        prediction_server.shutdown()
+        prediction_server.batcher.stop()
+
+
+def test_batch_scoring_resumes(tmp_path, monkeypatch):
+    batch_sizes = []
+    monkeypatch.setattr(
+        server, "load_predict_fn", lambda model_dir: _double_fn(batch_sizes)
+    )
+    for shard_index in range(3):
+        with open(tmp_path / f"serving-data-{shard_index}.jsonl", "w") as f:
+            f.write("".join(json.dumps({"x": [x]}) + "\n" for x in range(5)))
+    input_pattern = str(tmp_path / "serving-data-*.jsonl")
+    output_dir = str(tmp_path / "predictions")
+
+    predictions_dir = batch_scoring.run_batch_scoring(
+        "model", input_pattern, output_dir, num_workers=1, batch_size=2
+    )
+    assert sorted(os.listdir(output_dir)) == [batch_scoring.PREDICTIONS_DIR]
+    assert sorted(os.listdir(predictions_dir)) == [
+        batch_scoring.results_file_name(shard_index, 3) for shard_index in range(3)
+    ]
+    assert batch_sizes == [2, 2, 1] * 3
+    with open(os.path.join(predictions_dir, batch_scoring.results_file_name(1, 3))) as f:
+        results = [json.loads(line) for line in f]
+    assert results[4] == {"instance": {"x": [4]}, "prediction": {"value": 8}}
+
+    # Only the shard without results is scored again.
+    os.remove(os.path.join(predictions_dir, batch_scoring.results_file_name(2, 3)))
+    batch_scoring.run_batch_scoring(
+        "model", input_pattern, output_dir, num_workers=1, batch_size=8
+    )
+    assert batch_sizes[9:] == [5]
+    assert len(os.listdir(predictions_dir)) == 3
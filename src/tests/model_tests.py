@@ -14,11 +14,23 @@
 """Test model functions."""
 
 import sys
+import os
 import logging
+import numpy as np
 import tensorflow as tf
 
 from src.common import features
-from src.model_training import model, defaults
+from src.model_training import (
+    model,
+    defaults,
+    warmstart,
+    trainer,
+    checkpointing,
+    sweep,
+    evaluation_metrics,
+    embeddings,
+)
+from src.tests import fixtures
 
 root = logging.getLogger()
 root.setLevel(logging.INFO)
@@ -31,6 +43,20 @@ EXPECTED_HYPERPARAMS_KEYS = [
     "learning_rate",
     "batch_size",
     "num_epochs",
+    "shuffle_buffer_size",
+    "num_parallel_reads",
+    "num_parallel_calls",
+    "prefetch_buffer_size",
+    "eval_cache",
+    "distribution_strategy",
+    "num_cpu_replicas",
+    "steps_per_epoch",
+    "jit_compile",
+    "mixed_precision",
+    "steps_per_execution",
+    "checkpoint_interval",
+    "scheduler_min_epochs",
+    "scheduler_reduction_factor",
 ]
 
 
@@ -66,3 +92,379 @@ def test_create_binary_classifier():
     model_outputs = classifier(model_inputs)  # .numpy()
     assert model_outputs.shape == (3, 1)
     assert model_outputs.dtype == "float32"
+
+
+def test_embedding_sizes_include_oov_buckets():
+    hyperparams = defaults.update_hyperparams({"hidden_units": [64, 32]})
+    feature_vocab_sizes = {
+        feature_name: 100 for feature_name in features.categorical_feature_names()
+    }
+    classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+
+    for feature_name in features.EMBEDDING_CATEGORICAL_FEATURES:
+        embedding = classifier.get_layer(
+            f"{features.transformed_name(feature_name)}_embedding"
+        )
+        assert embedding.input_dim == 100 + features.num_oov_buckets(feature_name)
+        assert embedding.output_dim == features.embedding_size(feature_name)
+
+
+def test_mixed_precision_and_steps_per_execution():
+    hyperparams = defaults.update_hyperparams(
+        {
+            "hidden_units": [8],
+            "mixed_precision": "mixed_bfloat16",
+            "steps_per_execution": 4,
+        }
+    )
+    try:
+        trainer.set_precision_policy(hyperparams)
+        classifier = model._create_binary_classifier(
+            fixtures.feature_vocab_sizes(), hyperparams
+        )
+    finally:
+        trainer.set_precision_policy(defaults.update_hyperparams({}))
+    trainer._compile(classifier, hyperparams)
+
+    # The hidden layers compute in bfloat16, the logits in float32.
+    hidden_layer = classifier.get_layer("feedforward_network").layers[0]
+    assert hidden_layer.compute_dtype == "bfloat16"
+    assert classifier.get_layer("logits").compute_dtype == "float32"
+    assert classifier.output.dtype == tf.float32
+
+    batch_ends = []
+    callback = tf.keras.callbacks.LambdaCallback(
+        on_train_batch_end=lambda batch, logs: batch_ends.append(batch)
+    )
+    classifier.fit(
+        fixtures.get_dataset(256), epochs=1, callbacks=[callback], verbose=0
+    )
+    # The 8 steps run in 2 host calls of steps_per_execution steps.
+    assert int(classifier.optimizer.iterations.numpy()) == 8
+    assert len(batch_ends) == 2
+
+
+def test_jit_compile_matches_default_training():
+    hyperparams = defaults.update_hyperparams({"hidden_units": [8]})
+    jit_hyperparams = dict(hyperparams, jit_compile=1)
+    classifier = model._create_binary_classifier(
+        fixtures.feature_vocab_sizes(), hyperparams
+    )
+    jit_classifier = model._create_binary_classifier(
+        fixtures.feature_vocab_sizes(), hyperparams
+    )
+    jit_classifier.set_weights(classifier.get_weights())
+    trainer._compile(classifier, hyperparams)
+    trainer._compile(jit_classifier, jit_hyperparams)
+
+    dataset = fixtures.get_dataset(128)
+    history = classifier.fit(dataset, epochs=2, verbose=0)
+    jit_history = jit_classifier.fit(dataset, epochs=2, verbose=0)
+
+    np.testing.assert_allclose(
+        history.history["loss"], jit_history.history["loss"], rtol=1e-4
+    )
+    for weights, jit_weights in zip(
+        classifier.get_weights(), jit_classifier.get_weights()
+    ):
+        np.testing.assert_allclose(weights, jit_weights, rtol=1e-4, atol=1e-5)
+
+
+def test_warm_start_remaps_embeddings(tmp_path):
+    hyperparams = defaults.update_hyperparams({"hidden_units": [64, 32]})
+    old_vocabularies = {
+        feature_name: [f"{feature_name}-{i}" for i in range(100)]
+        for feature_name in features.EMBEDDING_CATEGORICAL_FEATURES
+    }
+    # The vocabularies grew, and the frequency order of the tokens changed.
+    new_vocabularies = {
+        feature_name: list(reversed(vocabulary)) + [f"{feature_name}-new"]
+        for feature_name, vocabulary in old_vocabularies.items()
+    }
+
+    feature_vocab_sizes = {
+        feature_name: 100 for feature_name in features.categorical_feature_names()
+    }
+    base_classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+    base_model_dir = os.path.join(str(tmp_path), "base_model")
+    base_classifier.save(base_model_dir)
+    warmstart.write_vocabularies(base_model_dir, old_vocabularies)
+
+    feature_vocab_sizes.update(
+        {
+            feature_name: len(vocabulary)
+            for feature_name, vocabulary in new_vocabularies.items()
+        }
+    )
+    classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+    assert warmstart.warm_start(classifier, base_model_dir, new_vocabularies)
+
+    for feature_name in features.EMBEDDING_CATEGORICAL_FEATURES:
+        layer_name = f"{features.transformed_name(feature_name)}_embedding"
+        old_embeddings = base_classifier.get_layer(layer_name).get_weights()[0]
+        new_embeddings = classifier.get_layer(layer_name).get_weights()[0]
+        np.testing.assert_allclose(new_embeddings[:100], old_embeddings[99::-1])
+        np.testing.assert_allclose(new_embeddings[101:], old_embeddings[100:])
+
+    np.testing.assert_allclose(
+        classifier.get_layer("logits").get_weights()[0],
+        base_classifier.get_layer("logits").get_weights()[0],
+    )
+
+
+def test_checkpoint_resume(tmp_path):
+    hyperparams = defaults.update_hyperparams(
+        {"hidden_units": [64, 32], "checkpoint_interval": 2}
+    )
+    feature_vocab_sizes = fixtures.feature_vocab_sizes()
+    checkpoint_dir = os.path.join(str(tmp_path), "checkpoints")
+    dataset = fixtures.get_dataset(256)
+
+    classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+    trainer._compile(classifier, hyperparams)
+    checkpoint_callback = checkpointing.CheckpointCallback(
+        classifier, checkpoint_dir, hyperparams["checkpoint_interval"]
+    )
+    assert checkpoint_callback.restore() is None
+    classifier.fit(dataset, epochs=2, callbacks=[checkpoint_callback], verbose=0)
+
+    # A restarted job resumes after the last completed epoch.
+    resumed_classifier = model._create_binary_classifier(
+        feature_vocab_sizes, hyperparams
+    )
+    trainer._compile(resumed_classifier, hyperparams)
+    resumed_callback = checkpointing.CheckpointCallback(
+        resumed_classifier, checkpoint_dir, hyperparams["checkpoint_interval"]
+    )
+    assert resumed_callback.restore() == 2
+    for weights, resumed_weights in zip(
+        classifier.get_weights(), resumed_classifier.get_weights()
+    ):
+        np.testing.assert_allclose(weights, resumed_weights)
+    assert len(tf.io.gfile.glob(os.path.join(checkpoint_dir, "ckpt-*.index"))) <= (
+        checkpointing.MAX_CHECKPOINTS_TO_KEEP
+    )
+
+
+def test_hash_embedding_lookup():
+    embedding = embeddings.HashEmbedding(num_buckets=4, output_dim=3)
+    outputs = embedding(tf.constant([1, 5, 2, 9])).numpy()
+    table = embedding.embeddings.numpy()
+
+    assert table.shape == (4, 3)
+    # Indices with the same remainder share a row, the others do not.
+    np.testing.assert_array_equal(outputs, table[[1, 1, 2, 1]])
+    assert not np.allclose(outputs[0], outputs[2])
+
+
+def test_quotient_remainder_embedding_lookup():
+    embedding = embeddings.QuotientRemainderEmbedding(
+        input_dim=20, num_buckets=4, output_dim=3
+    )
+    indices = np.arange(20)
+    outputs = embedding(tf.constant(indices)).numpy()
+    quotient_table = embedding.quotient_embeddings.numpy()
+    remainder_table = embedding.remainder_embeddings.numpy()
+
+    assert quotient_table.shape == (5, 3)
+    assert remainder_table.shape == (4, 3)
+    np.testing.assert_allclose(
+        outputs, quotient_table[indices // 4] * remainder_table[indices % 4]
+    )
+    # Every index has a distinct embedding, with 9 rows instead of 20.
+    assert len(np.unique(outputs, axis=0)) == 20
+
+
+def test_mixed_dimension_embedding_lookup():
+    embedding = embeddings.MixedDimensionEmbedding(
+        input_dim=20, head_size=5, output_dim=4, tail_output_dim=2
+    )
+    indices = np.array([0, 4, 5, 19])
+    outputs = embedding(tf.constant(indices)).numpy()
+    head_table = embedding.head_embeddings.numpy()
+    tail_table = embedding.tail_embeddings.numpy()
+    projection = embedding.tail_projection.numpy()
+
+    assert head_table.shape == (5, 4)
+    assert tail_table.shape == (15, 2)
+    np.testing.assert_allclose(outputs[:2], head_table[[0, 4]])
+    np.testing.assert_allclose(
+        outputs[2:], tail_table[[0, 14]] @ projection, rtol=1e-5, atol=1e-6
+    )
+
+
+def test_classifier_uses_configured_embedding_mode(monkeypatch):
+    hyperparams = defaults.update_hyperparams({"hidden_units": [8]})
+    feature_vocab_sizes = dict(fixtures.feature_vocab_sizes(), loc_cross=1000)
+    num_oov_buckets = features.num_oov_buckets("loc_cross")
+    dense_classifier = model._create_binary_classifier(
+        feature_vocab_sizes, hyperparams
+    )
+
+    monkeypatch.setitem(
+        features.EMBEDDING_CATEGORICAL_FEATURES,
+        "loc_cross",
+        dict(
+            features.EMBEDDING_CATEGORICAL_FEATURES["loc_cross"],
+            embedding_mode=features.HASH_EMBEDDING,
+            num_buckets=50,
+        ),
+    )
+    classifier = model._create_binary_classifier(feature_vocab_sizes, hyperparams)
+
+    layer = classifier.get_layer("loc_cross_xf_embedding")
+    assert isinstance(layer, embeddings.HashEmbedding)
+    # The 1000 values and the OOV buckets share 50 rows of 10 weights.
+    assert dense_classifier.count_params() - classifier.count_params() == (
+        (1000 + num_oov_buckets - 50) * 10
+    )
+
+
+def test_sweep_trains_trials_on_shared_batches():
+    dataset = fixtures.get_dataset(256, batch_size=64)
+    trials = sweep.get_grid_trials([[16], [32, 16]], [0.01, 0.001])
+    trials_hyperparams = [
+        defaults.update_hyperparams(dict(trial, num_epochs=2)) for trial in trials
+    ]
+
+    tf.random.set_seed(0)
+    results = sweep.train_trials(
+        trials_hyperparams, fixtures.feature_vocab_sizes(), dataset, dataset
+    )
+    assert [result["trial_id"] for result in results] == list(range(len(trials)))
+    assert [result["hyperparams"] for result in results] == trials
+    for result in results:
+        assert result[defaults.HYPERTUNE_METRIC_NAME] == result["val_accuracy"]
+        assert 1 <= result["epoch"] <= 2
+
+    # Sharing the batches does not change how a trial trains.
+    tf.random.set_seed(0)
+    (first_result,) = sweep.train_trials(
+        trials_hyperparams[:1], fixtures.feature_vocab_sizes(), dataset, dataset
+    )
+    assert first_result["epoch"] == results[0]["epoch"]
+    np.testing.assert_allclose(
+        first_result["val_loss"], results[0]["val_loss"], rtol=1e-4
+    )
+
+
+def test_calibration_metrics():
+    labels = tf.constant([[0], [1], [1], [0]])
+    logits = tf.constant([[-2.0], [2.0], [0.0], [0.0]])
+
+    calibration = evaluation_metrics.Calibration()
+    calibration.update_state(labels, logits)
+    assert np.isclose(calibration.result().numpy(), 1.0)
+
+    # Only the bins of sigmoid(-2) and sigmoid(2) have a gap, of 0.119 each.
+    expected_calibration_error = evaluation_metrics.ExpectedCalibrationError()
+    expected_calibration_error.update_state(labels, logits)
+    assert np.isclose(
+        expected_calibration_error.result().numpy(),
+        2 * (1 - tf.sigmoid(2.0).numpy()) / 4,
+    )
+
+
+def test_auc_and_precision_from_logits():
+    labels = tf.constant([[0], [0], [1], [1]])
+    logits = tf.constant([[-1.0], [1.0], [0.0], [2.0]])
+
+    # 3 of the 4 (positive, negative) pairs are ranked correctly.
+    auc = evaluation_metrics.AUC(num_thresholds=1000)
+    auc.update_state(labels, logits)
+    assert np.isclose(auc.result().numpy(), 0.75, atol=1e-2)
+
+    # Only the logits 1 and 2 are above the 0.5 probability, one of them positive.
+    precision = evaluation_metrics.Precision(thresholds=0.5)
+    precision.update_state(labels, logits)
+    assert np.isclose(precision.result().numpy(), 0.5)
+    recall = evaluation_metrics.Recall(thresholds=0.5)
+    recall.update_state(labels, logits)
+    assert np.isclose(recall.result().numpy(), 0.5)
+
+
+def test_evaluate_computes_evaluation_metrics():
+    dataset = fixtures.get_dataset(256, 64)
+    hyperparams = defaults.update_hyperparams({"hidden_units": [16]})
+    classifier = model._create_binary_classifier(
+        fixtures.feature_vocab_sizes(), hyperparams
+    )
+    trainer._compile(classifier, hyperparams)
+    classifier.fit(dataset, epochs=5)
+    loss, accuracy = classifier.evaluate(dataset)
+
+    results = trainer._evaluate(classifier, dataset, hyperparams)
+    expected_names = ["loss", "accuracy"] + [
+        metric.name for metric in evaluation_metrics.get_evaluation_metrics()
+    ]
+    assert sorted(results) == sorted(set(expected_names))
+    # The evaluation metrics do not change the compiled loss and accuracy.
+    assert np.isclose(results["loss"], loss)
+    assert np.isclose(results["accuracy"], accuracy)
+    # The label is the sign of trip_miles_xf, so the classes are separable.
+    assert results["auc"] > 0.9
+
+
+def _raw_serving_inputs(rows):
+    """Returns the serving_default inputs of raw rows, as (batch, 1) tensors."""
+    inputs = {}
+    for feature_name in features.FEATURE_NAMES:
+        values = [[row[feature_name]] for row in rows]
+        # Python ints would default to int32.
+        dtype = tf.int64 if isinstance(values[0][0], int) else None
+        inputs[feature_name] = tf.constant(values, dtype=dtype)
+    return inputs
+
+
+def _serialize_raw_example(row):
+    feature = {}
+    for feature_name, value in row.items():
+        if isinstance(value, str):
+            feature[feature_name] = tf.train.Feature(
+                bytes_list=tf.train.BytesList(value=[value.encode()])
+            )
+        elif isinstance(value, float):
+            feature[feature_name] = tf.train.Feature(
+                float_list=tf.train.FloatList(value=[value])
+            )
+        else:
+            feature[feature_name] = tf.train.Feature(
+                int64_list=tf.train.Int64List(value=[value])
+            )
+    return tf.train.Example(
+        features=tf.train.Features(feature=feature)
+    ).SerializeToString()
+
+
+def test_optimized_export_matches_keras_export(tmp_path):
+    saved_model_dirs = fixtures.export_serving_models(
+        str(tmp_path), include_tf_example_signature=False
+    )
+    inputs = _raw_serving_inputs(fixtures.bq_rows(8))
+
+    scores = {}
+    for export_mode, saved_model_dir in saved_model_dirs.items():
+        signatures = tf.saved_model.load(saved_model_dir).signatures
+        assert list(signatures.keys()) == ["serving_default"]
+        scores[export_mode] = signatures["serving_default"](**inputs)["scores"].numpy()
+    assert np.allclose(scores["keras"], scores["optimized"], atol=1e-6)
+    # The optimized export cannot be warm-started from.
+    assert not os.path.isdir(
+        os.path.join(saved_model_dirs["optimized"], warmstart.VOCABULARIES_DIR)
+    )
+
+
+def test_tf_example_signature_matches_serving_default(tmp_path):
+    saved_model_dirs = fixtures.export_serving_models(str(tmp_path))
+    signatures = tf.saved_model.load(saved_model_dirs["keras"]).signatures
+    rows = fixtures.bq_rows(8)
+
+    # The examples hold the label too, which is not parsed.
+    probabilities = signatures["serving_tf_example"](
+        examples=tf.constant([_serialize_raw_example(row) for row in rows])
+    )["probabilities"].numpy()
+    scores = signatures["serving_default"](**_raw_serving_inputs(rows))[
+        "scores"
+    ].numpy()
+    assert probabilities.shape == (8, 1)
+    assert np.allclose(probabilities[:, 0], scores[:, 0], atol=1e-6)
@@ -19,9 +19,11 @@ from tfx.orchestration.local.local_dag_runner import LocalDagRunner
 import tensorflow as tf
 from ml_metadata.proto import metadata_store_pb2
 import logging
+import pytest
 
 from src.tfx_pipelines import config
 from src.tfx_pipelines import training_pipeline
+from src.tfx_pipelines import prediction_pipeline
 
 root = logging.getLogger()
 root.setLevel(logging.INFO)
@@ -86,3 +88,9 @@ def test_e2e_pipeline():
 
     logging.info(f"Model output: {os.path.join(model_registry, model_display_name)}")
     assert tf.io.gfile.exists(os.path.join(model_registry, model_display_name))
+
+
+def test_prediction_pipeline_rejects_unknown_runner(monkeypatch):
+    monkeypatch.setattr(config, "BATCH_PREDICTION_RUNNER", "dataflow")
+    with pytest.raises(ValueError, match="BATCH_PREDICTION_RUNNER"):
+        prediction_pipeline.create_pipeline(pipeline_root="pipeline_root")
@@ -0,0 +1,97 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test successive halving of hyperparameter trials."""
+
+import sys
+import os
+import logging
+
+from src.model_training import defaults, scheduler, sweep
+from src.tests import fixtures
+
+root = logging.getLogger()
+root.setLevel(logging.INFO)
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+root.addHandler(handler)
+
+
+def _metrics(accuracy):
+    return {scheduler.METRIC_NAME: accuracy, "val_loss": 1 - accuracy}
+
+
+def test_rungs():
+    assert scheduler.get_rungs(1, 3, 10) == [1, 3, 9]
+    assert scheduler.get_rungs(2, 2, 8) == [2, 4]
+
+
+def test_report_many_keeps_top_trials(tmp_path):
+    trial_scheduler = scheduler.SuccessiveHalvingScheduler(
+        str(tmp_path), max_epochs=9, reduction_factor=3
+    )
+    keep_training = trial_scheduler.report_many(
+        1, {f"trial-{i}": _metrics(i / 10) for i in range(9)}
+    )
+    assert sorted(k for k, keep in keep_training.items() if keep) == [
+        "trial-6",
+        "trial-7",
+        "trial-8",
+    ]
+    assert trial_scheduler.load_trial("trial-0")["status"] == scheduler.PRUNED
+
+
+def test_report_prunes_asynchronously(tmp_path):
+    trial_scheduler = scheduler.SuccessiveHalvingScheduler(
+        str(tmp_path), max_epochs=3, reduction_factor=3
+    )
+    # The first trial at a rung has no trial to compare with.
+    assert trial_scheduler.report("trial-a", 1, _metrics(0.6))
+    assert not trial_scheduler.report("trial-b", 1, _metrics(0.5))
+    assert trial_scheduler.report("trial-c", 1, _metrics(0.7))
+    # Epochs between rungs never prune.
+    assert trial_scheduler.report("trial-a", 2, _metrics(0.1))
+    assert not trial_scheduler.report("trial-a", 3, _metrics(0.7))
+    assert trial_scheduler.load_trial("trial-a")["status"] == scheduler.COMPLETED
+
+
+def test_sweep_prunes_and_resumes(tmp_path):
+    dataset = fixtures.get_dataset(512, batch_size=64)
+    trials = sweep.get_grid_trials([[16], [32, 16]], [0.1, 0.01, 0.001])
+    trials_hyperparams = [
+        defaults.update_hyperparams(dict(trial, num_epochs=3)) for trial in trials
+    ]
+    feature_vocab_sizes = fixtures.feature_vocab_sizes()
+    scheduler_dir = os.path.join(str(tmp_path), "scheduler")
+
+    def run():
+        trial_scheduler = scheduler.SuccessiveHalvingScheduler(
+            scheduler_dir, max_epochs=3, reduction_factor=3
+        )
+        return sweep.train_trials(
+            trials_hyperparams, feature_vocab_sizes, dataset, dataset, trial_scheduler
+        )
+
+    results = run()
+    statuses = [result["status"] for result in results]
+    # Tied trials are all promoted.
+    assert statuses.count(scheduler.COMPLETED) >= 2
+    assert statuses.count(scheduler.COMPLETED) + statuses.count(
+        scheduler.PRUNED
+    ) == len(trials)
+    for result in results:
+        if result["status"] == scheduler.PRUNED:
+            assert result["epoch"] == 1
+
+    # Nothing is trained again: the results are read from the sweep state.
+    assert run() == results
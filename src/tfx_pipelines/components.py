@@ -199,6 +199,54 @@ def vertex_batch_prediction(
     )
 
 
+def _get_latest_model(project, region, model_display_name):
+    vertex_ai.init(project=project, location=region)
+    return vertex_ai.Model.list(
+        filter=f"display_name={model_display_name}", order_by="update_time"
+    )[-1]
+
+
+@component
+def local_batch_prediction(
+    project: Parameter[str],
+    region: Parameter[str],
+    model_display_name: Parameter[str],
+    num_workers: Parameter[int],
+    batch_size: Parameter[int],
+    serving_dataset: InputArtifact[Dataset],
+    prediction_results: OutputArtifact[Dataset],
+):
+    """Scores the serving data in this step, without a Vertex AI job.
+
+    Each pipeline run writes to a new prediction_results artifact, so a run
+    never resumes from the shards of a previous one, which scored other serving
+    data. To resume an interrupted scoring run, run src.model_serving.batch_scoring
+    with the same --output-dir instead.
+    """
+    from src.model_serving import batch_scoring
+
+    model = _get_latest_model(project, region, model_display_name)
+    model_dir = model.gca_resource.artifact_uri
+    input_pattern = (
+        os.path.join(
+            artifact_utils.get_single_uri([serving_dataset]), SERVING_DATA_PREFIX
+        )
+        + "*.jsonl"
+    )
+
+    logging.info(f"Scoring the serving data locally with {model_dir}...")
+    batch_scoring.run_batch_scoring(
+        model_dir,
+        input_pattern,
+        artifact_utils.get_single_uri([prediction_results]),
+        num_workers=num_workers or None,
+        batch_size=batch_size,
+    )
+    logging.info("Batch scoring completed.")
+
+    prediction_results.set_string_custom_property("model_uri", model.gca_resource.name)
+
+
 @component
 def datastore_prediction_writer(
     datastore_kind: Parameter[str],
@@ -225,3 +273,25 @@ def datastore_prediction_writer(
     logging.info(f"Storing predictions to Datastore kind: {datastore_kind}")
     etl.run_store_predictions_pipeline(pipeline_args)
     logging.info("Predictions are stored.")
+
+
+@component
+def fused_batch_prediction(
+    project: Parameter[str],
+    region: Parameter[str],
+    model_display_name: Parameter[str],
+    sql_query: Parameter[str],
+    datastore_kind: Parameter[str],
+    beam_args: Parameter[str],
+):
+
+    model = _get_latest_model(project, region, model_display_name)
+
+    pipeline_args = json.loads(beam_args)
+    pipeline_args["sql_query"] = sql_query
+    pipeline_args["model_dir"] = model.gca_resource.artifact_uri
+    pipeline_args["datastore_kind"] = datastore_kind
+
+    logging.info(f"Scoring the serving data with {model.gca_resource.name}...")
+    etl.run_fused_prediction_pipeline(pipeline_args)
+    logging.info(f"Predictions are stored to Datastore kind: {datastore_kind}")
@@ -106,9 +106,20 @@ BATCH_PREDICTION_JOB_RESOURCES = {
     "starting_replica_count": 1,
     "max_replica_count": 10,
 }
+# "vertex" submits a batch prediction job, "local" scores the data in the
+# pipeline step, which is enough for small and medium scoring runs. "fused"
+# scores the rows in the Beam pipeline that reads them, and writes the
+# predictions to Datastore, without materializing the serving data.
+BATCH_PREDICTION_RUNNERS = ("vertex", "local", "fused")
+BATCH_PREDICTION_RUNNER = os.getenv("BATCH_PREDICTION_RUNNER", "vertex")
+BATCH_PREDICTION_NUM_WORKERS = os.getenv("BATCH_PREDICTION_NUM_WORKERS", "0")
+BATCH_PREDICTION_BATCH_SIZE = os.getenv("BATCH_PREDICTION_BATCH_SIZE", "4096")
 DATASTORE_PREDICTION_KIND = f"{MODEL_DISPLAY_NAME}-predictions"
 
 ENABLE_CACHE = os.getenv("ENABLE_CACHE", "0")
+# Reuses tf.Transform analyzer accumulators of previously analyzed examples spans.
+# Only enable when a span's data does not change once generated.
+ENABLE_ANALYZER_CACHE = os.getenv("ENABLE_ANALYZER_CACHE", "0")
 UPLOAD_MODEL = os.getenv("UPLOAD_MODEL", "1")
 
 os.environ["PROJECT"] = PROJECT
@@ -31,17 +31,16 @@ from src.tfx_pipelines import components as custom_components
 from src.common import datasource_utils
 
 
-def create_pipeline(
-    pipeline_root: str,
-    metadata_connection_config: metadata_store_pb2.ConnectionConfig = None,
-):
+def _validate_batch_prediction_runner(runner):
+    if runner not in config.BATCH_PREDICTION_RUNNERS:
+        raise ValueError(
+            f"Invalid BATCH_PREDICTION_RUNNER {runner}. "
+            f"Supported runners: {config.BATCH_PREDICTION_RUNNERS}."
+        )
 
-    # Get source query.
-    sql_query = datasource_utils.get_serving_source_query(
-        bq_dataset_name=config.BATCH_PREDICTION_BQ_DATASET_NAME,
-        bq_table_name=config.BATCH_PREDICTION_BQ_TABLE_NAME,
-        limit=int(config.SERVE_LIMIT),
-    )
+
+def _create_staged_components(sql_query):
+    """Extracts the serving data to JSONL, scores it, then stores the predictions."""
 
     bigquery_data_gen = custom_components.bigquery_data_gen(
         sql_query=sql_query,
@@ -49,28 +48,68 @@ def create_pipeline(
         beam_args=json.dumps(config.BATCH_PREDICTION_BEAM_ARGS),
     )
 
-    vertex_batch_prediction = custom_components.vertex_batch_prediction(
-        project=config.PROJECT,
-        region=config.REGION,
-        model_display_name=config.MODEL_DISPLAY_NAME,
-        instances_format="jsonl",
-        predictions_format="jsonl",
-        job_resources=json.dumps(config.BATCH_PREDICTION_JOB_RESOURCES),
-        serving_dataset=bigquery_data_gen.outputs["serving_dataset"],
-    )
+    if config.BATCH_PREDICTION_RUNNER == "local":
+        batch_prediction = custom_components.local_batch_prediction(
+            project=config.PROJECT,
+            region=config.REGION,
+            model_display_name=config.MODEL_DISPLAY_NAME,
+            num_workers=int(config.BATCH_PREDICTION_NUM_WORKERS),
+            batch_size=int(config.BATCH_PREDICTION_BATCH_SIZE),
+            serving_dataset=bigquery_data_gen.outputs["serving_dataset"],
+        )
+    else:
+        batch_prediction = custom_components.vertex_batch_prediction(
+            project=config.PROJECT,
+            region=config.REGION,
+            model_display_name=config.MODEL_DISPLAY_NAME,
+            instances_format="jsonl",
+            predictions_format="jsonl",
+            job_resources=json.dumps(config.BATCH_PREDICTION_JOB_RESOURCES),
+            serving_dataset=bigquery_data_gen.outputs["serving_dataset"],
+        )
 
     datastore_prediction_writer = custom_components.datastore_prediction_writer(
         datastore_kind=config.DATASTORE_PREDICTION_KIND,
         predictions_format="jsonl",
         beam_args=json.dumps(config.BATCH_PREDICTION_BEAM_ARGS),
-        prediction_results=vertex_batch_prediction.outputs["prediction_results"],
+        prediction_results=batch_prediction.outputs["prediction_results"],
+    )
+
+    return [bigquery_data_gen, batch_prediction, datastore_prediction_writer]
+
+
+def _create_fused_components(sql_query):
+    """Scores the serving data in the Beam pipeline reading it."""
+
+    fused_batch_prediction = custom_components.fused_batch_prediction(
+        project=config.PROJECT,
+        region=config.REGION,
+        model_display_name=config.MODEL_DISPLAY_NAME,
+        sql_query=sql_query,
+        datastore_kind=config.DATASTORE_PREDICTION_KIND,
+        beam_args=json.dumps(config.BATCH_PREDICTION_BEAM_ARGS),
+    )
+    return [fused_batch_prediction]
+
+
+def create_pipeline(
+    pipeline_root: str,
+    metadata_connection_config: metadata_store_pb2.ConnectionConfig = None,
+):
+
+    _validate_batch_prediction_runner(config.BATCH_PREDICTION_RUNNER)
+
+    # Get source query.
+    sql_query = datasource_utils.get_serving_source_query(
+        bq_dataset_name=config.BATCH_PREDICTION_BQ_DATASET_NAME,
+        bq_table_name=config.BATCH_PREDICTION_BQ_TABLE_NAME,
+        limit=int(config.SERVE_LIMIT),
     )
 
-    pipeline_components = [
-        bigquery_data_gen,
-        vertex_batch_prediction,
-        datastore_prediction_writer,
-    ]
+    if config.BATCH_PREDICTION_RUNNER == "fused":
+        pipeline_components = _create_fused_components(sql_query)
+    else:
+        pipeline_components = _create_staged_components(sql_query)
 
     logging.info(
         f"Pipeline components: {[component.id for component in pipeline_components]}"
@@ -138,6 +138,16 @@ def create_pipeline(
         schema=schema_importer.outputs["result"],
     ).with_id("ExampleValidator")
 
+    # Get the latest analyzer cache, keyed by examples span, to skip
+    # re-analyzing unchanged spans.
+    analyzer_cache_resolver = Resolver(
+        strategy_class=latest_artifacts_resolver.LatestArtifactsResolver,
+        latest_analyzer_cache=Channel(type=standard_artifacts.TransformCache),
+    ).with_id("AnalyzerCacheResolver")
+    analyzer_cache = None
+    if int(config.ENABLE_ANALYZER_CACHE):
+        analyzer_cache = analyzer_cache_resolver.outputs["latest_analyzer_cache"]
+
     # Data transformation.
     transform = Transform(
         examples=train_example_gen.outputs["examples"],
@@ -148,6 +158,7 @@ def create_pipeline(
         splits_config=transform_pb2.SplitsConfig(
             analyze=["train"], transform=["train", "eval"]
         ),
+        analyzer_cache=analyzer_cache,
     ).with_id("DataTransformer")
 
     # Add dependency from example_validator to transform.
@@ -284,6 +295,9 @@ def create_pipeline(
         pusher,
     ]
 
+    if int(config.ENABLE_ANALYZER_CACHE):
+        pipeline_components.append(analyzer_cache_resolver)
+
     if int(config.UPLOAD_MODEL):
         pipeline_components.append(vertex_model_uploader)
         # Add dependency from pusher to aip_model_uploader.